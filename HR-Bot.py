@@ -1,27 +1,61 @@
+import asyncio
+import bisect
+import contextlib
+import csv
+import functools
+import gc
+import heapq
+import hmac
+import json
 import logging
+import operator
 import os
+import pickle
+import random
 import re
-from typing import Dict
+import secrets
+import signal
+import sqlite3
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
 
 # Устанавливаем зависимости:
 # pip install python-telegram-bot[job-queue] --pre
 # pip install pandas openpyxl python-dotenv
-import pandas as pd
+# pandas и openpyxl импортируются внутри функций выгрузки и старого Excel-хранилища:
+# бот запускается и принимает анкеты без них.
 from dotenv import load_dotenv
+import httpx
 from telegram import (
+    Bot,
     Update,
     ReplyKeyboardMarkup,
     KeyboardButton,
     ReplyKeyboardRemove,
 )
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from telegram.request import BaseRequest
 from telegram.ext import (
     Application,
+    BasePersistence,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     filters,
     ContextTypes,
     ConversationHandler,
-    PicklePersistence,
+    PersistenceInput,
 )
 
 # Включаем логирование
@@ -50,487 +84,4273 @@ load_dotenv()
     ADMIN_MENU,
     DELETE_ID,
     SEND_MESSAGE,
-) = range(13)
+    VIEW_ANKETS,
+    EXPORT_FORMAT,
+    EXPORT_FILTER,
+    SEARCH_QUERY,
+    VACANCY_EDIT,
+) = range(18)
 
 # Админ-IDs (используем set для быстрой проверки)
 ADMIN_IDS = {1481790360, 196597371}
 
-# Путь к файлу Excel
+# Выбор хранилища анкет: "sqlite" (по умолчанию) или "excel" (старый формат)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+
+# Путь к базе SQLite
+DB_FILE = os.getenv("DB_FILE", "hr_bot.db")
+
+# Путь к файлу Excel (старое хранилище и формат экспорта)
 EXCEL_FILE = "hr_responses.xlsx"
 
-# --- Функции для работы с Excel ---
+# Колонки таблицы анкет и соответствующие им ключи в user_data
+COLUMNS = ['ID пользователя', 'Опыт по категории Е', 'Гражданство', 'ФИО', 'Возраст', 'Город', 'Телефон']
+FIELDS = ('experience', 'citizenship', 'fio', 'age', 'city', 'phone')
+# Полная запись анкеты в хранилище
+RECORD_FIELDS = ('submission_id', 'user_id', *FIELDS, 'created_at')
+
+def make_record(user_id: int, data: Dict) -> Dict:
+    """Собирает запись анкеты с уникальным ID и временем подачи (UTC)."""
+    record = {field: data.get(field) for field in FIELDS}
+    record['submission_id'] = uuid.uuid4().hex
+    record['user_id'] = user_id
+    record['created_at'] = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    return record
+
+# --- Метрики ---
+
+# Границы корзин гистограмм времени, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in values
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Счетчик с метками в формате Prometheus."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def values(self) -> Dict[Tuple, float]:
+        """Копия значений по меткам (для сохранения)."""
+        return dict(self._values)
+
+    def restore(self, values: Dict[Tuple, float]):
+        """Продолжает счет с сохраненных значений (после перезапуска)."""
+        for labels, value in values.items():
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """Гистограмма с метками в формате Prometheus."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # метки -> [число наблюдений по корзинам (не накопленное)..., сумма, количество]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return series[-1] if series else 0
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labelnames + ("le",)
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(names, labels + ('+Inf',))} {series[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(series[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}"
+
+
+class MetricsRegistry:
+    """Набор метрик бота и их вывод в текстовом формате Prometheus.
+
+    Метрики изменяются только из event loop, поэтому обходятся без блокировок.
+    """
+
+    def __init__(self):
+        self._metrics: list = []
+        self._gauges: List[Tuple[str, str, Callable[[], float]]] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, func: Callable[[], float]):
+        """Показатель, значение которого вычисляется в момент выдачи метрик."""
+        self._gauges.append((name, help_text, func))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, help_text, func in self._gauges:
+            try:
+                value = func()
+            except Exception:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"]
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+HANDLER_SECONDS = metrics.histogram("hrbot_handler_seconds", "Время работы обработчика.", ("handler",))
+HANDLER_ERRORS = metrics.counter("hrbot_handler_errors_total", "Исключения в обработчиках.", ("handler",))
+STORAGE_SECONDS = metrics.histogram(
+    "hrbot_storage_seconds", "Время операции с хранилищем с учетом ожидания в очереди.", ("op", "func")
+)
+JOURNAL_APPEND_SECONDS = metrics.histogram("hrbot_journal_append_seconds", "Запись анкеты в журнал (с fsync).")
+FUNNEL_REACHED = metrics.counter(
+    "hrbot_funnel_reached_total", "Попытки заполнить анкету, дошедшие до шага (шаг считается раз за попытку).", ("step",)
+)
+FUNNEL_DROPOFFS = metrics.counter(
+    "hrbot_funnel_dropoffs_total", "Выходы из анкеты до отправки (в меню, /cancel, /start), по шагу.", ("step",)
+)
+VALIDATION_FAILURES = metrics.counter(
+    "hrbot_validation_failures_total", "Ответы, не прошедшие проверку, по шагу анкеты.", ("step",)
+)
+RESUBMISSIONS = metrics.counter("hrbot_resubmissions_total", "Повторные анкеты, заменившие прежнюю.")
+UPDATES_SHED = metrics.counter(
+    "hrbot_updates_shed_total", "Обновления, отброшенные без обработки, по причине (flood, overload).", ("reason",)
+)
+
+
+def timed_handler(callback):
+    """Оборачивает обработчик: время работы и исключения попадают в метрики."""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+    wrapper.timed = True
+    return wrapper
+
+
+def instrument_handlers(handler):
+    """Оборачивает все обработчики (в том числе внутри ConversationHandler) замером времени."""
+    if isinstance(handler, ConversationHandler):
+        nested = [*handler.entry_points, *handler.fallbacks]
+        for state_handlers in handler.states.values():
+            nested.extend(state_handlers)
+        for inner in nested:
+            instrument_handlers(inner)
+    elif not getattr(handler.callback, "timed", False):
+        handler.callback = timed_handler(handler.callback)
+
+# --- Хранилище анкет ---
+
+class ApplicantStore:
+    """Общий интерфейс хранилища анкет.
+
+    Строки возвращаются кортежами в порядке COLUMNS.
+    """
+
+    def init(self):
+        """Создает хранилище, если оно не существует."""
+        raise NotImplementedError
+
+    def add_many(self, records: List[Dict]) -> List[Dict]:
+        """Добавляет пачку анкет (записи из make_record); анкета с известным submission_id заменяет прежнюю.
+
+        Возвращает анкеты, которые не записаны: их пользователя удалили после приема анкеты.
+        """
+        raise NotImplementedError
+
+    def all(self) -> List[Tuple]:
+        """Возвращает все анкеты в порядке поступления."""
+        raise NotImplementedError
+
+    def records(self) -> List[Tuple]:
+        """Возвращает все анкеты полностью (порядок RECORD_FIELDS)."""
+        raise NotImplementedError
+
+    def page(self, after: int, limit: int) -> List[Tuple]:
+        """Возвращает до limit анкет после позиции after: (позиция, *строка COLUMNS)."""
+        raise NotImplementedError
+
+    def iter_rows(self) -> Iterator[Tuple]:
+        """Перебирает все анкеты, не загружая их в память целиком."""
+        return iter(self.all())
+
+    def delete_user(self, user_id: int) -> int:
+        """Удаляет все анкеты пользователя, возвращает число удаленных."""
+        raise NotImplementedError
+
+    def last_deletion(self) -> int:
+        """ID последнего удаления анкет (0, если хранилище удаления не учитывает)."""
+        return 0
+
+    def user_ids(self) -> List[int]:
+        """Возвращает ID всех пользователей, заполнивших анкету."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteDatabase:
+    """База SQLite с отдельным соединением на каждый поток.
+
+    Чтения из пула потоков идут параллельно с записью (WAL). В базу могут
+    писать несколько процессов-обработчиков: занятая другим процессом
+    запись ожидается до busy_timeout секунд, а не завершается ошибкой.
+    """
+
+    busy_timeout = 30
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def next_month(month: str) -> str:
+    """Следующий месяц в формате ГГГГ-ММ."""
+    year, number = map(int, month.split("-"))
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+
+
+class SQLiteStore(SQLiteDatabase, ApplicantStore):
+    """Хранилище в SQLite (WAL): добавление анкеты не зависит от размера таблицы.
+
+    Анкеты разбиты по месяцам подачи. Последние месяцы лежат в таблице
+    applicants — туда идут все записи. Старые месяцы (archive_before)
+    хранятся в applicant_archive по строке на месяц: столбцы анкет в JSON,
+    сжатом zlib. Чтение, выгрузка и удаление охватывают обе части.
+
+    При outbox=True каждая записанная анкета в той же транзакции ставится
+    в очередь applicant_outbox на отправку во внешнюю систему (OutboxSender).
+    """
+
+    def __init__(self, path: str, outbox: bool = False):
+        super().__init__(path)
+        self.outbox = outbox
+
+    def init(self):
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS applicants (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    experience TEXT,
+                    citizenship TEXT,
+                    fio TEXT,
+                    age INTEGER,
+                    city TEXT,
+                    phone TEXT,
+                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    submission_id TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_applicants_user_id ON applicants(user_id);
+                CREATE INDEX IF NOT EXISTS idx_applicants_phone ON applicants(phone);
+                CREATE INDEX IF NOT EXISTS idx_applicants_created ON applicants(created_at);
+                CREATE TABLE IF NOT EXISTS applicant_archive (
+                    month TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL,
+                    min_id INTEGER NOT NULL,
+                    max_id INTEGER NOT NULL,
+                    last_created TEXT NOT NULL,
+                    data BLOB NOT NULL
+                );
+                -- В каких архивных месяцах есть анкеты пользователя: удаление и замена без распаковки всего архива
+                CREATE TABLE IF NOT EXISTS applicant_archive_users (
+                    user_id INTEGER NOT NULL,
+                    month TEXT NOT NULL,
+                    PRIMARY KEY (user_id, month)
+                ) WITHOUT ROWID;
+                -- Удаления по ID пользователя: по ним другие процессы обновляют свои кэши
+                CREATE TABLE IF NOT EXISTS applicant_deletions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    deleted_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+                CREATE INDEX IF NOT EXISTS idx_deletions_user ON applicant_deletions(user_id);
+                -- Очередь анкет на отправку во внешнюю систему. Доставленные хранятся
+                -- OUTBOX_KEEP_DAYS: повтор журнала после сбоя не ставит их в очередь снова
+                CREATE TABLE IF NOT EXISTS applicant_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    submission_id TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    created_at TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    finished_at TEXT,
+                    UNIQUE (submission_id, created_at)
+                );
+                CREATE INDEX IF NOT EXISTS idx_outbox_status ON applicant_outbox(status, id);
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+            # Базы, созданные до появления submission_id
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(applicants)")}
+            if 'submission_id' not in columns:
+                self.conn.execute("ALTER TABLE applicants ADD COLUMN submission_id TEXT")
+                self.conn.execute(
+                    "UPDATE applicants SET submission_id = lower(hex(randomblob(16))) WHERE submission_id IS NULL"
+                )
+            self.conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_applicants_submission ON applicants(submission_id)"
+            )
+
+    def _insert(self, records: List[Dict]):
+        # Анкета с уже записанным submission_id (повторная подача или повтор
+        # журнала) заменяет прежнюю строку и становится последней
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO applicants "
+            "(submission_id, user_id, experience, citizenship, fio, age, city, phone, created_at) "
+            "VALUES (:submission_id, :user_id, :experience, :citizenship, :fio, :age, :city, :phone, :created_at)",
+            records
+        )
+        # Повторная анкета, прежний вариант которой уже в архиве, заменяет и его
+        if self.conn.execute("SELECT 1 FROM applicant_archive LIMIT 1").fetchone():
+            submission_ids = {record['submission_id'] for record in records}
+            self._archive_remove(
+                self._archive_months({record['user_id'] for record in records}),
+                lambda row: row[1] in submission_ids
+            )
+
+    # --- Архив по месяцам ---
+
+    @staticmethod
+    def _pack(rows: List[Tuple]) -> bytes:
+        # По столбцам: одинаковые значения (город, гражданство, опыт) идут подряд и хорошо сжимаются
+        columns = [list(column) for column in zip(*rows)]
+        return zlib.compress(json.dumps(columns, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 9)
+
+    @staticmethod
+    def _unpack(data: bytes) -> List[Tuple]:
+        return list(zip(*json.loads(zlib.decompress(data))))
+
+    def _partition(self, month: str) -> List[Tuple]:
+        """Анкеты архивного месяца: (id, *RECORD_FIELDS) по возрастанию id."""
+        row = self.conn.execute("SELECT data FROM applicant_archive WHERE month = ?", (month,)).fetchone()
+        return self._unpack(row[0]) if row else []
+
+    def _write_partition(self, month: str, rows: List[Tuple]):
+        self.conn.execute("DELETE FROM applicant_archive_users WHERE month = ?", (month,))
+        if not rows:
+            self.conn.execute("DELETE FROM applicant_archive WHERE month = ?", (month,))
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO applicant_archive (month, count, min_id, max_id, last_created, data) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (month, len(rows), rows[0][0], rows[-1][0], max(row[-1] for row in rows), self._pack(rows))
+        )
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO applicant_archive_users (user_id, month) VALUES (?, ?)",
+            ((user_id, month) for user_id in {row[2] for row in rows})
+        )
+
+    def _archive_months(self, user_ids) -> List[str]:
+        months = set()
+        for user_id in user_ids:
+            months.update(row[0] for row in self.conn.execute(
+                "SELECT month FROM applicant_archive_users WHERE user_id = ?", (user_id,)
+            ))
+        return sorted(months)
+
+    def _archive_remove(self, months: List[str], predicate: Callable[[Tuple], bool]) -> int:
+        """Удаляет из архивных месяцев анкеты, для которых predicate истинен."""
+        removed = 0
+        for month in months:
+            rows = self._partition(month)
+            kept = [row for row in rows if not predicate(row)]
+            if len(kept) != len(rows):
+                self._write_partition(month, kept)
+                removed += len(rows) - len(kept)
+        return removed
+
+    def archive_before(self, cutoff: str) -> int:
+        """Переносит в архив анкеты одного месяца, поданные до cutoff; возвращает их число.
+
+        Вызывается повторно, пока не вернет 0: каждый месяц — отдельная транзакция.
+        """
+        oldest = self.conn.execute(
+            "SELECT substr(created_at, 1, 7) FROM applicants WHERE created_at < ? ORDER BY created_at LIMIT 1", (cutoff,)
+        ).fetchone()
+        if oldest is None:
+            return 0
+        month = oldest[0]
+        end = min(cutoff, next_month(month))
+        with self.conn:
+            rows = self.conn.execute(
+                f"SELECT id, {', '.join(RECORD_FIELDS)} FROM applicants WHERE created_at >= ? AND created_at < ?",
+                (month, end)
+            ).fetchall()
+            # Месяц мог быть заархивирован раньше (например, анкеты из журнала после долгой остановки)
+            merged = sorted({row[1]: row for row in [*self._partition(month), *rows]}.values())
+            self._write_partition(month, merged)
+            self.conn.execute("DELETE FROM applicants WHERE created_at >= ? AND created_at < ?", (month, end))
+        return len(rows)
+
+    def purge_before(self, cutoff: str, limit: int) -> int:
+        """Удаляет до limit анкет, поданных до cutoff (или один архивный месяц); возвращает число удаленных.
+
+        Вызывается повторно, пока не вернет 0: каждая пачка — отдельная
+        транзакция, и запись новых анкет не ждет всей очистки.
+        """
+        with self.conn:
+            deleted = self.conn.execute(
+                "DELETE FROM applicants WHERE id IN (SELECT id FROM applicants WHERE created_at < ? LIMIT ?)",
+                (cutoff, limit)
+            ).rowcount
+            if deleted:
+                return deleted
+            # Старые месяцы удаляются целиком, месяц на границе срока — частично
+            row = self.conn.execute(
+                "SELECT month, count, last_created FROM applicant_archive WHERE month <= ? ORDER BY month LIMIT 1",
+                (cutoff[:7],)
+            ).fetchone()
+            if row is None:
+                return 0
+            month, count, last_created = row
+            if last_created < cutoff:
+                self._write_partition(month, [])
+                return count
+            return self._archive_remove([month], lambda r: r[-1] < cutoff)
+
+    def _split_deleted(self, records: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Делит анкеты на записываемые и отброшенные: пользователя удалили после приема анкеты.
+
+        В анкете хранится seen_deletion — ID последнего удаления на момент ее
+        приема (save_applicant). Удаление пользователя с большим ID записано
+        позже: анкета ждала в журнале другого процесса-обработчика (или в
+        журнале до перезапуска), пока админ удалял пользователя, и без проверки
+        вернулась бы при сбросе журнала. ID удалений строго растут, поэтому
+        анкета, принятая после удаления, не отбрасывается, даже если подана в
+        ту же секунду. Анкеты без seen_deletion (журнал прежней версии)
+        записываются как есть.
+        """
+        latest = {}
+        for user_id in {record['user_id'] for record in records if 'seen_deletion' in record}:
+            row = self.conn.execute(
+                "SELECT MAX(id) FROM applicant_deletions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row[0] is not None:
+                latest[user_id] = row[0]
+        if not latest:
+            return records, []
+        kept, dropped = [], []
+        for record in records:
+            deleted = latest.get(record['user_id'], 0)
+            (dropped if record.get('seen_deletion', deleted) < deleted else kept).append(record)
+        return kept, dropped
+
+    def add_many(self, records: List[Dict]) -> List[Dict]:
+        with self.conn:
+            records, dropped = self._split_deleted(records)
+            self._insert(records)
+            if self.outbox:
+                self._outbox_add(records)
+        if dropped:
+            logger.info(f"Не записано анкет, принятых до удаления пользователя: {len(dropped)}.")
+        return dropped
+
+    def last_deletion(self) -> int:
+        return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM applicant_deletions").fetchone()[0]
+
+    # --- Очередь отправки во внешнюю систему ---
+
+    def _outbox_add(self, records: List[Dict]):
+        # Повтор журнала дает ту же пару (submission_id, created_at) и в очередь не попадает;
+        # повторная анкета в ту же секунду заменяет еще не отправленную
+        self.conn.executemany(
+            "INSERT INTO applicant_outbox (submission_id, user_id, created_at, payload) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (submission_id, created_at) DO UPDATE SET payload = excluded.payload WHERE status = 'pending'",
+            (
+                (record['submission_id'], record['user_id'], record['created_at'],
+                 json.dumps({name: record[name] for name in RECORD_FIELDS}, ensure_ascii=False))
+                for record in records
+            )
+        )
+
+    def outbox_pending(self, limit: int) -> List[Tuple[int, str]]:
+        """Первые limit неотправленных анкет очереди: (id, JSON анкеты)."""
+        return self.conn.execute(
+            "SELECT id, payload FROM applicant_outbox WHERE status = 'pending' ORDER BY id LIMIT ?", (limit,)
+        ).fetchall()
+
+    def outbox_finish(self, ids: List[int], status: str, error: str = None):
+        """Отмечает анкеты очереди доставленными ('delivered') или отклоненными ('rejected')."""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE applicant_outbox SET status = ?, last_error = ?, attempts = attempts + 1, "
+                "finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+                ((status, error, outbox_id) for outbox_id in ids)
+            )
+
+    def outbox_retry(self, ids: List[int], error: str):
+        """Запоминает неудачную попытку: анкеты остаются в очереди."""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE applicant_outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?",
+                ((error, outbox_id) for outbox_id in ids)
+            )
+
+    def outbox_prune(self, before: str) -> int:
+        """Удаляет записи очереди, доставленные до before, возвращает их число."""
+        with self.conn:
+            return self.conn.execute(
+                "DELETE FROM applicant_outbox WHERE status = 'delivered' AND finished_at < ?", (before,)
+            ).rowcount
+
+    def _months(self) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT month FROM applicant_archive ORDER BY month")]
+
+    def all(self) -> List[Tuple]:
+        return list(self.iter_rows())
+
+    def records(self) -> List[Tuple]:
+        hot = self.conn.execute(f"SELECT id, {', '.join(RECORD_FIELDS)} FROM applicants ORDER BY id").fetchall()
+        # Месяцы архива и основная таблица сливаются по id — порядку поступления
+        merged = heapq.merge(*(self._partition(month) for month in self._months()), hot)
+        return [row[1:] for row in merged]
+
+    def iter_rows(self) -> Iterator[Tuple]:
+        # Архив — по месяцу за раз, поэтому память не зависит от размера истории
+        for month in self._months():
+            for row in self._partition(month):
+                yield row[2:9]
+        cursor = self.conn.execute(
+            "SELECT user_id, experience, citizenship, fio, age, city, phone FROM applicants ORDER BY id"
+        )
+        while True:
+            batch = cursor.fetchmany(1000)
+            if not batch:
+                break
+            yield from batch
+
+    def page(self, after: int, limit: int) -> List[Tuple]:
+        # Постраничный просмотр по ключу: стоимость не зависит от номера страницы
+        rows = self.conn.execute(
+            "SELECT id, user_id, experience, citizenship, fio, age, city, phone FROM applicants "
+            "WHERE id > ? ORDER BY id LIMIT ?",
+            (after, limit)
+        ).fetchall()
+        # Распаковываются только архивные месяцы, чьи id могут попасть на страницу
+        for min_id, month in self.conn.execute(
+            "SELECT min_id, month FROM applicant_archive WHERE max_id > ? ORDER BY min_id", (after,)
+        ).fetchall():
+            if len(rows) >= limit and min_id > rows[-1][0]:
+                break
+            rows.extend((row[0], *row[2:9]) for row in self._partition(month) if row[0] > after)
+            rows.sort(key=operator.itemgetter(0))
+            del rows[limit:]
+        return rows
+
+    def delete_user(self, user_id: int) -> int:
+        with self.conn:
+            deleted = self.conn.execute("DELETE FROM applicants WHERE user_id = ?", (user_id,)).rowcount
+            deleted += self._archive_remove(self._archive_months([user_id]), lambda row: row[2] == user_id)
+            # Анкеты удаленного пользователя, еще не отправленные во внешнюю систему, не отправляются
+            self.conn.execute("DELETE FROM applicant_outbox WHERE status = 'pending' AND user_id = ?", (user_id,))
+            if deleted:
+                self.conn.execute("INSERT INTO applicant_deletions (user_id) VALUES (?)", (user_id,))
+            return deleted
+
+    def user_ids(self) -> List[int]:
+        return [row[0] for row in self.conn.execute(
+            "SELECT user_id FROM applicants UNION SELECT user_id FROM applicant_archive_users"
+        )]
+
+    def positions(self) -> Tuple[int, int]:
+        """Последние ID анкет и удалений: с них начинается changes_after."""
+        return self.conn.execute(
+            "SELECT (SELECT COALESCE(MAX(id), 0) FROM applicants), (SELECT COALESCE(MAX(id), 0) FROM applicant_deletions)"
+        ).fetchone()
+
+    def changes_after(self, after: int, deleted_after: int) -> Tuple[List[Tuple], List[Tuple]]:
+        """Анкеты и удаления, записанные после данных позиций (в том числе другими процессами).
+
+        Анкеты — (id, *RECORD_FIELDS): новые и замененные (замена получает
+        новый id); удаления — (id, user_id). Оба запроса читают один снимок
+        базы (одна транзакция чтения), поэтому удаленные анкеты сюда уже не
+        попадают и удаления применяются первыми. Без общего снимка удаление,
+        записанное между запросами, пришло бы вместе с удаленной анкетой.
+        """
+        self.conn.execute("BEGIN")
+        try:
+            records = self.conn.execute(
+                f"SELECT id, {', '.join(RECORD_FIELDS)} FROM applicants WHERE id > ? ORDER BY id", (after,)
+            ).fetchall()
+            deletions = self.conn.execute(
+                "SELECT id, user_id FROM applicant_deletions WHERE id > ? ORDER BY id", (deleted_after,)
+            ).fetchall()
+        finally:
+            self.conn.commit()
+        return records, deletions
+
+    def migrate_from_excel(self, path: str):
+        """Однократно переносит анкеты из старого Excel-файла в базу.
+
+        Отметка о переносе ставится и при отсутствии файла, чтобы выгрузка
+        в файл с тем же именем не была повторно импортирована.
+        """
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'excel_migrated'").fetchone():
+            return
+
+        rows = []
+        if os.path.exists(path):
+            import openpyxl
+
+            # Читаем ячейки как есть через openpyxl: pandas превращает "+7999..." в число
+            workbook = openpyxl.load_workbook(path, read_only=True)
+            sheet_rows = workbook.active.iter_rows(values_only=True)
+            header = next(sheet_rows, ())
+            positions = [header.index(column) for column in COLUMNS]
+            for values in sheet_rows:
+                user_id, *rest = (values[pos] if pos < len(values) else None for pos in positions)
+                if user_id is None:
+                    continue
+                data = dict(zip(FIELDS, rest))
+                if data['age'] is not None:
+                    data['age'] = int(data['age'])
+                rows.append(make_record(int(user_id), data))
+            workbook.close()
+
+        with self.conn:
+            self._insert(rows)
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('excel_migrated', ?)", (path,))
+        if rows:
+            logger.info(f"Перенесено {len(rows)} анкет из {path} в {self.path}.")
+
+
+class ExcelStore(ApplicantStore):
+    """Старое хранилище в Excel: каждая запись перечитывает и переписывает весь файл.
+
+    pandas загружается при открытии хранилища, а не при импорте бота.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Файл не допускает параллельного чтения во время перезаписи
+        self._lock = threading.Lock()
+
+    def init(self):
+        import pandas as pd
+
+        if not os.path.exists(self.path):
+            pd.DataFrame(columns=COLUMNS).to_excel(self.path, index=False)
+            logger.info(f"Файл {self.path} создан.")
+
+    def _read(self):
+        import pandas as pd
+
+        return pd.read_excel(self.path)
+
+    def add_many(self, records: List[Dict]) -> List[Dict]:
+        # Файл не хранит submission_id, поэтому анкета пользователя, у которого
+        # уже есть строка, заменяет его последнюю строку (как повторная подача в SQLite)
+        latest = {record['user_id']: record for record in records}
+        new_rows = [
+            dict(zip(COLUMNS, (record['user_id'], *(record[field] for field in FIELDS))))
+            for record in latest.values()
+        ]
+        import pandas as pd
+
+        with self._lock:
+            df = self._read()
+            replaced = df[df['ID пользователя'].isin(latest)].groupby('ID пользователя').tail(1).index
+            df = pd.concat([df.drop(replaced), pd.DataFrame(new_rows)], ignore_index=True)
+            df.to_excel(self.path, index=False)
+        # Файл используется одним процессом, а удаление сначала сбрасывает журнал
+        return []
+
+    def all(self) -> List[Tuple]:
+        with self._lock:
+            df = self._read()
+        return list(df[COLUMNS].itertuples(index=False, name=None))
+
+    def records(self) -> List[Tuple]:
+        # В файле нет ID анкеты и времени подачи: ID выдаем при чтении
+        return [(uuid.uuid4().hex, *row, None) for row in self.all()]
+
+    def page(self, after: int, limit: int) -> List[Tuple]:
+        # Позиция — номер строки в файле, начиная с 1
+        rows = self.all()[after:after + limit]
+        return [(after + offset + 1, *row) for offset, row in enumerate(rows)]
+
+    def delete_user(self, user_id: int) -> int:
+        with self._lock:
+            df = self._read()
+            initial_count = len(df)
+            df = df[df['ID пользователя'] != user_id]
+            deleted = initial_count - len(df)
+            if deleted:
+                df.to_excel(self.path, index=False)
+        return deleted
+
+    def user_ids(self) -> List[int]:
+        with self._lock:
+            df = self._read()
+        return [int(user_id) for user_id in df['ID пользователя'].unique()]
+
+
+class Applicant:
+    """Компактная запись анкеты в кэше (без __dict__)."""
+
+    # seq — порядковый номер в кэше, задает порядок поступления в результатах поиска
+    __slots__ = RECORD_FIELDS + ('seq',)
+
+    def __init__(self, *values):
+        for name, value in zip(RECORD_FIELDS, values):
+            setattr(self, name, value)
+        self.seq = 0
+
+    @classmethod
+    def from_record(cls, record: Dict) -> 'Applicant':
+        return cls(*(record.get(name) for name in RECORD_FIELDS))
+
+    def row(self) -> Tuple:
+        """Строка в порядке COLUMNS."""
+        return (self.user_id, self.experience, self.citizenship, self.fio, self.age, self.city, self.phone)
+
+
+class ApplicantQuery(NamedTuple):
+    """Условия поиска анкет; None — условие не задано."""
+    city: Optional[str] = None
+    citizenship: Optional[str] = None
+    experience: Optional[str] = None
+    age_min: Optional[int] = None
+    age_max: Optional[int] = None
+    # Дни подачи (UTC) в формате ГГГГ-ММ-ДД, включительно
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    # Префиксы слов ФИО и цифр телефона
+    fio: Optional[str] = None
+    phone: Optional[str] = None
+
+
+def normalize_text(value) -> str:
+    return str(value).strip().casefold().replace("ё", "е")
+
+# Для полей с малым числом различных значений (город, гражданство, опыт)
+normalize_choice = functools.lru_cache(maxsize=4096)(normalize_text)
+
+def phone_digits(value) -> str:
+    return re.sub(r"\D", "", str(value))
+
+def normalize_phone(value) -> str:
+    """Цифры номера с кодом страны: 8XXXXXXXXXX, +7XXXXXXXXXX и 9XXXXXXXXX дают один ключ."""
+    digits = phone_digits(value)
+    if digits.startswith('8'):
+        return '7' + digits[1:]
+    if len(digits) == 10 and digits.startswith('9'):
+        return '7' + digits
+    return digits
+
+def normalize_fio(value) -> str:
+    return " ".join(normalize_text(value).split())
+
+# Индексы на равенство, ключи для них дает exact_keys()
+EXACT_INDEXES = ('city', 'citizenship', 'experience', 'age', 'day')
+CHOICE_FIELDS = ('city', 'citizenship', 'experience')
+
+def exact_keys(applicant: 'Applicant') -> Tuple:
+    """Ключи анкеты в индексах EXACT_INDEXES (None — не индексировать)."""
+    return (
+        normalize_choice(applicant.city) if applicant.city is not None else None,
+        normalize_choice(applicant.citizenship) if applicant.citizenship is not None else None,
+        normalize_choice(applicant.experience) if applicant.experience is not None else None,
+        applicant.age if isinstance(applicant.age, int) else None,
+        applicant.created_at[:10] if applicant.created_at else None,
+    )
+
+_seq_of = operator.attrgetter('seq')
+
+# Во сколько раз диапазон индекса по префиксу может превышать число проверяемых
+# анкет, чтобы проверку все еще выгодно было делать через множество
+PREFIX_SET_RATIO = 30
+
+
+class ApplicantCache:
+    """Все анкеты в памяти процесса с индексами для поиска.
+
+    Загружается из хранилища при запуске и обновляется при каждом приеме
+    и удалении анкеты, поэтому поиск, удаление и список получателей
+    рассылки не обращаются к диску. Используется только из event loop.
+
+    Вторичные индексы: по значению (город, гражданство, опыт, возраст, день
+    подачи) — списки анкет в порядке поступления; по началу слов ФИО и цифр
+    телефона — отсортированные ключи с параллельным списком анкет. Поиск
+    берет самый узкий индекс и проверяет остальные условия только на нем.
+
+    Индексы личности — по ID пользователя, нормализованному телефону и ФИО —
+    находят прежнюю анкету при повторной подаче и возможные дубли.
+    """
+
+    def __init__(self):
+        self._records: Dict[str, Applicant] = {}
+        self._by_user: Dict[int, List[str]] = {}
+        self._by_phone: Dict[str, List[str]] = {}
+        self._by_fio: Dict[str, List[str]] = {}
+        # Ключи индексов личности, под которыми больше одной анкеты: (индекс, ключ)
+        self._duplicates: Set[Tuple[str, object]] = set()
+        self._exact: Dict[str, Dict[object, List[Applicant]]] = {name: {} for name in EXACT_INDEXES}
+        # Исходные написания значений для каждого ключа (город, гражданство, опыт):
+        # проверка условия — поиск в множестве, без нормализации каждой анкеты
+        self._variants: Dict[str, Dict[str, Set[str]]] = {name: {} for name in CHOICE_FIELDS}
+        # Дни подачи по возрастанию, для поиска по диапазону дат
+        self._days: List[str] = []
+        self._fio_keys: List[str] = []
+        self._fio_entries: List[Applicant] = []
+        self._phone_keys: List[str] = []
+        self._phone_entries: List[Applicant] = []
+        self._seq = 0
+
+    def load(self, rows: List[Tuple]):
+        self.__init__()
+        fio, phones = [], []
+        # Сборщик мусора на каждой тысяче новых объектов обходил бы весь растущий кэш
+        gc.disable()
+        try:
+            for values in rows:
+                applicant = Applicant(*values)
+                self._register(applicant)
+                # Индексы по префиксам строим одной сортировкой, а не вставками
+                fio.extend((key, applicant.seq, applicant) for key in self._fio_words(applicant))
+                if applicant.phone:
+                    phones.append((normalize_phone(applicant.phone), applicant.seq, applicant))
+            # seq уникален, поэтому до сравнения самих анкет дело не доходит
+            fio.sort()
+            phones.sort()
+        finally:
+            gc.enable()
+        self._fio_keys = [entry[0] for entry in fio]
+        self._fio_entries = [entry[2] for entry in fio]
+        self._phone_keys = [entry[0] for entry in phones]
+        self._phone_entries = [entry[2] for entry in phones]
+
+    def _register(self, applicant: Applicant):
+        """Добавляет анкету во все индексы, кроме индексов по префиксам."""
+        # Повторяющиеся значения (город, гражданство, опыт) храним одним объектом
+        for name in CHOICE_FIELDS:
+            value = getattr(applicant, name)
+            if isinstance(value, str):
+                setattr(applicant, name, sys.intern(value))
+        self._seq += 1
+        applicant.seq = self._seq
+        submission_id = applicant.submission_id
+        self._records[submission_id] = applicant
+        for name, index, key in self._identity_keys(applicant):
+            ids = index.setdefault(key, [])
+            ids.append(submission_id)
+            if len(ids) == 2:
+                self._duplicates.add((name, key))
+        for name, key in zip(EXACT_INDEXES, exact_keys(applicant)):
+            if key is None:
+                continue
+            index = self._exact[name]
+            if name == 'day' and key not in index:
+                bisect.insort(self._days, key)
+            index.setdefault(key, []).append(applicant)
+            if name in self._variants:
+                self._variants[name].setdefault(key, set()).add(getattr(applicant, name))
+
+    def _identity_keys(self, applicant: Applicant) -> Iterator[Tuple[str, Dict, object]]:
+        """Индексы личности анкеты: (имя индекса, индекс, ключ)."""
+        yield 'user', self._by_user, applicant.user_id
+        if applicant.phone:
+            yield 'phone', self._by_phone, normalize_phone(applicant.phone)
+        if applicant.fio:
+            yield 'fio', self._by_fio, normalize_fio(applicant.fio)
+
+    @staticmethod
+    def _fio_words(applicant: Applicant) -> set:
+        if not applicant.fio:
+            return set()
+        return {sys.intern(word) for word in normalize_text(applicant.fio).split()}
+
+    def add(self, record: Dict):
+        """Добавляет анкету; анкета с уже известным submission_id заменяет прежнюю."""
+        previous = self._records.get(record['submission_id'])
+        if previous is not None:
+            self._remove(previous)
+        applicant = Applicant.from_record(record)
+        self._register(applicant)
+        for key in self._fio_words(applicant):
+            self._insert_prefix(self._fio_keys, self._fio_entries, key, applicant)
+        if applicant.phone:
+            self._insert_prefix(self._phone_keys, self._phone_entries, normalize_phone(applicant.phone), applicant)
+
+    @staticmethod
+    def _insert_prefix(keys: List[str], entries: List[Applicant], key: str, applicant: Applicant):
+        # Новая анкета — самая поздняя, поэтому встает в конец своего ключа
+        position = bisect.bisect_right(keys, key)
+        keys.insert(position, key)
+        entries.insert(position, applicant)
+
+    @staticmethod
+    def _remove_prefix(keys: List[str], entries: List[Applicant], key: str, applicant: Applicant):
+        low = bisect.bisect_left(keys, key)
+        high = bisect.bisect_right(keys, key, low)
+        position = bisect.bisect_left(entries, applicant.seq, low, high, key=_seq_of)
+        if position < high and entries[position] is applicant:
+            del keys[position]
+            del entries[position]
+
+    def _remove(self, applicant: Applicant):
+        submission_id = applicant.submission_id
+        del self._records[submission_id]
+        for name, index, key in self._identity_keys(applicant):
+            ids = index[key]
+            ids.remove(submission_id)
+            if len(ids) == 1:
+                self._duplicates.discard((name, key))
+            elif not ids:
+                del index[key]
+        for name, key in zip(EXACT_INDEXES, exact_keys(applicant)):
+            bucket = self._exact[name].get(key)
+            if bucket is None:
+                continue
+            position = bisect.bisect_left(bucket, applicant.seq, key=_seq_of)
+            if position < len(bucket) and bucket[position] is applicant:
+                del bucket[position]
+            if not bucket:
+                del self._exact[name][key]
+                if name == 'day':
+                    self._days.remove(key)
+        for key in self._fio_words(applicant):
+            self._remove_prefix(self._fio_keys, self._fio_entries, key, applicant)
+        if applicant.phone:
+            self._remove_prefix(self._phone_keys, self._phone_entries, normalize_phone(applicant.phone), applicant)
+
+    def discard(self, record: Dict) -> bool:
+        """Удаляет анкету, если в кэше именно эта ее версия, а не более поздняя с тем же submission_id."""
+        applicant = self._records.get(record['submission_id'])
+        if applicant is None or any(getattr(applicant, name) != record.get(name) for name in RECORD_FIELDS):
+            return False
+        self._remove(applicant)
+        return True
+
+    def delete_user(self, user_id: int) -> int:
+        submission_ids = list(self._by_user.get(user_id, ()))
+        for submission_id in submission_ids:
+            self._remove(self._records[submission_id])
+        return len(submission_ids)
+
+    def expire(self, before: str, limit: int) -> int:
+        """Удаляет до limit анкет, поданных раньше дня before (ГГГГ-ММ-ДД); возвращает их число."""
+        removed = 0
+        while self._days and self._days[0] < before and removed < limit:
+            # _remove убирает анкету из списка дня и сам день, когда список пуст
+            for applicant in self._exact['day'][self._days[0]][:limit - removed]:
+                self._remove(applicant)
+                removed += 1
+        return removed
+
+    def by_user(self, user_id: int) -> List[Applicant]:
+        return [self._records[submission_id] for submission_id in self._by_user.get(user_id, ())]
+
+    def by_phone(self, phone: str) -> List[Applicant]:
+        return [self._records[submission_id] for submission_id in self._by_phone.get(normalize_phone(phone), ())]
+
+    def counts(self, name: str) -> Dict[object, int]:
+        """Число анкет по значениям индекса name из EXACT_INDEXES.
+
+        Для города, гражданства и опыта ключ — значение в исходном написании.
+        """
+        variants = self._variants.get(name)
+        return {
+            (min(variants[key]) if variants else key): len(bucket)
+            for key, bucket in self._exact[name].items()
+        }
+
+    def user_count(self) -> int:
+        return len(self._by_user)
+
+    def submission_id(self, user_id: int) -> Optional[str]:
+        """ID последней анкеты пользователя: повторная подача заменяет ее."""
+        submission_ids = self._by_user.get(user_id)
+        return submission_ids[-1] if submission_ids else None
+
+    def duplicates(self) -> List[Tuple[str, object, List[Applicant]]]:
+        """Возможные дубли: (индекс, ключ, анкеты) по ID пользователя, телефону и ФИО.
+
+        Совпадения телефона или ФИО в анкетах одного пользователя не
+        повторяются: они уже видны в группе этого пользователя.
+        """
+        index_by_name = {'user': self._by_user, 'phone': self._by_phone, 'fio': self._by_fio}
+        groups = []
+        for name, key in sorted(self._duplicates):
+            applicants = [self._records[submission_id] for submission_id in index_by_name[name][key]]
+            if name != 'user' and len({applicant.user_id for applicant in applicants}) < 2:
+                continue
+            groups.append((name, key, applicants))
+        return groups
+
+    @staticmethod
+    def _prefix_range(keys: List[str], prefix: str) -> Tuple[int, int]:
+        return bisect.bisect_left(keys, prefix), bisect.bisect_left(keys, prefix + "\U0010ffff")
+
+    @staticmethod
+    def _prefix_condition(entries: List[Applicant], low: int, high: int, matches: Callable[[Applicant], bool]) -> Tuple:
+        def make_check(count: int) -> Callable[[Applicant], bool]:
+            # Множество анкет из диапазона строится в десятки раз быстрее, чем
+            # нормализуется ФИО или телефон одной анкеты: выгодно, если проверять много
+            if high - low < PREFIX_SET_RATIO * count:
+                return set(entries[low:high]).__contains__
+            return matches
+        return high - low, lambda: entries[low:high], False, make_check
+
+    def search(self, query: ApplicantQuery) -> List[Applicant]:
+        """Анкеты, подходящие под все условия запроса, в порядке поступления."""
+        # Каждое условие: (оценка числа анкет, получение анкет, уже упорядочены,
+        # построение проверки анкеты по числу проверяемых)
+        conditions = []
+        for name in ('city', 'citizenship', 'experience'):
+            value = getattr(query, name)
+            if value is None:
+                continue
+            key = normalize_choice(value)
+            bucket = self._exact[name].get(key, [])
+            variants = self._variants[name].get(key, set())
+            conditions.append((
+                len(bucket), lambda bucket=bucket: bucket, True,
+                lambda count, get=operator.attrgetter(name), variants=variants: lambda a: get(a) in variants,
+            ))
+        if query.age_min is not None or query.age_max is not None:
+            low = query.age_min if query.age_min is not None else float('-inf')
+            high = query.age_max if query.age_max is not None else float('inf')
+            buckets = [bucket for age, bucket in self._exact['age'].items() if low <= age <= high]
+            conditions.append((
+                sum(map(len, buckets)), lambda buckets=buckets: [a for bucket in buckets for a in bucket], False,
+                lambda count: lambda a: isinstance(a.age, int) and low <= a.age <= high,
+            ))
+        if query.date_from is not None or query.date_to is not None:
+            first = bisect.bisect_left(self._days, query.date_from) if query.date_from else 0
+            last = bisect.bisect_right(self._days, query.date_to) if query.date_to else len(self._days)
+            buckets = [self._exact['day'][day] for day in self._days[first:last]]
+            date_from, date_to = query.date_from or "", query.date_to or "\uffff"
+            conditions.append((
+                sum(map(len, buckets)), lambda buckets=buckets: [a for bucket in buckets for a in bucket], False,
+                lambda count: lambda a: bool(a.created_at) and date_from <= a.created_at[:10] <= date_to,
+            ))
+        for word in (normalize_text(query.fio).split() if query.fio else ()):
+            low, high = self._prefix_range(self._fio_keys, word)
+            conditions.append(self._prefix_condition(
+                self._fio_entries, low, high,
+                lambda a, word=word: bool(a.fio) and any(w.startswith(word) for w in normalize_text(a.fio).split()),
+            ))
+        if query.phone:
+            digits = normalize_phone(query.phone)
+            low, high = self._prefix_range(self._phone_keys, digits)
+            conditions.append(self._prefix_condition(
+                self._phone_entries, low, high,
+                lambda a: bool(a.phone) and normalize_phone(a.phone).startswith(digits),
+            ))
+
+        if not conditions:
+            return list(self._records.values())
+        # Перебираем только самый узкий индекс, остальные условия проверяем на его анкетах
+        conditions.sort(key=lambda condition: condition[0])
+        _, candidates, ordered, _ = conditions[0]
+        found = candidates()
+        for _, _, _, make_check in conditions[1:]:
+            check = make_check(len(found))
+            found = [a for a in found if check(a)]
+        if ordered:
+            # Без других условий это сам список индекса — отдаем копию
+            return list(found)
+        # Из нескольких корзин или индекса по префиксу: убираем повторы и упорядочиваем
+        unique = {a.seq: a for a in found}
+        return [unique[seq] for seq in sorted(unique)]
+
+    def search_user_ids(self, query: ApplicantQuery) -> List[int]:
+        """ID пользователей из результатов поиска, без повторов (для рассылки)."""
+        return list(dict.fromkeys(applicant.user_id for applicant in self.search(query)))
+
+    def user_ids(self) -> List[int]:
+        """ID всех пользователей, заполнивших анкету, без повторов."""
+        return list(self._by_user)
+
+    def rows(self) -> List[Tuple]:
+        """Все анкеты в порядке поступления (порядок COLUMNS)."""
+        return [applicant.row() for applicant in self._records.values()]
+
+    def __len__(self):
+        return len(self._records)
+
+    def memory_usage(self) -> int:
+        """Приблизительный объем памяти кэша в байтах (записи, значения и индексы)."""
+        seen = set()
+
+        def size(obj):
+            # Общие объекты (интернированные строки, малые числа) считаем один раз
+            if id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+            return sys.getsizeof(obj)
+
+        total = size(self._records) + size(self._duplicates)
+        for applicant in self._records.values():
+            total += size(applicant)
+            total += sum(size(getattr(applicant, name)) for name in Applicant.__slots__)
+        for index in (self._by_user, self._by_phone, self._by_fio, *self._exact.values()):
+            total += size(index)
+            for key, ids in index.items():
+                total += size(key) + size(ids)
+        for keys, entries in ((self._fio_keys, self._fio_entries), (self._phone_keys, self._phone_entries)):
+            total += size(keys) + size(entries) + sum(size(key) for key in keys)
+        return total
+
+
+class KeyedLock:
+    """Набор asyncio.Lock по ключу (например, по ID пользователя).
+
+    Замок создается при первом обращении и удаляется, когда его никто не
+    держит и не ждет, поэтому память не растет с числом пользователей.
+    Ожидающие получают замок в порядке очереди.
+    """
+
+    def __init__(self):
+        # ключ -> [замок, число держащих и ожидающих]
+        self._locks: Dict[object, list] = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class StorageExecutor:
+    """Выполняет операции с хранилищем вне event loop.
+
+    Все записи идут через единственный поток-писатель и выполняются строго
+    по очереди, чтения выполняются параллельно в отдельном пуле потоков.
+    """
+
+    def __init__(self, read_workers: int = 4):
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage-writer")
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="storage-reader")
+
+    async def read(self, func, *args):
+        loop = asyncio.get_running_loop()
+        with STORAGE_SECONDS.time("read", func.__name__):
+            return await loop.run_in_executor(self._readers, functools.partial(func, *args))
+
+    async def write(self, func, *args):
+        loop = asyncio.get_running_loop()
+        with STORAGE_SECONDS.time("write", func.__name__):
+            return await loop.run_in_executor(self._writer, functools.partial(func, *args))
+
+    def shutdown(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+
+
+class SubmissionJournal:
+    """Журнал принятых анкет для отложенной пакетной записи в хранилище.
+
+    Анкета дописывается в файл журнала с fsync и только после этого
+    подтверждается пользователю. Накопленные анкеты переносятся в хранилище
+    одной пачкой; перед этим журнал переименовывается в *.flushing, чтобы
+    новые анкеты писались в свежий файл. После падения оба файла
+    повторяются при запуске (replay).
+    """
+
+    def __init__(self, path: str, batch_size: int):
+        self.path = path
+        self.flushing_path = path + ".flushing"
+        self.batch_size = batch_size
+        # Все операции с файлом и очередью выполняются в одном потоке по порядку
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        self._file = None
+        self._pending: List[Dict] = []
+        self._flushing: Optional[List[Dict]] = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+
+    def replay(self) -> int:
+        """Переносит в хранилище анкеты, оставшиеся в журнале после остановки."""
+        records = []
+        for path in (self.flushing_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Недописанная последняя строка при падении во время записи
+                        logger.warning(f"Пропущена поврежденная запись журнала {path}.")
+        if records:
+            store.add_many(records)
+        for path in (self.flushing_path, self.path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        if records:
+            logger.info(f"Из журнала восстановлено анкет: {len(records)}.")
+        return len(records)
+
+    def _append(self, record: Dict) -> int:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending.append(record)
+        return len(self._pending)
+
+    async def append(self, record: Dict):
+        """Надежно записывает анкету в журнал; по заполнении пачки запускает сброс."""
+        loop = asyncio.get_running_loop()
+        with JOURNAL_APPEND_SECONDS.time():
+            pending = await loop.run_in_executor(self._executor, self._append, record)
+        if pending >= self.batch_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush_logged())
+
+    def _rotate(self) -> Optional[List[Dict]]:
+        if not self._pending:
+            return None
+        self._file.close()
+        os.replace(self.path, self.flushing_path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        batch, self._pending = self._pending, []
+        return batch
+
+    async def flush(self) -> int:
+        """Записывает накопленные анкеты в хранилище одной пачкой."""
+        loop = asyncio.get_running_loop()
+        async with self._flush_lock:
+            # Пачка, которую не удалось записать в прошлый раз, повторяется первой
+            if self._flushing is None:
+                self._flushing = await loop.run_in_executor(self._executor, self._rotate)
+            if not self._flushing:
+                self._flushing = None
+                return 0
+            dropped = await storage.write(store.add_many, self._flushing)
+            await loop.run_in_executor(self._executor, os.remove, self.flushing_path)
+            # Отброшенные анкеты удаленных пользователей не остаются в кэше
+            for record in dropped:
+                cache.discard(record)
+            count, self._flushing = len(self._flushing), None
+            return count
+
+    async def flush_logged(self):
+        """Сброс в фоне: ошибка логируется, анкеты остаются в журнале до следующего сброса."""
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Ошибка при записи анкет из журнала: {e}")
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# Число потоков для параллельного чтения из хранилища
+STORAGE_READ_WORKERS = int(os.getenv("STORAGE_READ_WORKERS", "4"))
+
+# Журнал анкет: сброс в хранилище каждые JOURNAL_BATCH_SIZE анкет или JOURNAL_FLUSH_INTERVAL секунд
+JOURNAL_FILE = os.getenv("JOURNAL_FILE", "submissions.journal")
+JOURNAL_BATCH_SIZE = int(os.getenv("JOURNAL_BATCH_SIZE", "50"))
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", "5"))
+
+# Как часто процесс-обработчик подхватывает анкеты и удаления из других процессов, секунды
+CACHE_SYNC_INTERVAL = float(os.getenv("CACHE_SYNC_INTERVAL", "1"))
+
+store: ApplicantStore = None
+storage: StorageExecutor = None
+journal: SubmissionJournal = None
+cache = ApplicantCache()
+# Позиции (ID анкеты, ID удаления), до которых кэш согласован с базой (sync_cache)
+sync_positions: Tuple[int, int] = (0, 0)
+# Замки по ID пользователя: прием и удаление анкет одного пользователя не пересекаются
+applicant_locks = KeyedLock()
+
+metrics.gauge("hrbot_applicants", "Анкет в базе (по кэшу).", lambda: len(cache))
+metrics.gauge("hrbot_journal_pending", "Анкет в журнале, еще не записанных в хранилище.", lambda: journal.pending())
+
+def create_store() -> ApplicantStore:
+    """Создает хранилище согласно STORAGE_BACKEND."""
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteStore(DB_FILE, outbox=bool(OUTBOX_URL))
+    if STORAGE_BACKEND == "excel":
+        if OUTBOX_URL:
+            raise ValueError("OUTBOX_URL требует STORAGE_BACKEND=sqlite: очередь отправки хранится в базе.")
+        return ExcelStore(EXCEL_FILE)
+    raise ValueError(f"Неизвестное хранилище STORAGE_BACKEND={STORAGE_BACKEND!r}.")
+
+def init_storage():
+    """Открывает хранилище, переносит старый Excel-файл, повторяет журнал анкет и загружает вакансии."""
+    global store, storage, journal, broadcasts, persistence, stats, sync_positions
+    store = create_store()
+    store.init()
+    if isinstance(store, SQLiteStore):
+        store.migrate_from_excel(EXCEL_FILE)
+    storage = StorageExecutor(STORAGE_READ_WORKERS)
+    journal = SubmissionJournal(JOURNAL_FILE, JOURNAL_BATCH_SIZE)
+    journal.replay()
+    if worker_index is not None:
+        # До загрузки: записанное во время нее подхватит sync_cache (повтор анкеты безвреден)
+        sync_positions = store.positions()
+    cache.load(store.records())
+    logger.info(f"Кэш анкет: {len(cache)} записей, ~{cache.memory_usage() / 1024 / 1024:.1f} МБ.")
+    broadcasts = BroadcastStore(DB_FILE)
+    broadcasts.init()
+    persistence = SQLitePersistence(DB_FILE, PERSISTENCE_TTL_DAYS, PERSISTENCE_UPDATE_INTERVAL)
+    persistence.init()
+    persistence.migrate_from_pickle(PICKLE_PERSISTENCE_FILE)
+    persistence.evict_expired()
+    stats = StatsStore(DB_FILE)
+    stats.init()
+    restore_counters()
+    vacancies.load()
+
+async def flush_journal(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически переносит анкеты из журнала в хранилище."""
+    await journal.flush_logged()
+
+async def sync_cache(context: ContextTypes.DEFAULT_TYPE):
+    """Переносит в кэш анкеты и удаления, записанные другими процессами-обработчиками.
+
+    Кэш обработчика отстает от других процессов на время до сброса их
+    журнала плюс CACHE_SYNC_INTERVAL. Свои анкеты тоже перечитываются:
+    удаление, пришедшее от админа из другого процесса, могло убрать из кэша
+    анкету, принятую здесь позже.
+    """
+    global sync_positions
+    try:
+        records, deletions = await storage.read(store.changes_after, *sync_positions)
+    except Exception as e:
+        logger.error(f"Ошибка при чтении изменений анкет: {e}")
+        return
+    for _, user_id in deletions:
+        cache.delete_user(user_id)
+    for row in records:
+        cache.add(dict(zip(RECORD_FIELDS, row[1:])))
+    sync_positions = (
+        records[-1][0] if records else sync_positions[0],
+        deletions[-1][0] if deletions else sync_positions[1],
+    )
+
+def release_storage():
+    """Закрывает хранилище и базы без сброса журнала (журнал повторится при запуске)."""
+    journal.close()
+    storage.shutdown()
+    store.close()
+    broadcasts.close()
+    persistence.close()
+    stats.close()
+
+async def close_storage(application: Application):
+    """Сбрасывает журнал, дожидается операций с хранилищем и закрывает его."""
+    await journal.flush_logged()
+    await save_counters()
+    release_storage()
+
+async def save_applicant(user_id: int, data: Dict):
+    """Принимает анкету: записывает ее в журнал, в хранилище она попадет пачкой.
+
+    Исключение пробрасывается, чтобы анкета не терялась молча.
+    """
+    async with applicant_locks.hold(user_id):
+        # Под замком: удаление, которое ждало замка, уже записано, и анкета,
+        # принятая после него, не будет отброшена при сбросе журнала
+        record = make_record(user_id, data)
+        record['seen_deletion'] = await storage.read(store.last_deletion)
+        # Повторная анкета пользователя заменяет прежнюю, а не добавляется
+        previous = cache.submission_id(user_id)
+        if previous is not None:
+            record['submission_id'] = previous
+        await journal.append(record)
+        cache.add(record)
+    if previous is not None:
+        RESUBMISSIONS.inc()
+        logger.info(f"Анкета пользователя {user_id} обновлена.")
+    else:
+        logger.info(f"Анкета пользователя {user_id} принята.")
+
+def export_applicants(path: str, fmt: str = "xlsx", predicate: Callable[[Tuple], bool] = None) -> int:
+    """Потоково выгружает анкеты в XLSX или CSV, возвращает число строк.
+
+    Строки идут из хранилища генератором и сразу пишутся в файл
+    (openpyxl в режиме write-only), поэтому память не растет с числом анкет.
+    """
+    rows = store.iter_rows()
+    if predicate is not None:
+        rows = filter(predicate, rows)
+
+    count = 0
+    if fmt == "csv":
+        # utf-8-sig, чтобы Excel правильно открывал кириллицу
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    else:
+        import openpyxl
+
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet("Анкеты")
+        sheet.append(COLUMNS)
+        for row in rows:
+            sheet.append(row)
+            count += 1
+        workbook.save(path)
+    return count
+
+def export_to_excel(path: str = EXCEL_FILE):
+    """Выгружает все анкеты в Excel-файл."""
+    count = export_applicants(path, "xlsx")
+    logger.info(f"Выгружено {count} анкет в {path}.")
+
+
+# --- Архив и срок хранения анкет ---
+
+# Сколько последних месяцев подачи (включая текущий) остается в основной
+# таблице; более ранние сжимаются в архив. 0 — не архивировать
+ARCHIVE_HOT_MONTHS = int(os.getenv("ARCHIVE_HOT_MONTHS", "2"))
+# Анкеты, поданные раньше чем столько дней назад, удаляются; 0 — хранить бессрочно
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+# Анкет в одной транзакции удаления (и в одном шаге очистки кэша)
+RETENTION_BATCH_SIZE = 1000
+# Как часто проверять архив и срок хранения, секунды
+ARCHIVE_CHECK_INTERVAL = float(os.getenv("ARCHIVE_CHECK_INTERVAL", "3600"))
+
+def archive_cutoff() -> str:
+    """Первый месяц (ГГГГ-ММ), который остается в основной таблице."""
+    today = datetime.now(timezone.utc)
+    index = today.year * 12 + today.month - ARCHIVE_HOT_MONTHS
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+def retention_cutoff() -> str:
+    """Первый день (ГГГГ-ММ-ДД), анкеты которого еще хранятся."""
+    return (datetime.now(timezone.utc) - timedelta(days=RETENTION_DAYS)).strftime("%Y-%m-%d")
+
+async def maintain_archive(context: ContextTypes.DEFAULT_TYPE):
+    """Удаляет анкеты старше RETENTION_DAYS и переносит старые месяцы в архив.
+
+    Кэш очищается в каждом процессе по тому же сроку, база — в одном
+    (в первом обработчике при BOT_WORKERS > 1). Удаление идет пачками:
+    прием анкет и event loop не ждут всей очистки.
+    """
+    if not isinstance(store, SQLiteStore):
+        return
+    try:
+        if RETENTION_DAYS:
+            cutoff = retention_cutoff()
+            expired = purged = 0
+            while count := cache.expire(cutoff, RETENTION_BATCH_SIZE):
+                expired += count
+                await asyncio.sleep(0)
+            if worker_index in (None, 0):
+                while count := await storage.write(store.purge_before, cutoff, RETENTION_BATCH_SIZE):
+                    purged += count
+            if expired or purged:
+                logger.info(f"Удалены анкеты до {cutoff}: из базы {purged}, из кэша {expired}.")
+        if ARCHIVE_HOT_MONTHS and worker_index in (None, 0):
+            cutoff = archive_cutoff()
+            archived = 0
+            while count := await storage.write(store.archive_before, cutoff):
+                archived += count
+            if archived:
+                logger.info(f"В архив перенесено анкет, поданных до {cutoff}: {archived}.")
+    except Exception as e:
+        logger.error(f"Ошибка при обслуживании архива анкет: {e}")
+
+
+# --- Отправка анкет во внешнюю систему ---
+
+# Адрес HR/CRM-системы, которой отправляются новые анкеты (POST, JSON-массив); пусто — не отправлять
+OUTBOX_URL = os.getenv("OUTBOX_URL", "")
+# Токен для заголовка Authorization: Bearer (если нужен)
+OUTBOX_TOKEN = os.getenv("OUTBOX_TOKEN", "")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+# Как часто проверять очередь отправки, секунды
+OUTBOX_INTERVAL = float(os.getenv("OUTBOX_INTERVAL", "2"))
+# Таймаут одного запроса, секунды
+OUTBOX_TIMEOUT = float(os.getenv("OUTBOX_TIMEOUT", "10"))
+# Пауза после неудачной отправки: от OUTBOX_RETRY_MIN, удваивается до OUTBOX_RETRY_MAX секунд
+OUTBOX_RETRY_MIN = 1
+OUTBOX_RETRY_MAX = 300
+# Сколько дней хранить отметки о доставке
+OUTBOX_KEEP_DAYS = 7
+
+OUTBOX_RECORDS = metrics.counter(
+    "hrbot_outbox_records_total", "Анкеты, отправленные во внешнюю систему, по результату (delivered, rejected, retried).",
+    ("result",)
+)
+
+
+class OutboxSender:
+    """Доставляет анкеты из очереди applicant_outbox во внешнюю систему пачками.
+
+    Анкета попадает в очередь при записи из журнала в базу, в одной
+    транзакции с самой анкетой, и отмечается доставленной только после
+    ответа 2xx. Каждая анкета в пачке несет постоянный id записи очереди:
+    если ответ потерян, пачка повторяется, и получатель отбрасывает уже
+    принятые id. Пока внешняя система недоступна, попытки повторяются с
+    экспоненциально растущей паузой; обработчики сети не касаются.
+    """
+
+    def __init__(self, url: str, token: str, batch_size: int, timeout: float):
+        self.url = url
+        self.batch_size = batch_size
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        # Пачки идут по одному keep-alive соединению
+        self._client = httpx.AsyncClient(headers=headers, timeout=timeout)
+        self._lock = asyncio.Lock()
+        self._delay = 0.0
+        self._retry_at = 0.0
+        self._prune_at = 0.0
+        self.unavailable = False
+
+    async def close(self):
+        await self._client.aclose()
+
+    async def deliver(self) -> int:
+        """Отправляет очередь, пока она не опустеет или отправка не сорвется; возвращает число доставленных."""
+        # Прошлая отправка еще идет или пауза после ошибки не истекла
+        if self._lock.locked() or time.monotonic() < self._retry_at:
+            return 0
+        async with self._lock:
+            delivered = 0
+            while True:
+                rows = await storage.read(store.outbox_pending, self.batch_size)
+                if not rows:
+                    break
+                sent = await self._deliver_batch(rows)
+                if sent is None:
+                    break
+                delivered += sent
+                if len(rows) < self.batch_size:
+                    break
+            if time.monotonic() >= self._prune_at:
+                self._prune_at = time.monotonic() + 3600
+                before = (datetime.now(timezone.utc) - timedelta(days=OUTBOX_KEEP_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+                await storage.write(store.outbox_prune, before)
+            return delivered
+
+    async def _post(self, rows: List[Tuple[int, str]]) -> Tuple[Optional[int], str]:
+        content = json.dumps([{"id": outbox_id, **json.loads(payload)} for outbox_id, payload in rows], ensure_ascii=False)
+        try:
+            response = await self._client.post(self.url, content=content.encode("utf-8"))
+        except httpx.HTTPError as e:
+            return None, repr(e)
+        return response.status_code, f"HTTP {response.status_code}: {response.text[:200]}"
+
+    async def _deliver_batch(self, rows: List[Tuple[int, str]]) -> Optional[int]:
+        """Отправляет пачку; возвращает число доставленных или None, если отправку надо повторить позже."""
+        ids = [row[0] for row in rows]
+        status, error = await self._post(rows)
+        if status is not None and 200 <= status < 300:
+            await storage.write(store.outbox_finish, ids, "delivered")
+            OUTBOX_RECORDS.inc("delivered", amount=len(ids))
+            self._delay = 0.0
+            if self.unavailable:
+                self.unavailable = False
+                logger.info(f"Внешняя система {self.url} снова принимает анкеты.")
+            return len(ids)
+        if status in (HTTPStatus.BAD_REQUEST, HTTPStatus.UNPROCESSABLE_ENTITY):
+            # Повтор той же пачки не поможет. Она делится пополам, пока некорректная
+            # анкета не останется одна: остальные доставляются за log2(пачки) запросов
+            if len(rows) > 1:
+                delivered = 0
+                middle = len(rows) // 2
+                for part in (rows[:middle], rows[middle:]):
+                    sent = await self._deliver_batch(part)
+                    if sent is None:
+                        return None
+                    delivered += sent
+                return delivered
+            logger.error(f"Внешняя система отклонила анкету (запись очереди {ids[0]}): {error}")
+            await storage.write(store.outbox_finish, ids, "rejected", error)
+            OUTBOX_RECORDS.inc("rejected")
+            return 0
+        # Нет соединения, таймаут, 5xx, 429 и прочее: анкеты остаются в очереди
+        await storage.write(store.outbox_retry, ids, error)
+        OUTBOX_RECORDS.inc("retried", amount=len(ids))
+        self._delay = min(max(self._delay * 2, OUTBOX_RETRY_MIN), OUTBOX_RETRY_MAX)
+        # Случайная доля паузы: несколько ботов не повторяют запросы одновременно
+        self._retry_at = time.monotonic() + self._delay * random.uniform(0.5, 1)
+        if not self.unavailable:
+            self.unavailable = True
+            logger.warning(f"Внешняя система {self.url} не приняла анкеты ({error}), повторяем с паузой.")
+        return None
+
+
+outbox: Optional[OutboxSender] = None
+
+async def deliver_outbox(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически отправляет новые анкеты во внешнюю систему."""
+    try:
+        await outbox.deliver()
+    except Exception as e:
+        logger.error(f"Ошибка при отправке анкет во внешнюю систему: {e}")
+
+
+# --- Рассылка ---
+
+class TokenBucket:
+    """Ограничитель частоты: в среднем rate событий в секунду, всплеск до capacity."""
+
+    # Создается на каждого активного пользователя (UserRateLimiter)
+    __slots__ = ('rate', 'capacity', '_tokens', '_updated')
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def delay(self) -> float:
+        """Сколько секунд ждать до появления следующего токена."""
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
+
+
+class BroadcastLimiter:
+    """Общий лимит Telegram на отправку и лимит на один чат, с паузой по RetryAfter."""
+
+    def __init__(self, global_rate: float, per_chat_rate: float):
+        self.per_chat_rate = per_chat_rate
+        self._global = TokenBucket(global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """Останавливает все отправки на seconds секунд (ответ 429 от Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id: int):
+        chat = self._chats.setdefault(chat_id, TokenBucket(self.per_chat_rate, 1))
+        while True:
+            wait = max(self._paused_until - time.monotonic(), chat.delay())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            await self._global.acquire()
+            # За время ожидания общего лимита могла прийти пауза
+            if self._paused_until <= time.monotonic() and chat.try_acquire():
+                return
+
+    def release(self, chat_id: int):
+        """Забывает чат, которому больше ничего не будет отправлено."""
+        self._chats.pop(chat_id, None)
+
+
+class BroadcastStore(SQLiteDatabase):
+    """Рассылки и их получатели; статус каждого получателя сохраняется сразу после отправки.
+
+    Незавершенную рассылку ведет один процесс — владелец аренды (owner,
+    lease_until), который продлевает ее, пока идет отправка. Рассылку с
+    истекшей арендой (процесс остановлен или упал) забирает claim_expired.
+    """
+
+    def init(self):
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    text TEXT NOT NULL,
+                    report_chat_id INTEGER NOT NULL,
+                    finished INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    owner TEXT,
+                    lease_until REAL
+                );
+                CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                    broadcast_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    PRIMARY KEY (broadcast_id, user_id)
+                );
+            """)
+            # Базы, созданные до появления аренды рассылок
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(broadcasts)")}
+            if 'owner' not in columns:
+                self.conn.execute("ALTER TABLE broadcasts ADD COLUMN owner TEXT")
+                self.conn.execute("ALTER TABLE broadcasts ADD COLUMN lease_until REAL")
+
+    def create(self, text: str, report_chat_id: int, user_ids: List[int], owner: str, lease: float) -> int:
+        """Создает рассылку, сразу арендованную процессом owner."""
+        with self.conn:
+            broadcast_id = self.conn.execute(
+                "INSERT INTO broadcasts (text, report_chat_id, owner, lease_until) VALUES (?, ?, ?, ?)",
+                (text, report_chat_id, owner, time.time() + lease)
+            ).lastrowid
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id) VALUES (?, ?)",
+                ((broadcast_id, user_id) for user_id in user_ids)
+            )
+        return broadcast_id
+
+    def get(self, broadcast_id: int) -> Tuple:
+        """Возвращает (текст, чат для отчета)."""
+        return self.conn.execute(
+            "SELECT text, report_chat_id FROM broadcasts WHERE id = ?", (broadcast_id,)
+        ).fetchone()
+
+    def claim_expired(self, owner: str, lease: float) -> List[int]:
+        """Арендует незавершенные рассылки с истекшей арендой, возвращает их ID.
+
+        Каждая рассылка забирается отдельным условным UPDATE: из нескольких
+        процессов, проверяющих одновременно, ее получает ровно один.
+        """
+        now = time.time()
+        expired = [row[0] for row in self.conn.execute(
+            "SELECT id FROM broadcasts WHERE finished = 0 AND (lease_until IS NULL OR lease_until < ?) ORDER BY id",
+            (now,)
+        )]
+        claimed = []
+        for broadcast_id in expired:
+            with self.conn:
+                if self.conn.execute(
+                    "UPDATE broadcasts SET owner = ?, lease_until = ? "
+                    "WHERE id = ? AND finished = 0 AND (lease_until IS NULL OR lease_until < ?)",
+                    (owner, now + lease, broadcast_id, now)
+                ).rowcount:
+                    claimed.append(broadcast_id)
+        return claimed
+
+    def renew(self, broadcast_id: int, owner: str, lease: float) -> bool:
+        """Продлевает аренду; False — рассылку уже забрал другой процесс."""
+        with self.conn:
+            return self.conn.execute(
+                "UPDATE broadcasts SET lease_until = ? WHERE id = ? AND owner = ? AND finished = 0",
+                (time.time() + lease, broadcast_id, owner)
+            ).rowcount == 1
+
+    def release(self, owner: str):
+        """Снимает аренду процесса при остановке: его рассылки продолжатся без ожидания ее конца."""
+        with self.conn:
+            self.conn.execute("UPDATE broadcasts SET lease_until = NULL WHERE owner = ? AND finished = 0", (owner,))
+
+    def pending(self, broadcast_id: int) -> List[int]:
+        return [row[0] for row in self.conn.execute(
+            "SELECT user_id FROM broadcast_recipients WHERE broadcast_id = ? AND status = 'pending'",
+            (broadcast_id,)
+        )]
+
+    def counts(self, broadcast_id: int) -> Dict[str, int]:
+        return dict(self.conn.execute(
+            "SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status",
+            (broadcast_id,)
+        ).fetchall())
+
+    def mark(self, broadcast_id: int, user_id: int, status: str):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE broadcast_recipients SET status = ? WHERE broadcast_id = ? AND user_id = ?",
+                (status, broadcast_id, user_id)
+            )
+
+    def finish(self, broadcast_id: int):
+        with self.conn:
+            self.conn.execute("UPDATE broadcasts SET finished = 1, lease_until = NULL WHERE id = ?", (broadcast_id,))
+
+
+# Лимиты Telegram: ~30 сообщений в секунду всего и 1 в секунду в один чат
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_PER_CHAT_RATE = float(os.getenv("BROADCAST_PER_CHAT_RATE", "1"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+# Как часто обновлять сообщение с прогрессом, секунд
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+# Сколько раз повторять отправку при сетевой ошибке
+BROADCAST_MAX_ATTEMPTS = 3
+# Аренда рассылки, секунд: владелец продлевает ее каждую треть срока. Рассылку
+# остановленного или упавшего процесса продолжает другой (или он сам после
+# перезапуска) не позже чем через BROADCAST_LEASE секунд
+BROADCAST_LEASE = float(os.getenv("BROADCAST_LEASE", "60"))
+# Владелец аренды рассылок — этот процесс
+BROADCAST_OWNER = uuid.uuid4().hex
+
+broadcasts: BroadcastStore = None
+# Рассылки, которые выполняются в этом процессе
+running_broadcasts: Set[int] = set()
+
+
+class BroadcastRunner:
+    """Выполняет одну рассылку: параллельно, в пределах лимитов, с сохранением прогресса.
+
+    Уже отправленные получатели отмечены в базе, поэтому после перезапуска
+    рассылка продолжается только по оставшимся. Пока рассылка идет, аренда
+    продлевается; если ее забрал другой процесс (этот не продлевал ее дольше
+    BROADCAST_LEASE), отправка здесь прекращается.
+    """
+
+    def __init__(self, bot, broadcast_id: int, limiter: BroadcastLimiter = None):
+        self.bot = bot
+        self.broadcast_id = broadcast_id
+        self.limiter = limiter or BroadcastLimiter(BROADCAST_RATE, BROADCAST_PER_CHAT_RATE)
+        self.text = None
+        self.report_chat_id = None
+        self.total = self.sent = self.failed = 0
+        self.sent_now = 0
+        self.started = None
+        self.lost = False
+
+    async def run(self):
+        self.text, self.report_chat_id = await storage.read(broadcasts.get, self.broadcast_id)
+        pending = await storage.read(broadcasts.pending, self.broadcast_id)
+        counts = await storage.read(broadcasts.counts, self.broadcast_id)
+        self.sent, self.failed = counts.get('sent', 0), counts.get('failed', 0)
+        self.total = self.sent + self.failed + len(pending)
+        self.started = time.monotonic()
+
+        progress_message = await self._call(self.report_chat_id, self.bot.send_message, text=self.progress_text())
+        reporter = asyncio.create_task(self._report(progress_message))
+        heartbeat = asyncio.create_task(self._heartbeat())
+        recipients = iter(pending)
+        try:
+            await asyncio.gather(*(self._worker(recipients) for _ in range(BROADCAST_CONCURRENCY)))
+        finally:
+            reporter.cancel()
+            heartbeat.cancel()
+        if self.lost:
+            logger.warning(f"Рассылка #{self.broadcast_id} продолжена другим процессом, здесь остановлена.")
+            return
+
+        await storage.write(broadcasts.finish, self.broadcast_id)
+        await self._call(
+            self.report_chat_id, self.bot.send_message,
+            text=f"📬 Рассылка #{self.broadcast_id} завершена:\n"
+            f"✅ Успешно отправлено: {self.sent}\n"
+            f"❌ Ошибок: {self.failed}"
+        )
+
+    async def _worker(self, recipients):
+        # Общий итератор: каждый получатель достается ровно одному обработчику
+        for user_id in recipients:
+            if self.lost:
+                return
+            try:
+                await self._call(user_id, self.bot.send_message, text=self.text)
+                status = 'sent'
+            except TelegramError as e:
+                logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
+                status = 'failed'
+            self.limiter.release(user_id)
+            await storage.write(broadcasts.mark, self.broadcast_id, user_id, status)
+            if status == 'sent':
+                self.sent += 1
+                self.sent_now += 1
+            else:
+                self.failed += 1
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(BROADCAST_LEASE / 3)
+            try:
+                owned = await storage.write(broadcasts.renew, self.broadcast_id, BROADCAST_OWNER, BROADCAST_LEASE)
+            except Exception as e:
+                logger.warning(f"Не удалось продлить аренду рассылки #{self.broadcast_id}: {e}")
+                continue
+            if not owned:
+                self.lost = True
+                return
+
+    async def _call(self, chat_id: int, method, **kwargs):
+        """Вызывает метод Bot API в пределах лимитов, повторяя при 429 и сетевых ошибках."""
+        attempt = 0
+        while True:
+            await self.limiter.acquire(chat_id)
+            try:
+                return await method(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Рассылка #{self.broadcast_id}: лимит Telegram, пауза {retry_after} с.")
+                self.limiter.pause(retry_after)
+            except (Forbidden, BadRequest):
+                # Пользователь заблокировал бота или чат недоступен: повтор не поможет
+                raise
+            except NetworkError:
+                attempt += 1
+                if attempt >= BROADCAST_MAX_ATTEMPTS:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+
+    def progress_text(self) -> str:
+        elapsed = time.monotonic() - self.started if self.started else 0
+        speed = self.sent_now / elapsed if elapsed else 0
+        return (
+            f"📢 Рассылка #{self.broadcast_id}: {self.sent + self.failed} из {self.total}\n"
+            f"✅ Отправлено: {self.sent}\n"
+            f"❌ Ошибок: {self.failed}\n"
+            f"⚡ Скорость: {speed:.1f} сообщ./с"
+        )
+
+    async def _report(self, message):
+        last_text = None
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            text = self.progress_text()
+            if text == last_text:
+                continue
+            try:
+                await self._call(message.chat_id, self.bot.edit_message_text, text=text, message_id=message.message_id)
+                last_text = text
+            except Exception as e:
+                logger.warning(f"Не удалось обновить прогресс рассылки #{self.broadcast_id}: {e}")
+
+
+async def broadcast_job(context: ContextTypes.DEFAULT_TYPE):
+    """Задача job-queue: выполняет (или продолжает) рассылку."""
+    broadcast_id = context.job.data
+    # Рассылку, которая уже идет здесь, но не успела продлить аренду, не запускаем второй раз
+    if broadcast_id in running_broadcasts:
+        return
+    running_broadcasts.add(broadcast_id)
+    try:
+        await BroadcastRunner(context.bot, broadcast_id).run()
+    except Exception as e:
+        logger.error(f"Рассылка #{broadcast_id} прервана: {e}")
+    finally:
+        running_broadcasts.discard(broadcast_id)
+
+async def resume_broadcasts(application: Application):
+    """Продолжает рассылки с истекшей арендой: прерванные остановкой бота или падением процесса.
+
+    Рассылки, которые ведут работающие процессы-обработчики, не трогаются:
+    их аренда продлевается.
+    """
+    for broadcast_id in await storage.write(broadcasts.claim_expired, BROADCAST_OWNER, BROADCAST_LEASE):
+        logger.info(f"Продолжаем рассылку #{broadcast_id}.")
+        application.job_queue.run_once(broadcast_job, when=0, data=broadcast_id, name=f"broadcast-{broadcast_id}")
+
+async def check_broadcasts(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически забирает рассылки, аренда которых истекла (упавший процесс)."""
+    try:
+        await resume_broadcasts(context.application)
+    except Exception as e:
+        logger.error(f"Ошибка при проверке прерванных рассылок: {e}")
+
+
+# --- Хранение состояния бота ---
+
+# Файл старого PicklePersistence, переносится в базу один раз
+PICKLE_PERSISTENCE_FILE = "bot_data"
+# Разговоры и user_data, не менявшиеся дольше TTL, считаются брошенными и удаляются
+PERSISTENCE_TTL_DAYS = float(os.getenv("PERSISTENCE_TTL_DAYS", "30"))
+# Как часто Application сохраняет изменения, секунд
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "60"))
+
+
+class SQLitePersistence(SQLiteDatabase, BasePersistence):
+    """Persistence в SQLite: сохраняются только изменившиеся пользователи и разговоры.
+
+    Все изменения одного цикла update_persistence записываются одной
+    транзакцией через поток-писатель хранилища. Пустые user_data не
+    хранятся. При запуске читаются только строки моложе TTL, старые
+    удаляются (evict_expired).
+    """
+
+    def __init__(self, path: str, ttl_days: float, update_interval: float):
+        SQLiteDatabase.__init__(self, path)
+        BasePersistence.__init__(
+            self, store_data=PersistenceInput(callback_data=False), update_interval=update_interval
+        )
+        self.ttl = ttl_days * 24 * 3600
+        self._dirty: Dict[Tuple, object] = {}
+        self._commit = None
+
+    def init(self):
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS persist_user_data (
+                    user_id INTEGER PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS persist_chat_data (
+                    chat_id INTEGER PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS persist_bot_data (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    data BLOB NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS persist_conversations (
+                    name TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    state NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (name, key)
+                );
+                CREATE INDEX IF NOT EXISTS idx_persist_user_data_updated ON persist_user_data(updated_at);
+                CREATE INDEX IF NOT EXISTS idx_persist_conversations_updated ON persist_conversations(updated_at);
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+
+    def migrate_from_pickle(self, path: str):
+        """Однократно переносит данные из файла PicklePersistence."""
+        if not os.path.exists(path):
+            return
+        with self.conn:
+            if self.conn.execute("SELECT 1 FROM meta WHERE key = 'pickle_migrated'").fetchone():
+                return
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+            now = time.time()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO persist_user_data VALUES (?, ?, ?)",
+                ((user_id, pickle.dumps(value), now) for user_id, value in (data.get('user_data') or {}).items() if value)
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO persist_chat_data VALUES (?, ?, ?)",
+                ((chat_id, pickle.dumps(value), now) for chat_id, value in (data.get('chat_data') or {}).items() if value)
+            )
+            for name, conversations in (data.get('conversations') or {}).items():
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO persist_conversations VALUES (?, ?, ?, ?)",
+                    (
+                        (name, self._encode_key(key), self._encode_state(state), now)
+                        for key, state in conversations.items()
+                    )
+                )
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('pickle_migrated', ?)", (path,))
+        logger.info(f"Данные {path} перенесены в {self.path}.")
+
+    @staticmethod
+    def _encode_key(key: Tuple) -> str:
+        # Ключи разговоров — кортежи ID чата/пользователя: "42,42" читается быстрее JSON
+        if all(isinstance(part, int) for part in key):
+            return ",".join(map(str, key))
+        return json.dumps(key)
+
+    @staticmethod
+    def _decode_key(key: str) -> Tuple:
+        if key.startswith("["):
+            return tuple(json.loads(key))
+        return tuple(map(int, key.split(",")))
+
+    @staticmethod
+    def _encode_state(state) -> object:
+        # Состояния — целые числа и хранятся как есть, прочее — pickle
+        return state if isinstance(state, int) else pickle.dumps(state)
+
+    @staticmethod
+    def _decode_state(state) -> object:
+        return state if isinstance(state, int) else pickle.loads(state)
+
+    def _load(self, query: str, *params) -> List[Tuple]:
+        return self.conn.execute(query, (time.time() - self.ttl, *params)).fetchall()
+
+    def _save(self, dirty: Dict[Tuple, object]):
+        now = time.time()
+        with self.conn:
+            for (table, *key), data in dirty.items():
+                if table == 'conversations':
+                    if data is None:
+                        self.conn.execute("DELETE FROM persist_conversations WHERE name = ? AND key = ?", key)
+                    else:
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO persist_conversations VALUES (?, ?, ?, ?)", (*key, data, now)
+                        )
+                elif data is None:
+                    # Ключ (user_id, chat_id или 0) — INTEGER PRIMARY KEY, то есть rowid
+                    self.conn.execute(f"DELETE FROM persist_{table} WHERE rowid = ?", key)
+                else:
+                    self.conn.execute(f"INSERT OR REPLACE INTO persist_{table} VALUES (?, ?, ?)", (*key, data, now))
+
+    def evict_expired(self) -> int:
+        """Удаляет разговоры и данные пользователей старше TTL."""
+        cutoff = time.time() - self.ttl
+        with self.conn:
+            evicted = self.conn.execute("DELETE FROM persist_conversations WHERE updated_at < ?", (cutoff,)).rowcount
+            self.conn.execute("DELETE FROM persist_user_data WHERE updated_at < ?", (cutoff,))
+            self.conn.execute("DELETE FROM persist_chat_data WHERE updated_at < ?", (cutoff,))
+        return evicted
+
+    async def _write(self, key: Tuple, data: object):
+        # Изменения, пришедшие в одном цикле update_persistence, попадают в одну транзакцию
+        self._dirty[key] = data
+        if self._commit is None:
+            self._commit = asyncio.ensure_future(self._commit_dirty())
+        await asyncio.shield(self._commit)
+
+    async def _commit_dirty(self):
+        await asyncio.sleep(0)
+        dirty, self._dirty = self._dirty, {}
+        self._commit = None
+        try:
+            await storage.write(self._save, dirty)
+        except Exception:
+            # Не записанные изменения попадут в следующую транзакцию, если их не обновили
+            for key, data in dirty.items():
+                self._dirty.setdefault(key, data)
+            raise
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        rows = await storage.read(self._load, "SELECT user_id, data FROM persist_user_data WHERE updated_at >= ?")
+        return {user_id: pickle.loads(data) for user_id, data in rows}
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        rows = await storage.read(self._load, "SELECT chat_id, data FROM persist_chat_data WHERE updated_at >= ?")
+        return {chat_id: pickle.loads(data) for chat_id, data in rows}
+
+    async def get_bot_data(self) -> Dict:
+        rows = await storage.read(self._load, "SELECT data FROM persist_bot_data WHERE updated_at >= ?")
+        return pickle.loads(rows[0][0]) if rows else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        rows = await storage.read(
+            self._load, "SELECT key, state FROM persist_conversations WHERE updated_at >= ? AND name = ?", name
+        )
+        decode_key, decode_state = self._decode_key, self._decode_state
+        return {decode_key(key): decode_state(state) for key, state in rows}
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]):
+        state = None if new_state is None else self._encode_state(new_state)
+        await self._write(('conversations', name, self._encode_key(key)), state)
+
+    async def update_user_data(self, user_id: int, data: Dict):
+        # Пустые user_data (после отправки анкеты) не храним
+        await self._write(('user_data', user_id), pickle.dumps(data) if data else None)
+
+    async def update_chat_data(self, chat_id: int, data: Dict):
+        await self._write(('chat_data', chat_id), pickle.dumps(data) if data else None)
+
+    async def update_bot_data(self, data: Dict):
+        await self._write(('bot_data', 0), pickle.dumps(data))
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id: int):
+        await self._write(('user_data', user_id), None)
+
+    async def drop_chat_data(self, chat_id: int):
+        await self._write(('chat_data', chat_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict):
+        pass
+
+    async def flush(self):
+        if self._commit is not None:
+            await self._commit
+
+
+persistence: SQLitePersistence = None
+
+async def evict_expired_state(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически удаляет брошенные разговоры из базы."""
+    try:
+        evicted = await storage.write(persistence.evict_expired)
+        if evicted:
+            logger.info(f"Удалено брошенных разговоров: {evicted}.")
+    except Exception as e:
+        logger.error(f"Ошибка при очистке состояния бота: {e}")
+
+# --- Статистика ---
+
+class StatsStore(SQLiteDatabase):
+    """Сохраненные значения счетчиков воронки: статистика переживает перезапуск.
+
+    Распределения анкет (по городу, возрасту и т.д.) не хранятся отдельно —
+    это размеры индексов кэша, которые строятся из анкет при запуске.
+    """
+
+    def init(self):
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS stats_counters (
+                    metric TEXT NOT NULL,
+                    labels TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    PRIMARY KEY (metric, labels)
+                )
+            """)
+
+    def load(self) -> Dict[str, Dict[Tuple, float]]:
+        counters: Dict[str, Dict[Tuple, float]] = {}
+        for metric, labels, value in self.conn.execute("SELECT metric, labels, value FROM stats_counters"):
+            counters.setdefault(metric, {})[tuple(json.loads(labels))] = value
+        return counters
+
+    def add(self, deltas: Dict[str, Dict[Tuple, float]]):
+        """Прибавляет приращения счетчиков к сохраненным значениям.
+
+        Приращения, а не значения целиком: в базу пишут счетчики всех
+        процессов-обработчиков, и запись одного не затирает счет другого.
+        """
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO stats_counters (metric, labels, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (metric, labels) DO UPDATE SET value = value + excluded.value",
+                [
+                    (metric, json.dumps(labels, ensure_ascii=False), value)
+                    for metric, values in deltas.items() for labels, value in values.items()
+                ]
+            )
+
+
+# Как часто сохранять счетчики воронки, секунды
+STATS_SAVE_INTERVAL = float(os.getenv("STATS_SAVE_INTERVAL", "60"))
+# Счетчики, которые продолжают счет после перезапуска
+PERSISTED_COUNTERS = (FUNNEL_REACHED, FUNNEL_DROPOFFS, VALIDATION_FAILURES, RESUBMISSIONS)
+
+stats: StatsStore = None
+# Значения счетчиков, уже учтенные в базе
+saved_counters: Dict[str, Dict[Tuple, float]] = {}
+
+def restore_counters():
+    """Продолжает счет с сохраненных значений.
+
+    Процесс-обработчик считает с нуля: сохраненный итог общий для всех
+    обработчиков, и в метриках каждого он повторялся бы.
+    """
+    global saved_counters
+    if worker_index is None:
+        saved = stats.load()
+        for counter in PERSISTED_COUNTERS:
+            counter.restore(saved.get(counter.name, {}))
+    saved_counters = {counter.name: counter.values() for counter in PERSISTED_COUNTERS}
+
+def counter_deltas(snapshot: Dict[str, Dict[Tuple, float]]) -> Dict[str, Dict[Tuple, float]]:
+    """Приращения счетчиков в snapshot с последнего сохранения."""
+    deltas = {}
+    for name, values in snapshot.items():
+        saved = saved_counters.get(name, {})
+        changed = {labels: value - saved.get(labels, 0) for labels, value in values.items() if value != saved.get(labels, 0)}
+        if changed:
+            deltas[name] = changed
+    return deltas
+
+async def counter_totals() -> Dict[str, Dict[Tuple, float]]:
+    """Итоги счетчиков воронки: сохраненные всеми процессами плюс еще не сохраненные этим."""
+    totals = await storage.read(stats.load)
+    snapshot = {counter.name: counter.values() for counter in PERSISTED_COUNTERS}
+    for name, values in counter_deltas(snapshot).items():
+        for labels, delta in values.items():
+            totals.setdefault(name, {})[labels] = totals.get(name, {}).get(labels, 0) + delta
+    return totals
+
+async def save_counters(context: ContextTypes.DEFAULT_TYPE = None):
+    """Сохраняет счетчики воронки (периодически и при остановке)."""
+    global saved_counters
+    # Снимок берется в event loop: поток-писатель не видит изменений во время записи
+    snapshot = {counter.name: counter.values() for counter in PERSISTED_COUNTERS}
+    deltas = counter_deltas(snapshot)
+    if not deltas:
+        return
+    try:
+        await storage.write(stats.add, deltas)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении статистики: {e}")
+        return
+    saved_counters = snapshot
+
+
+# --- Основные обработчики ---
+
+# Клавиатуры создаются один раз и переиспользуются во всех ответах
+MAIN_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    [[KeyboardButton("📝 Заполнить анкету")], [KeyboardButton("💼 Список вакансий")]],
+    resize_keyboard=True
+)
+ADMIN_MAIN_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    [[KeyboardButton("📝 Заполнить анкету")], [KeyboardButton("💼 Список вакансий")], [KeyboardButton("🔐 Админка")]],
+    resize_keyboard=True
+)
+ADMIN_KEYBOARD = ReplyKeyboardMarkup(
+    [
+        [KeyboardButton("📋 Просмотреть все анкеты")],
+        [KeyboardButton("🔎 Поиск анкет")],
+        [KeyboardButton("🗑 Удалить анкету")],
+        [KeyboardButton("📢 Отправить всем сообщение")],
+        [KeyboardButton("📥 Выгрузить анкеты")],
+        [KeyboardButton("📊 Статистика")],
+        [KeyboardButton("👥 Возможные дубли")],
+        [KeyboardButton("💼 Редактировать вакансии")],
+        [KeyboardButton("📈 Метрики")],
+        [KeyboardButton("⬅️ Назад в меню")]
+    ],
+    resize_keyboard=True
+)
+
+async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отправляет главное меню."""
+    if update.effective_user.id in ADMIN_IDS:
+        reply_markup = ADMIN_MAIN_MENU_KEYBOARD
+    else:
+        reply_markup = MAIN_MENU_KEYBOARD
+    await update.message.reply_text("📋 Главное меню:", reply_markup=reply_markup)
+    return MENU
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /start. Очищает старые данные и показывает меню."""
+    FUNNEL_REACHED.inc("menu")
+    # /start посреди анкеты — выход из нее
+    leave_form(context)
+    context.user_data.clear()
+    await main_menu(update, context)
+    return MENU
+
+# --- Логика главного меню ---
+
+async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает выбор в главном меню."""
+    text = update.message.text
+    user_id = update.effective_user.id
+
+    if text == "📝 Заполнить анкету":
+        return await start_form(update, context)
+
+    elif text == "💼 Список вакансий":
+        return await show_vacancies(update, context)
+
+    elif text == "🔐 Админка" and user_id in ADMIN_IDS:
+        await update.message.reply_text("🔐 Админ-панель:", reply_markup=ADMIN_KEYBOARD)
+        return ADMIN_MENU
+
+    else:
+        await update.message.reply_text("Пожалуйста, выберите опцию из меню.")
+        return MENU
+
+# --- Логика заполнения анкеты ---
+
+class FormStep(NamedTuple):
+    """Вопрос анкеты: состояние, ключ в user_data, текст, клавиатура и проверка ответа."""
+    state: int
+    key: str
+    label: str
+    prompt: str
+    keyboard: ReplyKeyboardMarkup
+    # Возвращает значение для сохранения или None, если ответ неверный
+    validate: Callable[[str], Optional[object]]
+    error: str
+    back: str = "⬅️ Назад"
+
+
+def choice_validator(options, normalize: Callable[[str], str] = None) -> Callable[[str], Optional[str]]:
+    options = frozenset(options)
+    def validate(text: str) -> Optional[str]:
+        value = normalize(text) if normalize else text
+        return value if value in options else None
+    return validate
+
+def min_length_validator(length: int) -> Callable[[str], Optional[str]]:
+    def validate(text: str) -> Optional[str]:
+        return text if len(text) >= length else None
+    return validate
+
+def validate_age(text: str) -> Optional[int]:
+    if text.isdigit() and 16 <= int(text) <= 100:
+        return int(text)
+    return None
+
+PHONE_RE = re.compile(r'^(\+7|8)\d{10}$')
+
+def validate_phone(text: str) -> Optional[str]:
+    # Номер сохраняется в одном виде: +7XXXXXXXXXX
+    return "+" + normalize_phone(text) if PHONE_RE.match(text) else None
+
+def reply_keyboard(*rows) -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup([[KeyboardButton(text) for text in row] for row in rows], resize_keyboard=True)
+
+# Для ввода текста в админке: только возврат в меню
+MENU_BACK_KEYBOARD = reply_keyboard(["⬅️ Назад в меню"])
+
+BACK_KEYBOARD = reply_keyboard(["⬅️ Назад"])
+
+# Анкета: вопросы задаются по порядку, "⬅️ Назад" возвращает к предыдущему
+FORM_STEPS = [
+    FormStep(
+        ASK_EXPERIENCE, 'experience', "Опыт по категории Е",
+        "❓ Есть ли у вас опыт работы водителем по категории Е?",
+        reply_keyboard(["ДА", "НЕТ"], ["⬅️ Назад в меню"]),
+        choice_validator(["ДА", "НЕТ"], str.upper),
+        "❌ Пожалуйста, выберите 'ДА' или 'НЕТ'.",
+        back="⬅️ Назад в меню",
+    ),
+    FormStep(
+        ASK_CITIZENSHIP, 'citizenship', "Гражданство",
+        "🌍 Какое у вас гражданство?",
+        reply_keyboard(["Россия", "СНГ", "Другое"], ["⬅️ Назад"]),
+        choice_validator(["Россия", "СНГ", "Другое"]),
+        "❌ Выберите 'Россия', 'СНГ' или 'Другое'.",
+    ),
+    FormStep(
+        ASK_FIO, 'fio', "ФИО",
+        "👤 Введите ваше ФИО (например: Иванов Иван Иванович):",
+        BACK_KEYBOARD,
+        min_length_validator(5),
+        "❌ ФИО должно содержать хотя бы 5 символов.",
+    ),
+    FormStep(
+        ASK_AGE, 'age', "Возраст",
+        "🎂 Укажите ваш возраст (число):",
+        BACK_KEYBOARD,
+        validate_age,
+        "❌ Введите корректный возраст (от 16 до 100).",
+    ),
+    FormStep(
+        ASK_CITY, 'city', "Город",
+        "🏙 Укажите город проживания:",
+        BACK_KEYBOARD,
+        min_length_validator(2),
+        "❌ Город должен содержать хотя бы 2 символа.",
+    ),
+    FormStep(
+        ASK_PHONE, 'phone', "Телефон",
+        "📱 Укажите ваш номер телефона (например: +79991234567):",
+        BACK_KEYBOARD,
+        validate_phone,
+        "❌ Неверный формат. Пример: +79991234567",
+    ),
+]
+
+async def ask_form_step(update: Update, index: int, intro: str = ""):
+    """Задает вопрос анкеты с номером index."""
+    step = FORM_STEPS[index]
+    await update.message.reply_text(intro + step.prompt, reply_markup=step.keyboard)
+    return step.state
+
+# Шаги воронки анкеты по порядку: вопросы и подтверждение
+FUNNEL_STEPS = [step.key for step in FORM_STEPS] + ["confirm"]
+
+def enter_form_step(context: ContextTypes.DEFAULT_TYPE, position: int):
+    """Запоминает текущий шаг анкеты; шаг воронки засчитывается один раз за попытку.
+
+    После «⬅️ Назад» и нового ответа дальние шаги не засчитываются повторно,
+    поэтому доля дошедших до шага не превышает 100%.
+    """
+    context.user_data['form_step'] = position
+    if position > context.user_data.get('form_reached', -1):
+        context.user_data['form_reached'] = position
+        FUNNEL_REACHED.inc(FUNNEL_STEPS[position])
+
+def leave_form(context: ContextTypes.DEFAULT_TYPE):
+    """Засчитывает выход из анкеты до отправки на текущем шаге, если анкета заполняется."""
+    position = context.user_data.get('form_step')
+    if position is not None:
+        FUNNEL_DROPOFFS.inc(FUNNEL_STEPS[position])
+
+async def start_form(update: Update, context: ContextTypes.DEFAULT_TYPE, intro: str = "", restart: bool = False):
+    """Начинает заполнение анкеты с первого вопроса.
+
+    restart — «🔄 Заполнить заново»: та же попытка, пройденные шаги не засчитываются снова.
+    """
+    reached = context.user_data.get('form_reached', -1) if restart else -1
+    context.user_data.clear()
+    context.user_data['form_reached'] = reached
+    enter_form_step(context, 0)
+    return await ask_form_step(update, 0, intro)
+
+def make_form_handler(index: int):
+    """Создает обработчик ответа на вопрос анкеты с номером index."""
+    step = FORM_STEPS[index]
+
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        text = update.message.text.strip()
+        if text == step.back:
+            if index == 0:
+                leave_form(context)
+                context.user_data.clear()
+                await main_menu(update, context)
+                return MENU
+            enter_form_step(context, index - 1)
+            return await ask_form_step(update, index - 1)
+
+        value = step.validate(text)
+        if value is None:
+            VALIDATION_FAILURES.inc(step.key)
+            await update.message.reply_text(step.error)
+            return step.state
+
+        context.user_data[step.key] = value
+        enter_form_step(context, index + 1)
+        if index + 1 < len(FORM_STEPS):
+            return await ask_form_step(update, index + 1)
+        await show_confirmation(update, context)
+        return CONFIRM_DATA
+
+    handler.__name__ = handler.__qualname__ = f"ask_{step.key}"
+    handler.__doc__ = f"Обрабатывает ответ на вопрос «{step.label}»."
+    return handler
+
+# Обработчики по состояниям, из них строится ConversationHandler
+FORM_HANDLERS = {step.state: make_form_handler(index) for index, step in enumerate(FORM_STEPS)}
+
+# --- Подтверждение и сохранение анкеты ---
+
+CONFIRM_KEYBOARD = reply_keyboard(["✅ Отправить", "🔄 Заполнить заново"], ["⬅️ Назад в меню"])
+
+async def show_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает пользователю введенные данные для подтверждения."""
+    data = context.user_data
+    lines = "".join(f"🔸 {step.label}: {data[step.key]}\n" for step in FORM_STEPS)
+    message = f"📋 Пожалуйста, проверьте ваши данные:\n\n{lines}\nВсё верно?"
+    await update.message.reply_text(message, reply_markup=CONFIRM_KEYBOARD)
+
+async def confirm_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает подтверждение, сохраняет данные или начинает заново."""
+    text = update.message.text.strip()
+    user_id = update.effective_user.id
+
+    if text == "✅ Отправить":
+        try:
+            await save_applicant(user_id, context.user_data)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении анкеты пользователя {user_id}: {e}")
+            await update.message.reply_text("❌ Не удалось сохранить анкету. Попробуйте отправить ещё раз чуть позже.")
+            return CONFIRM_DATA
+        FUNNEL_REACHED.inc("submitted")
+        await update.message.reply_text(
+            "✅ Анкета успешно отправлена! Спасибо, мы с вами свяжемся.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        context.user_data.clear()
+        await main_menu(update, context)
+        return MENU
+
+    elif text == "🔄 Заполнить заново":
+        return await start_form(update, context, "🔄 Начнем заново.\n", restart=True)
+
+    elif text == "⬅️ Назад в меню":
+        leave_form(context)
+        context.user_data.clear()
+        await main_menu(update, context)
+        return MENU
+
+    else:
+        await update.message.reply_text("❌ Пожалуйста, выберите один из вариантов: 'Отправить', 'Заполнить заново' или 'Назад в меню'.")
+        return CONFIRM_DATA
+
+# --- Каталог вакансий ---
+
+# Файл каталога: .json, либо .yaml/.yml (нужен PyYAML)
+VACANCIES_FILE = os.getenv("VACANCIES_FILE", "vacancies.json")
+# Как часто проверять, не изменился ли файл каталога, секунды
+VACANCIES_RELOAD_INTERVAL = float(os.getenv("VACANCIES_RELOAD_INTERVAL", "10"))
+# Вакансий на одной странице списка
+VACANCIES_PAGE_SIZE = 8
+
+# Каталог, который создается, если файла еще нет
+DEFAULT_VACANCIES = [
+    {
+        "title": "🚚 Водитель категории Е",
+        "description": (
+            "📌 Требования:\n"
+            "- Опыт работы водителем категории Е\n"
+            "- Готовность к дальним поездкам\n\n"
+            "💼 Зарплата: от 120 000 руб.\n"
+            "📍 Место работы: Москва, Санкт-Петербург"
+        ),
+    },
+    {
+        "title": "📦 Водитель-экспедитор",
+        "description": (
+            "📌 Требования:\n"
+            "- Опыт работы водителем\n"
+            "- Ответственность\n\n"
+            "💼 Зарплата: от 100 000 руб.\n"
+            "📍 Место работы: Москва, регионы"
+        ),
+    },
+]
+
+VACANCIES_PREV = "⬅️ Предыдущие"
+VACANCIES_NEXT = "Следующие ➡️"
+# Кнопки разделов вакансий: название вакансии не может совпадать с ними
+VACANCY_RESERVED_TITLES = {VACANCIES_PREV, VACANCIES_NEXT, "⬅️ Назад в меню", "⬅️ Назад", "✅ Откликнуться"}
+
+
+class VacancyCatalog:
+    """Каталог вакансий из файла JSON или YAML, целиком в памяти.
+
+    Файл — список объектов {"title": ..., "description": ...}. Тексты
+    описаний и клавиатуры всех страниц списка строятся при загрузке, поэтому
+    сообщения пользователей обслуживаются без обращений к файлу. Файл
+    перечитывается, когда меняется время его изменения (проверяет задача
+    check_vacancies), и переписывается при правке из админки.
+
+    Чтение и запись файла — в пуле потоков (read_if_changed, write),
+    остальное — только из event loop.
+    """
+
+    def __init__(self, path: str, page_size: int):
+        self.path = path
+        self.page_size = page_size
+        self._mtime = None
+        self._items: List[Dict[str, str]] = []
+        self._texts: Dict[str, str] = {}
+        self._pages: List[Tuple[str, ReplyKeyboardMarkup]] = []
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def _is_yaml(self) -> bool:
+        return self.path.endswith((".yaml", ".yml"))
+
+    def _parse(self, content: str) -> List[Dict[str, str]]:
+        if self._is_yaml:
+            import yaml
+
+            data = yaml.safe_load(content) or []
+        else:
+            data = json.loads(content)
+        if not isinstance(data, list):
+            raise ValueError("ожидается список вакансий")
+        items = []
+        for item in data:
+            title = str(item["title"]).strip()
+            if title in VACANCY_RESERVED_TITLES:
+                raise ValueError(f"название «{title}» совпадает с кнопкой меню")
+            items.append({"title": title, "description": str(item.get("description") or "").strip()})
+        return items
+
+    def read_if_changed(self) -> Optional[Tuple[List[Dict[str, str]], int]]:
+        """Читает файл, если он изменился с прошлой загрузки: (вакансии, mtime) или None."""
+        if not os.path.exists(self.path):
+            # Первый запуск или файл удален: записываем стандартный или текущий каталог
+            return (self._items or DEFAULT_VACANCIES), self.write(self._items or DEFAULT_VACANCIES)
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return None
+        with open(self.path, encoding="utf-8") as f:
+            content = f.read()
+        try:
+            return self._parse(content), mtime
+        except Exception as e:
+            # Остается прежний каталог; ошибка повторится только при следующем изменении файла
+            self._mtime = mtime
+            logger.error(f"Ошибка в файле вакансий {self.path}: {e}")
+            return None
+
+    def write(self, items: List[Dict[str, str]]) -> int:
+        """Атомарно записывает каталог в файл, возвращает новое время изменения."""
+        if self._is_yaml:
+            import yaml
+
+            content = yaml.safe_dump(items, allow_unicode=True, sort_keys=False)
+        else:
+            content = json.dumps(items, ensure_ascii=False, indent=2)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, delete=False) as f:
+            f.write(content)
+        os.replace(f.name, self.path)
+        return os.stat(self.path).st_mtime_ns
+
+    def apply(self, items: List[Dict[str, str]], mtime: int):
+        """Заменяет каталог в памяти и заново строит тексты и клавиатуры."""
+        texts = {
+            item["title"]: f"{item['title']}\n\n{item['description']}\n\n📩 Хотите откликнуться?"
+            for item in items
+        }
+        titles = list(texts)
+        page_count = max(1, -(-len(titles) // self.page_size))
+        pages = []
+        for page in range(page_count):
+            rows = [[title] for title in titles[page * self.page_size:(page + 1) * self.page_size]]
+            navigation = ([VACANCIES_PREV] if page > 0 else []) + ([VACANCIES_NEXT] if page + 1 < page_count else [])
+            if navigation:
+                rows.append(navigation)
+            rows.append(["⬅️ Назад в меню"])
+            caption = "💼 Выберите вакансию:"
+            if page_count > 1:
+                caption = f"💼 Выберите вакансию (страница {page + 1} из {page_count}):"
+            pages.append((caption, reply_keyboard(*rows)))
+        self._items, self._texts, self._pages, self._mtime = items, texts, pages, mtime
+        logger.info(f"Каталог вакансий загружен: {len(items)}.")
+
+    def load(self):
+        """Загружает каталог при запуске (создает файл со стандартными вакансиями, если его нет)."""
+        loaded = self.read_if_changed()
+        if loaded is not None:
+            self.apply(*loaded)
+
+    async def reload_if_changed(self) -> bool:
+        loop = asyncio.get_running_loop()
+        loaded = await loop.run_in_executor(None, self.read_if_changed)
+        if loaded is None:
+            return False
+        self.apply(*loaded)
+        return True
+
+    async def upsert(self, title: str, description: str) -> bool:
+        """Добавляет вакансию или заменяет описание существующей; True — если вакансия новая."""
+        loop = asyncio.get_running_loop()
+        async with self._write_lock:
+            items = [item for item in self._items if item["title"] != title]
+            is_new = len(items) == len(self._items)
+            if is_new:
+                items.append({"title": title, "description": description})
+            else:
+                # Вакансия остается на своем месте в списке
+                items = [
+                    {"title": title, "description": description} if item["title"] == title else item
+                    for item in self._items
+                ]
+            mtime = await loop.run_in_executor(None, self.write, items)
+            self.apply(items, mtime)
+        return is_new
+
+    def text(self, title: str) -> Optional[str]:
+        return self._texts.get(title)
+
+    def titles(self) -> List[str]:
+        return list(self._texts)
+
+    def page(self, number: int) -> Tuple[int, str, ReplyKeyboardMarkup]:
+        """Страница списка (номер приводится к допустимому): (номер, подпись, клавиатура)."""
+        number = min(max(number, 0), len(self._pages) - 1)
+        caption, keyboard = self._pages[number]
+        return number, caption, keyboard
+
+    def __len__(self):
+        return len(self._items)
+
+
+vacancies = VacancyCatalog(VACANCIES_FILE, VACANCIES_PAGE_SIZE)
+
+async def check_vacancies(context: ContextTypes.DEFAULT_TYPE):
+    """Перечитывает каталог вакансий, если файл изменился."""
+    try:
+        await vacancies.reload_if_changed()
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении каталога вакансий: {e}")
+
+# --- Логика раздела вакансий ---
+
+VACANCY_KEYBOARD = reply_keyboard(["✅ Откликнуться"], ["⬅️ Назад"])
+
+async def show_vacancies(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
+    """Показывает страницу списка вакансий."""
+    if not len(vacancies):
+        await update.message.reply_text("📭 Сейчас открытых вакансий нет.")
+        return MENU
+    page, caption, keyboard = vacancies.page(page)
+    context.user_data['vacancy_page'] = page
+    await update.message.reply_text(caption, reply_markup=keyboard)
+    return VACANCIES_LIST
+
+async def handle_vacancy_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листает список вакансий и показывает описание выбранной."""
+    text = update.message.text.strip()
+    page = context.user_data.get('vacancy_page', 0)
+
+    if text == "⬅️ Назад в меню":
+        await main_menu(update, context)
+        return MENU
+
+    if text == VACANCIES_NEXT:
+        return await show_vacancies(update, context, page + 1)
+    if text == VACANCIES_PREV:
+        return await show_vacancies(update, context, page - 1)
+
+    description = vacancies.text(text)
+    if description is not None:
+        await update.message.reply_text(description, reply_markup=VACANCY_KEYBOARD)
+        return VACANCY_DESCRIPTION
+
+    else:
+        await update.message.reply_text("❌ Неизвестная вакансия. Выберите из списка.")
+        return VACANCIES_LIST
+
+async def handle_vacancy_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает отклик на вакансию, перенаправляя на анкету."""
+    text = update.message.text.strip()
+    if text == "⬅️ Назад":
+        return await show_vacancies(update, context, context.user_data.get('vacancy_page', 0))
+
+    elif text == "✅ Откликнуться":
+        # Переход к заполнению анкеты
+        return await start_form(update, context, "Отлично! Чтобы откликнуться, пожалуйста, заполните короткую анкету.\n\n")
+
+    else:
+        await update.message.reply_text("❌ Выберите '✅ Откликнуться' или '⬅️ Назад'.")
+        return VACANCY_DESCRIPTION
+
+# --- Функции админ-панели ---
+
+async def handle_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает команды из админ-меню."""
+    text = update.message.text.strip()
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("🔒 Доступ запрещён.")
+        return MENU
+
+    if text == "⬅️ Назад в меню":
+        await main_menu(update, context)
+        return MENU
+
+    elif text == "📋 Просмотреть все анкеты":
+        return await view_all_ankets(update, context)
+
+    elif text == "🗑 Удалить анкету":
+        await update.message.reply_text("Введите ID пользователя, анкету которого нужно удалить:")
+        return DELETE_ID
+
+    elif text == "🔎 Поиск анкет":
+        await update.message.reply_text(SEARCH_HELP, reply_markup=MENU_BACK_KEYBOARD)
+        return SEARCH_QUERY
+
+    elif text == "📢 Отправить всем сообщение":
+        context.user_data.pop('broadcast_query', None)
+        await update.message.reply_text("📝 Напишите сообщение для рассылки всем, кто заполнил анкету:")
+        return SEND_MESSAGE
+
+    elif text == "📥 Выгрузить анкеты":
+        await update.message.reply_text("📥 Выберите формат файла:", reply_markup=EXPORT_FORMAT_KEYBOARD)
+        return EXPORT_FORMAT
+
+    elif text == "💼 Редактировать вакансии":
+        titles = "\n".join(f"• {title}" for title in vacancies.titles())
+        await update.message.reply_text(
+            f"{VACANCY_EDIT_HELP}\n\nСейчас вакансий: {len(vacancies)}\n{titles}"[:MESSAGE_LIMIT],
+            reply_markup=MENU_BACK_KEYBOARD
+        )
+        return VACANCY_EDIT
+
+    elif text == "📊 Статистика":
+        await reply_text_or_file(update, statistics_report(await counter_totals()), "statistics")
+        return ADMIN_MENU
+
+    elif text == "👥 Возможные дубли":
+        await send_duplicates(update)
+        return ADMIN_MENU
+
+    elif text == "📈 Метрики":
+        await send_metrics(update)
+        return ADMIN_MENU
+
+    else:
+        await update.message.reply_text("❌ Неизвестная команда. Выберите из меню.")
+        return ADMIN_MENU
+
+
+async def reply_text_or_file(update: Update, text: str, name: str):
+    """Отправляет админу текст; если он не помещается в сообщение — файлом name_*.txt."""
+    if len(text) <= MESSAGE_LIMIT:
+        await update.message.reply_text(text, reply_markup=ADMIN_KEYBOARD)
+    else:
+        await update.message.reply_document(
+            text.encode("utf-8"), filename=f"{name}_{datetime.now():%Y%m%d_%H%M}.txt", reply_markup=ADMIN_KEYBOARD
+        )
+
+async def send_metrics(update: Update):
+    """Отправляет админу текущие метрики."""
+    await reply_text_or_file(update, metrics.render(), "metrics")
+
+
+# Нижние границы возрастных групп в отчете статистики
+AGE_GROUPS = (16, 25, 35, 45, 55)
+# Сколько значений показывать в каждом разделе статистики и сколько последних дней
+STATS_TOP = 10
+STATS_DAYS = 14
+
+def percent(part: float, whole: float) -> str:
+    return f"{part / whole:.0%}" if whole else "—"
+
+def age_group(age: int) -> str:
+    position = bisect.bisect_right(AGE_GROUPS, age)
+    if position == 0:
+        return f"до {AGE_GROUPS[0]}"
+    if position == len(AGE_GROUPS):
+        return f"{AGE_GROUPS[-1]}+"
+    return f"{AGE_GROUPS[position - 1]}–{AGE_GROUPS[position] - 1}"
+
+def statistics_report(counters: Dict[str, Dict[Tuple, float]]) -> str:
+    """Статистика по анкетам и воронке.
+
+    Считается по индексам кэша и итогам счетчиков воронки (counter_totals),
+    которые обновляются при каждом приеме и удалении анкеты, поэтому не
+    зависит от числа анкет.
+    """
+    total = len(cache)
+    sections = [f"📊 Статистика\n\nАнкет: {total}, пользователей: {cache.user_count()}"]
+
+    def section(title: str, counts: Dict, ordered: bool = False):
+        # ordered — сохранить порядок counts, иначе по убыванию числа анкет
+        items = list(counts.items()) if ordered else sorted(counts.items(), key=lambda item: -item[1])
+        lines = [f"  {label} — {count} ({percent(count, total)})" for label, count in items[:STATS_TOP]]
+        if len(items) > STATS_TOP:
+            lines.append(f"  …и еще {len(items) - STATS_TOP}")
+        sections.append("\n".join([title, *lines]) if lines else f"{title}\n  нет данных")
+
+    section("🏙 Города:", cache.counts('city'))
+    section("🌍 Гражданство:", cache.counts('citizenship'))
+    section("🚚 Опыт по категории Е:", cache.counts('experience'))
+    groups = {}
+    for age, count in sorted(cache.counts('age').items()):
+        groups[age_group(age)] = groups.get(age_group(age), 0) + count
+    section("🎂 Возраст:", groups, ordered=True)
+
+    days = sorted(cache.counts('day').items())[-STATS_DAYS:]
+    sections.append("\n".join([f"📅 Анкеты по дням (последние {STATS_DAYS}):", *(f"  {day} — {count}" for day, count in days)]))
+
+    funnel = counters.get(FUNNEL_REACHED.name, {})
+    started = funnel.get((FORM_STEPS[0].key,), 0)
+    lines = ["🔻 Воронка (доля от начавших анкету):", f"  Открыли меню — {funnel.get(('menu',), 0):.0f}"]
+    for label, key in [*((step.label, step.key) for step in FORM_STEPS), ("Подтверждение", "confirm"), ("Отправлено", "submitted")]:
+        reached = funnel.get((key,), 0)
+        lines.append(f"  {label} — {reached:.0f} ({percent(reached, started)})")
+    lines.append(f"  Повторных анкет — {counters.get(RESUBMISSIONS.name, {}).get((), 0):.0f}")
+    sections.append("\n".join(lines))
+    return "\n\n".join(sections)
+
+
+DUPLICATE_TITLES = {
+    'user': "🆔 Несколько анкет пользователя {key}",
+    'phone': "📞 Один телефон +{key}",
+    'fio': "👤 Одно ФИО: {fio}",
+}
+
+def duplicates_report() -> str:
+    """Текст отчета о возможных дублях по индексам личности кэша."""
+    groups = cache.duplicates()
+    if not groups:
+        return "✅ Возможных дублей не найдено."
+    parts = [f"👥 Возможные дубли: {len(groups)}"]
+    for name, key, applicants in groups:
+        lines = [DUPLICATE_TITLES[name].format(key=key, fio=applicants[0].fio)]
+        for applicant in applicants:
+            submitted = (applicant.created_at or "")[:10]
+            lines.append(f"  • ID {applicant.user_id}: {applicant.fio}, {applicant.phone}, {submitted}".rstrip(", "))
+        parts.append("\n".join(lines))
+    return "\n\n".join(parts)
+
+async def send_duplicates(update: Update):
+    """Отправляет админу отчет о возможных дублях анкет."""
+    await reply_text_or_file(update, duplicates_report(), "duplicates")
+
+
+VACANCY_EDIT_HELP = (
+    "💼 Отправьте вакансию одним сообщением: первая строка — название (оно же кнопка), "
+    "остальное — описание. Если вакансия с таким названием уже есть, ее описание будет заменено."
+)
+
+async def handle_vacancy_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Добавляет вакансию в каталог или заменяет описание существующей."""
+    text = update.message.text.strip()
+    if update.effective_user.id not in ADMIN_IDS:
+        return MENU
+
+    if text == "⬅️ Назад в меню":
+        await main_menu(update, context)
+        return MENU
+
+    title, _, description = text.partition("\n")
+    title, description = title.strip(), description.strip()
+    if not description:
+        await update.message.reply_text("❌ Добавьте описание со второй строки.\n\n" + VACANCY_EDIT_HELP)
+        return VACANCY_EDIT
+    if title in VACANCY_RESERVED_TITLES:
+        await update.message.reply_text("❌ Название совпадает с кнопкой меню, выберите другое.")
+        return VACANCY_EDIT
+
+    try:
+        is_new = await vacancies.upsert(title, description)
+    except Exception as e:
+        await update.message.reply_text(f"❌ Не удалось сохранить вакансию: {e}")
+        return VACANCY_EDIT
+    action = "добавлена" if is_new else "обновлена"
+    await update.message.reply_text(f"✅ Вакансия «{title}» {action}.", reply_markup=ADMIN_KEYBOARD)
+    return ADMIN_MENU
+
+
+# Максимальная длина сообщения Telegram
+MESSAGE_LIMIT = 4096
+# Сколько анкет читать из хранилища для одной страницы
+VIEW_FETCH_SIZE = 40
+
+ANKETA_TEMPLATE = (
+    "👤 Анкета #{number}\n"
+    "ID: {0}\n"
+    "ФИО: {3}\n"
+    "Возраст: {4}\n"
+    "Город: {5}\n"
+    "Телефон: {6}\n"
+    "Гражданство: {2}\n"
+    "Опыт: {1}\n"
+)
+
+VIEW_KEYBOARD = ReplyKeyboardMarkup(
+    [
+        [KeyboardButton("⬅️ Предыдущая"), KeyboardButton("Следующая ➡️")],
+        [KeyboardButton("⬅️ Назад в меню")],
+    ],
+    resize_keyboard=True
+)
+
+SEARCH_RESULTS_KEYBOARD = ReplyKeyboardMarkup(
+    [
+        [KeyboardButton("⬅️ Предыдущая"), KeyboardButton("Следующая ➡️")],
+        [KeyboardButton("📢 Написать найденным")],
+        [KeyboardButton("⬅️ Назад в меню")],
+    ],
+    resize_keyboard=True
+)
+
+def ankets_header(first_number: int, last_number: int, total: int) -> str:
+    return f"📋 Анкеты {first_number}–{last_number} из {total}\n\n"
+
+def build_page(rows: List[Tuple], first_number: int, limit: int = MESSAGE_LIMIT) -> Tuple[str, int]:
+    """Упаковывает анкеты в текст до limit символов.
+
+    rows — кортежи (позиция, *строка COLUMNS). Возвращает текст и число
+    поместившихся анкет. Анкета длиннее limit обрезается: перенести ее
+    часть на следующую страницу нельзя.
+    """
+    parts = []
+    length = 0
+    for offset, (_, *row) in enumerate(rows):
+        part = ANKETA_TEMPLATE.format(*row, number=first_number + offset)
+        if len(part) > limit:
+            part = part[:limit - 1] + "…"
+        if parts and length + len(part) + 1 > limit:
+            break
+        parts.append(part)
+        length += len(part) + 1
+    return "\n".join(parts), len(parts)
+
+async def read_ankets_page(context: ContextTypes.DEFAULT_TYPE, after: int) -> Tuple[List[Tuple], int]:
+    """Анкеты страницы после позиции after и их общее число.
+
+    Без поиска страница читается из хранилища, с поиском — из результатов
+    cache.search (позиция — номер анкеты в результатах).
+    """
+    query = context.user_data.get('view_query')
+    if query is None:
+        return await storage.read(store.page, after, VIEW_FETCH_SIZE), len(cache)
+    found = cache.search(ApplicantQuery(**query))
+    page = found[after:after + VIEW_FETCH_SIZE]
+    return [(position, *applicant.row()) for position, applicant in enumerate(page, after + 1)], len(found)
+
+async def show_ankets_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает текущую страницу анкет; страница читается из хранилища по запросу."""
+    # Стек начал страниц: (позиция, после которой начинается страница, номер первой анкеты)
+    pages = context.user_data['view_pages']
+    after, first_number = pages[-1]
+    rows, total = await read_ankets_page(context, after)
+    keyboard = SEARCH_RESULTS_KEYBOARD if 'view_query' in context.user_data else VIEW_KEYBOARD
+    if not rows:
+        await update.message.reply_text("📭 Больше анкет нет.", reply_markup=keyboard)
+        if len(pages) > 1:
+            pages.pop()
+        return VIEW_ANKETS
+
+    # Заголовок входит в лимит сообщения; его длина оценивается по наибольшему номеру на странице
+    longest_header = ankets_header(first_number, first_number + len(rows) - 1, total)
+    text, count = build_page(rows, first_number, MESSAGE_LIMIT - len(longest_header))
+    if count == len(rows) and len(rows) < VIEW_FETCH_SIZE:
+        # Хранилище вернуло меньше, чем просили, и всё поместилось: страница последняя
+        context.user_data['view_next'] = None
+    else:
+        context.user_data['view_next'] = (rows[count - 1][0], first_number + count)
+    await update.message.reply_text(
+        ankets_header(first_number, first_number + count - 1, total) + text,
+        reply_markup=keyboard
+    )
+    return VIEW_ANKETS
+
+async def view_all_ankets(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Открывает постраничный просмотр анкет с первой страницы."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return MENU
+    try:
+        if not len(cache):
+            await update.message.reply_text("📭 В базе данных пока нет ни одной анкеты.")
+            return ADMIN_MENU
+        # Анкеты из журнала должны попасть в хранилище до чтения страниц
+        await journal.flush()
+        context.user_data.pop('view_query', None)
+        context.user_data['view_pages'] = [(0, 1)]
+        return await show_ankets_page(update, context)
+    except Exception as e:
+        await update.message.reply_text(f"❌ Произошла ошибка при чтении анкет: {e}")
+    return ADMIN_MENU
+
+async def handle_view_ankets(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листает страницы анкет."""
+    text = update.message.text.strip()
+    if update.effective_user.id not in ADMIN_IDS:
+        return MENU
+
+    if text == "⬅️ Назад в меню":
+        context.user_data.pop('view_pages', None)
+        context.user_data.pop('view_next', None)
+        context.user_data.pop('view_query', None)
+        await main_menu(update, context)
+        return MENU
+
+    pages = context.user_data.get('view_pages')
+    if not pages:
+        return await view_all_ankets(update, context)
+
+    if text == "📢 Написать найденным" and 'view_query' in context.user_data:
+        query = context.user_data['view_query']
+        count = len(cache.search_user_ids(ApplicantQuery(**query)))
+        context.user_data['broadcast_query'] = query
+        await update.message.reply_text(
+            f"📝 Напишите сообщение для рассылки найденным пользователям ({count}):",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        return SEND_MESSAGE
+
+    try:
+        if text == "Следующая ➡️":
+            if context.user_data.get('view_next') is None:
+                keyboard = SEARCH_RESULTS_KEYBOARD if 'view_query' in context.user_data else VIEW_KEYBOARD
+                await update.message.reply_text("📭 Больше анкет нет.", reply_markup=keyboard)
+                return VIEW_ANKETS
+            pages.append(context.user_data['view_next'])
+            return await show_ankets_page(update, context)
+        elif text == "⬅️ Предыдущая":
+            if len(pages) > 1:
+                pages.pop()
+            return await show_ankets_page(update, context)
+    except Exception as e:
+        await update.message.reply_text(f"❌ Произошла ошибка при чтении анкет: {e}")
+        return VIEW_ANKETS
+
+    await update.message.reply_text("❌ Выберите '⬅️ Предыдущая', 'Следующая ➡️' или '⬅️ Назад в меню'.")
+    return VIEW_ANKETS
+
+
+# --- Поиск анкет ---
+
+SEARCH_HELP = (
+    "🔎 Введите условия поиска через запятую, например:\n\n"
+    "город: Москва, опыт: да, возраст: 25-40\n\n"
+    "Условия:\n"
+    "• город, гражданство, опыт — точное значение\n"
+    "• возраст — число или диапазон: 25-40, 25-, -40\n"
+    "• дата — день подачи или диапазон: 2026-10-01..2026-10-18 (или 01.10.2026)\n"
+    "• фио — начало слов ФИО: Иван Петр\n"
+    "• телефон — начало номера: +7999"
+)
+
+SEARCH_KEYS = {
+    "город": "city",
+    "гражданство": "citizenship",
+    "опыт": "experience",
+    "возраст": "age",
+    "дата": "date",
+    "фио": "fio",
+    "телефон": "phone",
+}
+
+def parse_search_date(text: str) -> Optional[str]:
+    """Дата в формате ГГГГ-ММ-ДД или ДД.ММ.ГГГГ → ГГГГ-ММ-ДД; None, если не разобрать."""
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(text.strip(), fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+def parse_search_query(text: str) -> Tuple[Optional[ApplicantQuery], Optional[str]]:
+    """Разбирает условия вида «ключ: значение, ...»; возвращает запрос или текст ошибки."""
+    conditions = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        name, separator, value = part.partition(":")
+        field = SEARCH_KEYS.get(name.strip().casefold())
+        value = value.strip()
+        if not separator or field is None:
+            return None, f"Непонятное условие «{part.strip()}». Условия: {', '.join(SEARCH_KEYS)}."
+        if not value:
+            return None, f"Не указано значение для «{name.strip()}»."
+
+        if field == "age":
+            low, dash, high = value.partition("-")
+            try:
+                age_min = int(low) if low.strip() else None
+                age_max = (int(high) if high.strip() else None) if dash else age_min
+            except ValueError:
+                return None, f"Возраст указывается числом или диапазоном, например 25-40, а не «{value}»."
+            conditions.update(age_min=age_min, age_max=age_max)
+        elif field == "date":
+            first, dots, last = value.partition("..")
+            date_from = parse_search_date(first) if first.strip() else None
+            date_to = (parse_search_date(last) if last.strip() else None) if dots else date_from
+            if (first.strip() and date_from is None) or (dots and last.strip() and date_to is None):
+                return None, f"Дата указывается как 2026-10-01 или 01.10.2026, а не «{value}»."
+            conditions.update(date_from=date_from, date_to=date_to)
+        else:
+            conditions[field] = value
+    if not conditions:
+        return None, "Не задано ни одного условия."
+    return ApplicantQuery(**conditions), None
+
+async def handle_search_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ищет анкеты по условиям админа и открывает постраничный просмотр результатов."""
+    text = update.message.text.strip()
+    if update.effective_user.id not in ADMIN_IDS:
+        return MENU
+
+    if text == "⬅️ Назад в меню":
+        await main_menu(update, context)
+        return MENU
+
+    query, error = parse_search_query(text)
+    if error:
+        await update.message.reply_text(f"❌ {error}\n\n{SEARCH_HELP}", reply_markup=MENU_BACK_KEYBOARD)
+        return SEARCH_QUERY
+    if not cache.search(query):
+        await update.message.reply_text("📭 Ничего не найдено. Измените условия или вернитесь в меню.", reply_markup=MENU_BACK_KEYBOARD)
+        return SEARCH_QUERY
+
+    # В user_data — словарь, чтобы состояние разговора сохранялось без классов бота
+    context.user_data['view_query'] = query._asdict()
+    context.user_data['view_pages'] = [(0, 1)]
+    try:
+        return await show_ankets_page(update, context)
+    except Exception as e:
+        await update.message.reply_text(f"❌ Произошла ошибка при поиске анкет: {e}")
+        return ADMIN_MENU
+
+
+async def delete_id_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Удаляет анкету пользователя по ID."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return MENU
+    try:
+        target_id = int(update.message.text.strip())
+        # Анкета, принятая во время удаления, иначе осталась бы в журнале и вернулась в хранилище
+        async with applicant_locks.hold(target_id):
+            found = bool(cache.by_user(target_id))
+            if found:
+                # Иначе анкеты из журнала вернутся в хранилище после удаления; журналы
+                # других процессов-обработчиков не вернут их благодаря store.add_many
+                await journal.flush()
+                await storage.write(store.delete_user, target_id)
+                cache.delete_user(target_id)
+        if found:
+            await update.message.reply_text(f"✅ Анкета пользователя с ID {target_id} успешно удалена.")
+        else:
+            await update.message.reply_text(f"❌ Анкета пользователя с ID {target_id} не найдена.")
+    except ValueError:
+        await update.message.reply_text("❌ Некорректный ID. Введите число.")
+    except Exception as e:
+        await update.message.reply_text(f"❌ Ошибка при удалении: {e}")
+
+    await main_menu(update, context) # Возвращаем в главное меню после действия
+    return MENU
+
+
+async def send_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запускает рассылку сообщения всем пользователям из базы (или найденным поиском) в фоне."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return MENU
+
+    message_text = update.message.text
+    query = context.user_data.pop('broadcast_query', None)
+    try:
+        unique_user_ids = cache.search_user_ids(ApplicantQuery(**query)) if query else cache.user_ids()
+        broadcast_id = await storage.write(
+            broadcasts.create, message_text, update.effective_chat.id, unique_user_ids,
+            BROADCAST_OWNER, BROADCAST_LEASE
+        )
+        context.job_queue.run_once(broadcast_job, when=0, data=broadcast_id, name=f"broadcast-{broadcast_id}")
+        await update.message.reply_text(
+            f"📢 Рассылка #{broadcast_id} запущена для {len(unique_user_ids)} получателей.\n"
+            "Прогресс будет приходить сюда."
+        )
+    except Exception as e:
+        await update.message.reply_text(f"❌ Ошибка при выполнении рассылки: {e}")
+
+    await main_menu(update, context) # Возвращаем в главное меню после действия
+    return MENU
+
+
+EXPORT_FORMATS = {"📊 Excel (XLSX)": "xlsx", "📄 CSV": "csv"}
+EXPORT_FORMAT_KEYBOARD = reply_keyboard(list(EXPORT_FORMATS), ["⬅️ Назад в меню"])
+EXPORT_FILTER_KEYBOARD = reply_keyboard(["📋 Все анкеты"], ["⬅️ Назад в меню"])
+
+async def handle_export_format(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запоминает формат выгрузки и спрашивает фильтр."""
+    text = update.message.text.strip()
+    if update.effective_user.id not in ADMIN_IDS:
+        return MENU
+
+    if text == "⬅️ Назад в меню":
+        await main_menu(update, context)
+        return MENU
+
+    if text not in EXPORT_FORMATS:
+        await update.message.reply_text("❌ Выберите формат: 'Excel (XLSX)' или 'CSV'.")
+        return EXPORT_FORMAT
+
+    context.user_data['export_format'] = EXPORT_FORMATS[text]
+    await update.message.reply_text(
+        "🏙 Введите город, чтобы выгрузить только его анкеты, или нажмите «Все анкеты»:",
+        reply_markup=EXPORT_FILTER_KEYBOARD
+    )
+    return EXPORT_FILTER
+
+async def handle_export_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгружает анкеты в файл и отправляет его админу документом."""
+    text = update.message.text.strip()
+    if update.effective_user.id not in ADMIN_IDS:
+        return MENU
+
+    fmt = context.user_data.pop('export_format', 'xlsx')
+    if text == "⬅️ Назад в меню":
+        await main_menu(update, context)
+        return MENU
+
+    predicate = None
+    if text != "📋 Все анкеты":
+        city = text.casefold()
+        predicate = lambda row: isinstance(row[5], str) and row[5].strip().casefold() == city
+
+    filename = f"applicants_{datetime.now():%Y%m%d_%H%M}.{fmt}"
+    try:
+        # Анкеты из журнала должны попасть в выгрузку
+        await journal.flush()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, filename)
+            count = await storage.read(export_applicants, path, fmt, predicate)
+            if count:
+                with open(path, "rb") as f:
+                    await update.message.reply_document(f, filename=filename, caption=f"📥 Анкет в файле: {count}")
+            else:
+                await update.message.reply_text("📭 Нет анкет для выгрузки.")
+    except Exception as e:
+        await update.message.reply_text(f"❌ Ошибка при выгрузке анкет: {e}")
+
+    await main_menu(update, context)
+    return MENU
+
+
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отменяет текущую операцию и возвращает в главное меню."""
+    leave_form(context)
+    context.user_data.clear()
+    await update.message.reply_text(
+        "Действие отменено.",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    await main_menu(update, context)
+    return MENU
+
+# --- Параллельная обработка обновлений ---
 
-def init_excel():
-    """Создает Excel-файл, если он не существует."""
-    if not os.path.exists(EXCEL_FILE):
-        df = pd.DataFrame(columns=[
-            'ID пользователя', 'Опыт по категории Е', 'Гражданство', 'ФИО', 'Возраст', 'Город', 'Телефон'
-        ])
-        df.to_excel(EXCEL_FILE, index=False)
-        logger.info(f"Файл {EXCEL_FILE} создан.")
+# Сколько обновлений обрабатывается одновременно (разных пользователей)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+# Сколько обновлений может находиться в работе с учетом ждущих своей очереди внутри пользователя
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "10000"))
+# Сколько секунд обновление может ждать места в UPDATE_CONCURRENCY, прежде чем будет отброшено
+UPDATE_MAX_WAIT = float(os.getenv("UPDATE_MAX_WAIT", "30"))
 
-def save_to_excel(user_id: int, data: Dict):
-    """Сохраняет новую строку с данными пользователя в Excel."""
-    try:
-        df = pd.read_excel(EXCEL_FILE)
-        new_row = {
-            'ID пользователя': user_id,
-            'Опыт по категории Е': data.get('experience'),
-            'Гражданство': data.get('citizenship'),
-            'ФИО': data.get('fio'),
-            'Возраст': data.get('age'),
-            'Город': data.get('city'),
-            'Телефон': data.get('phone')
-        }
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        df.to_excel(EXCEL_FILE, index=False)
-        logger.info(f"Данные пользователя {user_id} сохранены в Excel.")
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении в Excel: {e}")
+# Защита от флуда: в среднем FLOOD_RATE сообщений в секунду от пользователя, подряд до FLOOD_BURST
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", "1"))
+FLOOD_BURST = float(os.getenv("FLOOD_BURST", "10"))
+# Сколько последних активных пользователей помнит ограничитель
+FLOOD_MAX_USERS = int(os.getenv("FLOOD_MAX_USERS", "50000"))
 
 
-# --- Основные обработчики ---
+class UserRateLimiter:
+    """Ограничитель частоты по пользователям: TokenBucket на каждого в LRU.
 
-async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Отправляет главное меню."""
-    keyboard = [
-        [KeyboardButton("📝 Заполнить анкету")],
-        [KeyboardButton("💼 Список вакансий")],
-    ]
-    if update.effective_user.id in ADMIN_IDS:
-        keyboard.append([KeyboardButton("🔐 Админка")])
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    await update.message.reply_text("📋 Главное меню:", reply_markup=reply_markup)
-    return MENU
+    Хранится не больше max_users ограничителей: при переполнении забывается
+    тот, кто дольше всех не писал (его ведро к этому времени, скорее всего,
+    и так полное), поэтому память не зависит от числа пользователей.
+    """
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /start. Очищает старые данные и показывает меню."""
-    context.user_data.clear()
-    await main_menu(update, context)
-    return MENU
+    def __init__(self, rate: float, burst: float, max_users: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self._buckets: OrderedDict = OrderedDict()
 
-# --- Логика главного меню ---
+    def allow(self, key: int) -> bool:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.try_acquire()
 
-async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает выбор в главном меню."""
-    text = update.message.text
-    user_id = update.effective_user.id
+    def __len__(self) -> int:
+        return len(self._buckets)
 
-    if text == "📝 Заполнить анкету":
-        context.user_data.clear()
-        keyboard = [
-            [KeyboardButton("ДА"), KeyboardButton("НЕТ")],
-            [KeyboardButton("⬅️ Назад в меню")]
-        ]
-        await update.message.reply_text(
-            "❓ Есть ли у вас опыт работы водителем по категории Е?",
-            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        )
-        return ASK_EXPERIENCE
 
-    elif text == "💼 Список вакансий":
-        keyboard = [
-            [KeyboardButton("🚚 Водитель категории Е")],
-            [KeyboardButton("📦 Водитель-экспедитор")],
-            [KeyboardButton("⬅️ Назад в меню")]
-        ]
-        await update.message.reply_text("💼 Выберите вакансию:", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
-        return VACANCIES_LIST
+flood_limiter = UserRateLimiter(FLOOD_RATE, FLOOD_BURST, FLOOD_MAX_USERS)
+metrics.gauge("hrbot_flood_tracked_users", "Пользователей в ограничителе частоты.", lambda: len(flood_limiter))
 
-    elif text == "🔐 Админка" and user_id in ADMIN_IDS:
-        keyboard = [
-            [KeyboardButton("📋 Просмотреть все анкеты")],
-            [KeyboardButton("🗑 Удалить анкету")],
-            [KeyboardButton("📢 Отправить всем сообщение")],
-            [KeyboardButton("⬅️ Назад в меню")]
-        ]
-        await update.message.reply_text("🔐 Админ-панель:", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
-        return ADMIN_MENU
 
-    else:
-        await update.message.reply_text("Пожалуйста, выберите опцию из меню.")
-        return MENU
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления разных пользователей параллельно, одного — по порядку.
 
-# --- Логика заполнения анкеты ---
+    ConversationHandler рассчитан на то, что обновления одного чата приходят
+    последовательно, поэтому обновления одного пользователя ждут друг друга
+    на замке по его ID. Место в общем лимите UPDATE_CONCURRENCY занимается
+    только после получения замка: пользователь, отправивший много сообщений
+    подряд, не блокирует остальных.
 
-async def ask_experience(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.strip()
-    if text == "⬅️ Назад в меню":
-        context.user_data.clear()
-        await main_menu(update, context)
-        return MENU
+    Это же — слой перед обработчиками: сообщения сверх лимита частоты
+    пользователя (кроме админов) и обновления, прождавшие место дольше
+    max_wait, отбрасываются до ConversationHandler, не трогая user_data и
+    persistence, и учитываются в hrbot_updates_shed_total.
+    """
 
-    if text.upper() not in ["ДА", "НЕТ"]:
-        await update.message.reply_text("❌ Пожалуйста, выберите 'ДА' или 'НЕТ'.")
-        return ASK_EXPERIENCE
+    def __init__(self, max_concurrent_updates: int, max_pending: int = UPDATE_MAX_PENDING,
+                 limiter: Optional[UserRateLimiter] = None, max_wait: float = UPDATE_MAX_WAIT):
+        # Ограничение базового класса — на все обновления в работе, включая ждущие
+        super().__init__(max(max_pending, max_concurrent_updates))
+        self._active = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._user_locks = KeyedLock()
+        self.limiter = limiter
+        self.max_wait = max_wait
 
-    context.user_data['experience'] = text.upper()
-    keyboard = [
-        [KeyboardButton("Россия"), KeyboardButton("СНГ"), KeyboardButton("Другое")],
-        [KeyboardButton("⬅️ Назад")]
-    ]
-    await update.message.reply_text("🌍 Какое у вас гражданство?", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
-    return ASK_CITIZENSHIP
+    @staticmethod
+    def update_key(update: object) -> Optional[int]:
+        """Ключ очереди обновления: ID пользователя, иначе ID чата."""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
 
-async def ask_citizenship(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.strip()
-    if text == "⬅️ Назад":
-        keyboard = [[KeyboardButton("ДА"), KeyboardButton("НЕТ")], [KeyboardButton("⬅️ Назад в меню")]]
-        await update.message.reply_text(
-            "❓ Есть ли у вас опыт работы водителем по категории Е?",
-            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        )
-        return ASK_EXPERIENCE
+    @staticmethod
+    def _shed(coroutine, reason: str):
+        # Корутина обработки так и не запускается
+        coroutine.close()
+        UPDATES_SHED.inc(reason)
 
-    if text not in ["Россия", "СНГ", "Другое"]:
-        await update.message.reply_text("❌ Выберите 'Россия', 'СНГ' или 'Другое'.")
-        return ASK_CITIZENSHIP
+    async def _run(self, coroutine):
+        try:
+            await asyncio.wait_for(self._active.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            self._shed(coroutine, "overload")
+            return
+        try:
+            await coroutine
+        finally:
+            self._active.release()
 
-    context.user_data['citizenship'] = text
-    keyboard = [[KeyboardButton("⬅️ Назад")]]
-    await update.message.reply_text(
-        "👤 Введите ваше ФИО (например: Иванов Иван Иванович):",
-        reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    )
-    return ASK_FIO
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = self.update_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+        if self.limiter is not None and key not in ADMIN_IDS and not self.limiter.allow(key):
+            self._shed(coroutine, "flood")
+            return
+        async with self._user_locks.hold(key):
+            await self._run(coroutine)
 
-async def ask_fio(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.strip()
-    if text == "⬅️ Назад":
-        keyboard = [[KeyboardButton("Россия"), KeyboardButton("СНГ"), KeyboardButton("Другое")], [KeyboardButton("⬅️ Назад")]]
-        await update.message.reply_text("🌍 Какое у вас гражданство?", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
-        return ASK_CITIZENSHIP
+    async def initialize(self) -> None:
+        pass
 
-    if len(text) < 5:
-        await update.message.reply_text("❌ ФИО должно содержать хотя бы 5 символов.")
-        return ASK_FIO
+    async def shutdown(self) -> None:
+        pass
 
-    context.user_data['fio'] = text
-    keyboard = [[KeyboardButton("⬅️ Назад")]]
-    await update.message.reply_text("🎂 Укажите ваш возраст (число):", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
-    return ASK_AGE
 
-async def ask_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.strip()
-    if text == "⬅️ Назад":
-        keyboard = [[KeyboardButton("⬅️ Назад")]]
-        await update.message.reply_text("👤 Введите ваше ФИО:", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
-        return ASK_FIO
+# --- Встроенный HTTP-сервер ---
 
-    if not text.isdigit() or not (16 <= int(text) <= 100):
-        await update.message.reply_text("❌ Введите корректный возраст (от 16 до 100).")
-        return ASK_AGE
+class HTTPServer:
+    """Минимальный HTTP/1.1-сервер на asyncio для встроенных эндпоинтов бота.
 
-    context.user_data['age'] = int(text)
-    keyboard = [[KeyboardButton("⬅️ Назад")]]
-    await update.message.reply_text("🏙 Укажите город проживания:", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
-    return ASK_CITY
+    Поддерживает keep-alive и тело фиксированной длины; ответ на запрос
+    формирует handle() в наследнике.
+    """
 
-async def ask_city(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.strip()
-    if text == "⬅️ Назад":
-        keyboard = [[KeyboardButton("⬅️ Назад")]]
-        await update.message.reply_text("🎂 Укажите ваш возраст (число):", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
-        return ASK_AGE
+    # Максимальный размер тела запроса, байт
+    max_body = 1024 * 1024
 
-    if len(text) < 2:
-        await update.message.reply_text("❌ Город должен содержать хотя бы 2 символа.")
-        return ASK_CITY
+    def __init__(self, listen: str, port: int, ssl_context: ssl.SSLContext = None):
+        self.listen = listen
+        self.port = port
+        self.ssl_context = ssl_context
+        self._server = None
 
-    context.user_data['city'] = text
-    keyboard = [[KeyboardButton("⬅️ Назад")]]
-    await update.message.reply_text("📱 Укажите ваш номер телефона (например: +79991234567):", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
-    return ASK_PHONE
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port, ssl=self.ssl_context)
+        # Порт 0 — выбрать свободный (нужно при локальной проверке)
+        self.port = self._server.sockets[0].getsockname()[1]
 
-async def ask_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.strip()
-    if text == "⬅️ Назад":
-        keyboard = [[KeyboardButton("⬅️ Назад")]]
-        await update.message.reply_text("🏙 Укажите город проживания:", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
-        return ASK_CITY
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
 
-    phone_pattern = r'^(\+7|8)\d{10}$'
-    if not re.match(phone_pattern, text):
-        await update.message.reply_text("❌ Неверный формат. Пример: +79991234567")
-        return ASK_PHONE
+    async def handle(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, bytes, Dict[str, str]]:
+        """Возвращает статус, тело и дополнительные заголовки ответа."""
+        raise NotImplementedError
 
-    context.user_data['phone'] = text
-    await show_confirmation(update, context)
-    return CONFIRM_DATA
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while await self._handle_request(reader, writer):
+                pass
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
 
-# --- Подтверждение и сохранение анкеты ---
+    async def _handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=60)
+        if not request_line:
+            return False
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=10)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
 
-async def show_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает пользователю введенные данные для подтверждения."""
-    data = context.user_data
-    message = (
-        "📋 Пожалуйста, проверьте ваши данные:\n\n"
-        f"🔸 Опыт по категории Е: {data['experience']}\n"
-        f"🔸 Гражданство: {data['citizenship']}\n"
-        f"🔸 ФИО: {data['fio']}\n"
-        f"🔸 Возраст: {data['age']}\n"
-        f"🔸 Город: {data['city']}\n"
-        f"🔸 Телефон: {data['phone']}\n\n"
-        "Всё верно?"
-    )
-    keyboard = [
-        [KeyboardButton("✅ Отправить"), KeyboardButton("🔄 Заполнить заново")],
-        [KeyboardButton("⬅️ Назад в меню")]
-    ]
-    await update.message.reply_text(message, reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
+        length = int(headers.get("content-length", "0"))
+        if length > self.max_body:
+            await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, close=True)
+            return False
+        body = await asyncio.wait_for(reader.readexactly(length), timeout=10) if length else b""
+        keep_alive = headers.get("connection", "").lower() != "close"
 
-async def confirm_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает подтверждение, сохраняет данные или начинает заново."""
-    text = update.message.text.strip()
-    user_id = update.effective_user.id
+        status, response_body, response_headers = await self.handle(method, path.split("?", 1)[0], headers, body)
+        await self._respond(writer, status, response_body, response_headers, close=not keep_alive)
+        return keep_alive
 
-    if text == "✅ Отправить":
-        save_to_excel(user_id, context.user_data)
-        await update.message.reply_text(
-            "✅ Анкета успешно отправлена! Спасибо, мы с вами свяжемся.",
-            reply_markup=ReplyKeyboardRemove()
-        )
-        context.user_data.clear()
-        await main_menu(update, context)
-        return MENU
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, body: bytes = b"",
+                       headers: Dict[str, str] = None, close: bool = False):
+        head = f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Length: {len(body)}\r\n"
+        for name, value in (headers or {}).items():
+            head += f"{name}: {value}\r\n"
+        if close:
+            head += "Connection: close\r\n"
+        writer.write((head + "\r\n").encode("latin-1") + body)
+        await writer.drain()
 
-    elif text == "🔄 Заполнить заново":
-        context.user_data.clear()
-        keyboard = [[KeyboardButton("ДА"), KeyboardButton("НЕТ")], [KeyboardButton("⬅️ Назад в меню")]]
-        await update.message.reply_text(
-            "🔄 Начнем заново.\n❓ Есть ли у вас опыт работы водителем по категории Е?",
-            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        )
-        return ASK_EXPERIENCE
 
-    elif text == "⬅️ Назад в меню":
-        context.user_data.clear()
-        await main_menu(update, context)
-        return MENU
+# Адрес эндпоинта метрик Prometheus (GET /metrics); порт 0 — не запускать
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
 
-    else:
-        await update.message.reply_text("❌ Пожалуйста, выберите один из вариантов: 'Отправить', 'Заполнить заново' или 'Назад в меню'.")
-        return CONFIRM_DATA
 
-# --- Логика раздела вакансий ---
+class MetricsServer(HTTPServer):
+    """Отдает метрики бота в текстовом формате Prometheus по GET /metrics."""
 
-async def handle_vacancy_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает описание выбранной вакансии."""
-    text = update.message.text.strip()
-    vacancy_info = {
-        "🚚 Водитель категории Е": (
-            "🚚 Водитель категории Е\n\n"
-            "📌 Требования:\n"
-            "- Опыт работы водителем категории Е\n"
-            "- Готовность к дальним поездкам\n\n"
-            "💼 Зарплата: от 120 000 руб.\n"
-            "📍 Место работы: Москва, Санкт-Петербург"
-        ),
-        "📦 Водитель-экспедитор": (
-            "📦 Водитель-экспедитор\n\n"
-            "📌 Требования:\n"
-            "- Опыт работы водителем\n"
-            "- Ответственность\n\n"
-            "💼 Зарплата: от 100 000 руб.\n"
-            "📍 Место работы: Москва, регионы"
-        )
-    }
+    async def handle(self, method, path, headers, body):
+        if path != "/metrics":
+            return HTTPStatus.NOT_FOUND, b"", {}
+        if method != "GET":
+            return HTTPStatus.METHOD_NOT_ALLOWED, b"", {}
+        return HTTPStatus.OK, metrics.render().encode("utf-8"), {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
 
-    if text == "⬅️ Назад в меню":
-        await main_menu(update, context)
-        return MENU
 
-    if text in vacancy_info:
-        description = vacancy_info[text] + "\n\n📩 Хотите откликнуться?"
-        keyboard = [[KeyboardButton("✅ Откликнуться")], [KeyboardButton("⬅️ Назад")]]
-        await update.message.reply_text(description, reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
-        return VACANCY_DESCRIPTION
+metrics_server: MetricsServer = None
 
-    else:
-        await update.message.reply_text("❌ Неизвестная вакансия. Выберите из списка.")
-        return VACANCIES_LIST
+async def start_metrics_server(application: Application):
+    """Запускает эндпоинт метрик; ошибка (например, занятый порт) не останавливает бота."""
+    global metrics_server
+    if not METRICS_PORT:
+        return
+    server = MetricsServer(METRICS_LISTEN, METRICS_PORT)
+    try:
+        await server.start()
+    except OSError as e:
+        logger.error(f"Не удалось запустить эндпоинт метрик на {METRICS_LISTEN}:{METRICS_PORT}: {e}")
+        return
+    metrics_server = server
+    logger.info(f"Метрики доступны на http://{METRICS_LISTEN}:{server.port}/metrics")
 
-async def handle_vacancy_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает отклик на вакансию, перенаправляя на анкету."""
-    text = update.message.text.strip()
-    if text == "⬅️ Назад":
-        keyboard = [
-            [KeyboardButton("🚚 Водитель категории Е"), KeyboardButton("📦 Водитель-экспедитор")],
-            [KeyboardButton("⬅️ Назад в меню")]
-        ]
-        await update.message.reply_text("💼 Выберите вакансию:", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
-        return VACANCIES_LIST
+async def stop_metrics_server(application: Application):
+    global metrics_server
+    if metrics_server is not None:
+        await metrics_server.stop()
+        metrics_server = None
 
-    elif text == "✅ Откликнуться":
-        context.user_data.clear()
-        keyboard = [[KeyboardButton("ДА"), KeyboardButton("НЕТ")], [KeyboardButton("⬅️ Назад в меню")]]
-        await update.message.reply_text(
-            "Отлично! Чтобы откликнуться, пожалуйста, заполните короткую анкету.\n\n"
-            "❓ Есть ли у вас опыт работы водителем по категории Е?",
-            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+async def on_startup(application: Application):
+    """post_init: продолжает прерванные рассылки и запускает эндпоинт метрик."""
+    # Только рассылки с истекшей арендой: перезапущенный обработчик не забирает
+    # рассылки, которые ведут остальные
+    await resume_broadcasts(application)
+    await start_metrics_server(application)
+
+async def on_shutdown(application: Application):
+    """post_shutdown: останавливает эндпоинт метрик и закрывает хранилище."""
+    await stop_metrics_server(application)
+    if outbox is not None:
+        await outbox.close()
+    try:
+        await storage.write(broadcasts.release, BROADCAST_OWNER)
+    except Exception as e:
+        logger.error(f"Ошибка при снятии аренды рассылок: {e}")
+    await close_storage(application)
+
+
+# --- Режим webhook ---
+
+# Режим получения обновлений: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес, который сообщается Telegram через setWebhook (если пуст — не вызывается)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token. Обязателен: без него любой
+# мог бы прислать обновление от имени админа. Если пуст, но задан WEBHOOK_URL,
+# при запуске генерируется случайный и передается Telegram в setWebhook
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Сертификат и ключ для HTTPS; без них сервер работает по HTTP (например, за прокси)
+WEBHOOK_CERT = os.getenv("WEBHOOK_CERT", "")
+WEBHOOK_KEY = os.getenv("WEBHOOK_KEY", "")
+# Сколько принятых обновлений может ждать обработки; сверх этого — ответ 503
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Адрес сервера Bot API (собственный сервер или локальная заглушка); пусто — api.telegram.org
+BOT_API_URL = os.getenv("BOT_API_URL", "").rstrip("/")
+
+def bot_api_urls() -> Dict[str, str]:
+    """Параметры base_url и base_file_url для Bot при заданном BOT_API_URL."""
+    if not BOT_API_URL:
+        return {}
+    return {"base_url": f"{BOT_API_URL}/bot", "base_file_url": f"{BOT_API_URL}/file/bot"}
+
+def ensure_webhook_secret():
+    """Проверяет, что webhook не запустится без секрета; при заданном WEBHOOK_URL генерирует его."""
+    global WEBHOOK_SECRET
+    if WEBHOOK_SECRET:
+        return
+    if not WEBHOOK_URL:
+        raise ValueError(
+            "BOT_MODE=webhook требует WEBHOOK_SECRET (тот же, что передан Telegram в setWebhook): "
+            "без него webhook принимает поддельные обновления."
         )
-        return ASK_EXPERIENCE # Переход к заполнению анкеты
+    WEBHOOK_SECRET = secrets.token_urlsafe(32)
+    logger.info("WEBHOOK_SECRET не задан: сгенерирован случайный секрет для setWebhook.")
 
-    else:
-        await update.message.reply_text("❌ Выберите '✅ Откликнуться' или '⬅️ Назад'.")
-        return VACANCY_DESCRIPTION
+def secret_matches(headers: Dict[str, str], secret: str) -> bool:
+    """Сверяет заголовок X-Telegram-Bot-Api-Secret-Token с секретом за постоянное время."""
+    received = headers.get("x-telegram-bot-api-secret-token", "")
+    return bool(secret) and hmac.compare_digest(received.encode("utf-8"), secret.encode("utf-8"))
 
-# --- Функции админ-панели ---
 
-async def handle_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает команды из админ-меню."""
-    text = update.message.text.strip()
-    if update.effective_user.id not in ADMIN_IDS:
-        await update.message.reply_text("🔒 Доступ запрещён.")
-        return MENU
 
-    if text == "⬅️ Назад в меню":
-        await main_menu(update, context)
-        return MENU
+class WebhookServer(HTTPServer):
+    """Встроенный HTTP(S)-сервер, принимающий обновления от Telegram.
 
-    elif text == "📋 Просмотреть все анкеты":
-        await view_all_ankets(update, context)
-        return ADMIN_MENU
+    Принятые обновления кладутся в ограниченную очередь. Когда очередь
+    заполнена, сервер отвечает 503, и Telegram повторит доставку позже.
+    Обработчик забирает обновления из очереди в PerUserUpdateProcessor;
+    число забранных, но не обработанных обновлений тоже ограничено, поэтому
+    очередь не растет быстрее, чем идет обработка.
 
-    elif text == "🗑 Удалить анкету":
-        await update.message.reply_text("Введите ID пользователя, анкету которого нужно удалить:")
-        return DELETE_ID
+    Приемник (BOT_WORKERS > 1) присылает обновления пачкой — JSON-массивом;
+    пачка принимается целиком или, если не помещается в очередь, отклоняется.
+    """
 
-    elif text == "📢 Отправить всем сообщение":
-        await update.message.reply_text("📝 Напишите сообщение для рассылки всем, кто заполнил анкету:")
-        return SEND_MESSAGE
+    def __init__(self, application: Application, listen: str, port: int, path: str,
+                 secret_token: str = "", queue_size: int = 1000, ssl_context: ssl.SSLContext = None):
+        super().__init__(listen, port, ssl_context)
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        # Обновления, забранные из очереди, но еще не обработанные, тоже ограничены
+        self._in_flight = asyncio.Semaphore(queue_size)
+        self.rejected = 0
+        self._consumer = None
 
-    else:
-        await update.message.reply_text("❌ Неизвестная команда. Выберите из меню.")
-        return ADMIN_MENU
+    async def start(self):
+        await super().start()
+        self._consumer = asyncio.create_task(self._consume())
+        logger.info(f"Webhook слушает {self.listen}:{self.port}{self.path}")
 
+    async def stop(self):
+        await super().stop()
+        # Дообрабатываем уже принятые обновления: Telegram считает их доставленными
+        await self.queue.join()
+        self._consumer.cancel()
 
-async def view_all_ankets(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Отправляет админу список всех анкет из Excel файла."""
-    if update.effective_user.id not in ADMIN_IDS:
-        return MENU
-    try:
-        df = pd.read_excel(EXCEL_FILE)
-        if df.empty:
-            await update.message.reply_text("📭 В базе данных пока нет ни одной анкеты.")
-            return ADMIN_MENU
+    async def _consume(self):
+        while True:
+            await self._in_flight.acquire()
+            data = await self.queue.get()
+            asyncio.create_task(self._process(data))
 
-        for index, row in df.iterrows():
-            anketa_text = (
-                f"👤 Анкета #{index + 1}\n"
-                f"ID: {row['ID пользователя']}\n"
-                f"ФИО: {row['ФИО']}\n"
-                f"Возраст: {row['Возраст']}\n"
-                f"Город: {row['Город']}\n"
-                f"Телефон: {row['Телефон']}\n"
-                f"Гражданство: {row['Гражданство']}\n"
-                f"Опыт: {row['Опыт по категории Е']}\n"
-            )
-            await update.message.reply_text(anketa_text)
-    except FileNotFoundError:
-        await update.message.reply_text(f"❌ Файл {EXCEL_FILE} не найден.")
-    except Exception as e:
-        await update.message.reply_text(f"❌ Произошла ошибка при чтении анкет: {e}")
-    return ADMIN_MENU
+    async def _process(self, data: dict):
+        # Через update_processor: разные пользователи параллельно, один — по порядку
+        application = self.application
+        try:
+            update = Update.de_json(data, application.bot)
+            await application.update_processor.process_update(update, application.process_update(update))
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления из webhook: {e}")
+        finally:
+            self._in_flight.release()
+            self.queue.task_done()
 
+    async def handle(self, method, path, headers, body):
+        if path != self.path:
+            return HTTPStatus.NOT_FOUND, b"", {}
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, b"", {}
+        if not secret_matches(headers, self.secret_token):
+            return HTTPStatus.FORBIDDEN, b"", {}
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        updates = data if isinstance(data, list) else [data]
+        if not updates or not all(isinstance(item, dict) for item in updates):
+            return HTTPStatus.BAD_REQUEST, b"", {}
+        if self.queue.maxsize - self.queue.qsize() < len(updates):
+            self.rejected += 1
+            return HTTPStatus.SERVICE_UNAVAILABLE, b"", {"Retry-After": "1"}
+        for item in updates:
+            self.queue.put_nowait(item)
+        return HTTPStatus.OK, b"", {}
 
-async def delete_id_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Удаляет анкету пользователя по ID."""
-    if update.effective_user.id not in ADMIN_IDS:
-        return MENU
-    try:
-        target_id = int(update.message.text.strip())
-        df = pd.read_excel(EXCEL_FILE)
-        initial_count = len(df)
-        df = df[df['ID пользователя'] != target_id]
 
-        if len(df) < initial_count:
-            df.to_excel(EXCEL_FILE, index=False)
-            await update.message.reply_text(f"✅ Анкета пользователя с ID {target_id} успешно удалена.")
-        else:
-            await update.message.reply_text(f"❌ Анкета пользователя с ID {target_id} не найдена.")
-    except ValueError:
-        await update.message.reply_text("❌ Некорректный ID. Введите число.")
-    except Exception as e:
-        await update.message.reply_text(f"❌ Ошибка при удалении: {e}")
+webhook_server: WebhookServer = None
 
-    await main_menu(update, context) # Возвращаем в главное меню после действия
-    return MENU
+def webhook_ssl_context() -> Optional[ssl.SSLContext]:
+    if not (WEBHOOK_CERT and WEBHOOK_KEY):
+        return None
+    ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ssl_context.load_cert_chain(WEBHOOK_CERT, WEBHOOK_KEY)
+    return ssl_context
 
+def stop_on_signals() -> asyncio.Event:
+    """Событие, которое устанавливается по SIGINT или SIGTERM."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    return stop_event
 
-async def send_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Выполняет рассылку сообщения всем пользователям из базы."""
-    if update.effective_user.id not in ADMIN_IDS:
-        return MENU
+async def set_webhook(bot: Bot, ssl_context: Optional[ssl.SSLContext]):
+    """Сообщает Telegram адрес WEBHOOK_URL (если задан)."""
+    if not WEBHOOK_URL:
+        return
+    certificate = open(WEBHOOK_CERT, "rb") if ssl_context else None
+    try:
+        await bot.set_webhook(
+            WEBHOOK_URL,
+            certificate=certificate,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    finally:
+        if certificate:
+            certificate.close()
 
-    message_text = update.message.text
-    bot = context.bot
+async def run_webhook(application: Application, stop_event: asyncio.Event = None):
+    """Запускает бота в режиме webhook до сигнала остановки (или stop_event)."""
+    global webhook_server
+    ensure_webhook_secret()
+    ssl_context = webhook_ssl_context()
+    if stop_event is None:
+        stop_event = stop_on_signals()
+
+    server = WebhookServer(
+        application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+        WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE, ssl_context
+    )
+    # run_polling делает то же самое сам; здесь жизненный цикл ведем вручную
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    await server.start()
+    webhook_server = server
     try:
-        df = pd.read_excel(EXCEL_FILE)
-        unique_user_ids = df['ID пользователя'].unique()
-        sent_count, error_count = 0, 0
+        await set_webhook(application.bot, ssl_context)
+        await stop_event.wait()
+    finally:
+        webhook_server = None
+        await server.stop()
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+# --- Несколько процессов-обработчиков ---
 
-        for user_id in unique_user_ids:
+# Число процессов-обработчиков. При 1 бот работает одним процессом, как раньше;
+# больше 1 — этот процесс становится приемником: получает обновления
+# (BOT_MODE) и раздает их обработчикам по ID пользователя
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# Обработчики слушают 127.0.0.1: BOT_WORKER_BASE_PORT, BOT_WORKER_BASE_PORT + 1, ...
+BOT_WORKER_BASE_PORT = int(os.getenv("BOT_WORKER_BASE_PORT", "8450"))
+# Очередь приемника к каждому обработчику и наибольшая пачка в одном запросе
+BOT_WORKER_QUEUE_SIZE = int(os.getenv("BOT_WORKER_QUEUE_SIZE", "10000"))
+BOT_WORKER_BATCH_SIZE = int(os.getenv("BOT_WORKER_BATCH_SIZE", "100"))
+# Сколько ждать дообработки очередей и завершения обработчиков при остановке, секунды
+BOT_WORKER_STOP_TIMEOUT = float(os.getenv("BOT_WORKER_STOP_TIMEOUT", "30"))
+# Длительность long polling запроса getUpdates в приемнике, секунды
+FRONT_POLL_TIMEOUT = 30
+WORKER_PATH = "/update"
+
+# Номер этого процесса-обработчика (None — обычный процесс или приемник)
+worker_index: Optional[int] = None
+# PID приемника, запустившего обработчик
+front_pid: Optional[int] = None
+
+
+def update_user_id(data: Dict) -> Optional[int]:
+    """ID пользователя из JSON обновления, иначе ID чата — как PerUserUpdateProcessor.update_key."""
+    for name, value in data.items():
+        if name == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = value.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return None
+
+def worker_for(data: Dict, workers: int) -> int:
+    """Номер обработчика для обновления: все обновления пользователя попадают к одному."""
+    key = update_user_id(data)
+    # Хеш целого числа в Python — само число
+    return hash(key) % workers if key is not None else 0
+
+
+class WorkerLink:
+    """Канал приемника к одному обработчику.
+
+    Обновления отправляются пачками по keep-alive соединению, следующая
+    пачка — только после ответа 200 на предыдущую, поэтому порядок
+    сообщений пользователя сохраняется. Пока обработчик недоступен
+    (запускается, перезапускается) или отвечает 503, пачка повторяется.
+    """
+
+    def __init__(self, url: str, secret: str, queue_size: int, batch_size: int):
+        self.url = url
+        self.batch_size = batch_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._client = httpx.AsyncClient(headers={
+            "Content-Type": "application/json",
+            "X-Telegram-Bot-Api-Secret-Token": secret,
+        })
+        self._task = None
+        self.unavailable = False
+
+    def start(self):
+        self._task = asyncio.create_task(self._forward())
+
+    async def stop(self, timeout: float):
+        """Дожидается отправки очереди (не дольше timeout) и закрывает соединение."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Не отправлено обработчику {self.url}: {self.queue.qsize()} обновлений.")
+        self._task.cancel()
+        await self._client.aclose()
+
+    async def _forward(self):
+        while True:
+            bodies = [await self.queue.get()]
+            while len(bodies) < self.batch_size and not self.queue.empty():
+                bodies.append(self.queue.get_nowait())
+            await self._send(b"[" + b",".join(bodies) + b"]")
+            for _ in bodies:
+                self.queue.task_done()
+
+    async def _send(self, content: bytes):
+        delay = 0.05
+        while True:
             try:
-                await bot.send_message(chat_id=int(user_id), text=message_text)
-                sent_count += 1
-            except Exception as e:
-                error_count += 1
-                logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
+                response = await self._client.post(self.url, content=content)
+                status, error = response.status_code, None
+            except httpx.HTTPError as e:
+                status, error = None, repr(e)
+            if status == HTTPStatus.OK:
+                if self.unavailable:
+                    self.unavailable = False
+                    logger.info(f"Обработчик {self.url} снова доступен.")
+                return
+            if status == HTTPStatus.BAD_REQUEST:
+                # Повтор не поможет: пачка отброшена, чтобы не задерживать следующие
+                logger.error(f"Обработчик {self.url} отклонил обновления как некорректные.")
+                return
+            # 503 — очередь обработчика полна; нет соединения, 403 или 404 — обработчик
+            # запускается или порт еще занят прежним процессом. При запуске это ожидаемо: пишем один раз
+            if status != HTTPStatus.SERVICE_UNAVAILABLE and not self.unavailable:
+                self.unavailable = True
+                logger.warning(f"Обработчик {self.url} недоступен ({error or status}), повторяем отправку.")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1)
 
-        await update.message.reply_text(
-            f"📬 Рассылка завершена:\n"
-            f"✅ Успешно отправлено: {sent_count}\n"
-            f"❌ Ошибок: {error_count}"
-        )
-    except Exception as e:
-        await update.message.reply_text(f"❌ Ошибка при выполнении рассылки: {e}")
 
-    await main_menu(update, context) # Возвращаем в главное меню после действия
-    return MENU
+class FrontServer(HTTPServer):
+    """Приемник webhook: проверяет обновление и кладет его в очередь нужного обработчика."""
 
+    def __init__(self, links: List[WorkerLink], listen: str, port: int, path: str,
+                 secret_token: str = "", ssl_context: ssl.SSLContext = None):
+        super().__init__(listen, port, ssl_context)
+        self.links = links
+        self.path = path
+        self.secret_token = secret_token
 
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Отменяет текущую операцию и возвращает в главное меню."""
-    context.user_data.clear()
-    await update.message.reply_text(
-        "Действие отменено.",
-        reply_markup=ReplyKeyboardRemove()
+    async def handle(self, method, path, headers, body):
+        if path != self.path:
+            return HTTPStatus.NOT_FOUND, b"", {}
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, b"", {}
+        # Обработчики доверяют всему, что переслал приемник: без секрета ничего не принимаем
+        if not secret_matches(headers, self.secret_token):
+            return HTTPStatus.FORBIDDEN, b"", {}
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return HTTPStatus.BAD_REQUEST, b"", {}
+        try:
+            # Тело пересылается как есть, без повторной сериализации
+            self.links[worker_for(data, len(self.links))].queue.put_nowait(body)
+        except asyncio.QueueFull:
+            return HTTPStatus.SERVICE_UNAVAILABLE, b"", {"Retry-After": "1"}
+        return HTTPStatus.OK, b"", {}
+
+
+front_server: FrontServer = None
+
+def spawn_worker(index: int, secret: str) -> subprocess.Popen:
+    # Своя группа процессов: Ctrl+C получает только приемник и останавливает
+    # обработчики сам, дослав им очереди
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "worker", str(index)],
+        env={**os.environ, "BOT_WORKER_SECRET": secret},
+        start_new_session=True,
     )
-    await main_menu(update, context)
-    return MENU
 
-# --- Сборка и запуск бота ---
+async def supervise_workers(processes: List[subprocess.Popen], secret: str, stop_event: asyncio.Event):
+    """Перезапускает упавшие обработчики; их обновления тем временем ждут в очереди приемника."""
+    while not stop_event.is_set():
+        for index, process in enumerate(processes):
+            if process.poll() is not None:
+                logger.error(f"Обработчик {index} завершился с кодом {process.returncode}, перезапускаем.")
+                processes[index] = spawn_worker(index, secret)
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(stop_event.wait(), 1)
 
-def main():
-    """Главная функция для запуска бота."""
-    init_excel()
+def stop_workers(processes: List[subprocess.Popen], timeout: float):
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    deadline = time.monotonic() + timeout
+    for index, process in enumerate(processes):
+        try:
+            process.wait(max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            logger.error(f"Обработчик {index} не остановился за {timeout} с, завершаем принудительно.")
+            process.kill()
+            process.wait()
 
-    TOKEN = os.getenv("TELEGRAM_TOKEN")
-    if not TOKEN:
-        raise ValueError("Необходимо установить TELEGRAM_TOKEN в переменных окружения (в файле .env).")
+async def receive_polling(bot: Bot, links: List[WorkerLink], stop_event: asyncio.Event):
+    """Получает обновления через getUpdates и раздает их обработчикам."""
+    await bot.delete_webhook()
+    offset = None
+    stopping = asyncio.create_task(stop_event.wait())
+    try:
+        while not stop_event.is_set():
+            fetch = asyncio.create_task(bot.get_updates(
+                offset=offset, timeout=FRONT_POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES
+            ))
+            await asyncio.wait({fetch, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            if not fetch.done():
+                # Неподтвержденные обновления Telegram отдаст при следующем запуске
+                fetch.cancel()
+                break
+            try:
+                updates = fetch.result()
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                await asyncio.sleep(retry_after)
+                continue
+            except TelegramError as e:
+                logger.error(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                data = update.to_dict()
+                # Ожидание места в очереди притормаживает получение, а не теряет обновления
+                await links[worker_for(data, len(links))].queue.put(json.dumps(data).encode())
+                offset = update.update_id + 1
+    finally:
+        stopping.cancel()
+    if offset is not None:
+        # Подтверждаем розданные обновления, иначе после перезапуска они придут снова
+        with contextlib.suppress(TelegramError):
+            await bot.get_updates(offset=offset, timeout=0, limit=1)
+
+async def receive_webhook(bot: Bot, links: List[WorkerLink], stop_event: asyncio.Event):
+    """Принимает обновления webhook и раздает их обработчикам."""
+    global front_server
+    ssl_context = webhook_ssl_context()
+    server = FrontServer(links, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, ssl_context)
+    await server.start()
+    front_server = server
+    logger.info(f"Приемник webhook слушает {server.listen}:{server.port}{server.path}")
+    try:
+        await set_webhook(bot, ssl_context)
+        await stop_event.wait()
+    finally:
+        front_server = None
+        await server.stop()
+
+async def run_front(token: str, stop_event: asyncio.Event = None):
+    """Приемник: запускает BOT_WORKERS обработчиков и раздает им обновления по ID пользователя.
+
+    Обработчики — этот же скрипт (python HR-Bot.py worker N) с обычными
+    обработчиками разговора; общие у них база SQLite (анкеты, persistence,
+    рассылки, статистика) и файл вакансий.
+    """
+    if BOT_MODE == "webhook":
+        # До запуска обработчиков: без секрета приемник не стартует
+        ensure_webhook_secret()
+    if stop_event is None:
+        stop_event = stop_on_signals()
+    # Секрет защищает порты обработчиков от запросов в обход приемника
+    secret = uuid.uuid4().hex
+    processes = [spawn_worker(index, secret) for index in range(BOT_WORKERS)]
+    links = [
+        WorkerLink(
+            f"http://127.0.0.1:{BOT_WORKER_BASE_PORT + index}{WORKER_PATH}", secret,
+            BOT_WORKER_QUEUE_SIZE, min(BOT_WORKER_BATCH_SIZE, WEBHOOK_QUEUE_SIZE)
+        )
+        for index in range(BOT_WORKERS)
+    ]
+    for link in links:
+        link.start()
+    supervisor = asyncio.create_task(supervise_workers(processes, secret, stop_event))
+    logger.info(f"Запущено обработчиков: {BOT_WORKERS}.")
+    try:
+        async with Bot(token, **bot_api_urls()) as bot:
+            if BOT_MODE == "webhook":
+                await receive_webhook(bot, links, stop_event)
+            else:
+                await receive_polling(bot, links, stop_event)
+    finally:
+        stop_event.set()
+        await supervisor
+        for link in links:
+            await link.stop(BOT_WORKER_STOP_TIMEOUT)
+        await asyncio.to_thread(stop_workers, processes, BOT_WORKER_STOP_TIMEOUT)
+
+def prepare_shared_storage():
+    """Однократная подготовка общей базы приемником до запуска обработчиков.
+
+    Переносы старых данных (Excel, pickle) и журналы прошлых запусков
+    (общий и журналы обработчиков, в том числе при другом BOT_WORKERS)
+    обрабатываются здесь, а не в каждом обработчике параллельно.
+    """
+    if STORAGE_BACKEND != "sqlite":
+        raise ValueError("BOT_WORKERS > 1 требует STORAGE_BACKEND=sqlite: Excel-файл не поддерживает нескольких писателей.")
+    init_storage()
+    directory, name = os.path.split(os.path.abspath(JOURNAL_FILE))
+    pattern = re.compile(rf"{re.escape(name)}\.(\d+)(\.flushing)?")
+    indexes = {int(match.group(1)) for match in map(pattern.fullmatch, os.listdir(directory)) if match}
+    for index in sorted(indexes):
+        worker_journal = SubmissionJournal(f"{JOURNAL_FILE}.{index}", JOURNAL_BATCH_SIZE)
+        worker_journal.replay()
+        worker_journal.close()
+    release_storage()
+    cache.load([])
+
+def configure_worker(index: int):
+    """Настраивает процесс как обработчик номер index: свой порт, журнал и порт метрик."""
+    global worker_index, front_pid, JOURNAL_FILE, METRICS_PORT
+    global WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_CERT, WEBHOOK_KEY
+    worker_index = index
+    front_pid = os.getppid()
+    # Строки журнала обработчиков различимы в общем выводе
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(f'%(asctime)s - worker {index} - %(name)s - %(levelname)s - %(message)s'))
+    JOURNAL_FILE = f"{JOURNAL_FILE}.{index}"
+    if METRICS_PORT:
+        METRICS_PORT += 1 + index
+    # Обновления приходят только от приемника; setWebhook вызывает он же
+    WEBHOOK_URL = WEBHOOK_CERT = WEBHOOK_KEY = ""
+    WEBHOOK_LISTEN = "127.0.0.1"
+    WEBHOOK_PORT = BOT_WORKER_BASE_PORT + index
+    WEBHOOK_PATH = WORKER_PATH
+    WEBHOOK_SECRET = os.getenv("BOT_WORKER_SECRET", "")
+
+async def check_front(context: ContextTypes.DEFAULT_TYPE):
+    """Останавливает обработчик, если приемник завершился, не остановив его (например, kill -9)."""
+    if os.getppid() != front_pid:
+        logger.error("Приемник завершился, останавливаем обработчик.")
+        os.kill(os.getpid(), signal.SIGTERM)
 
-    # Создаем persistence для сохранения данных между перезапусками
-    persistence = PicklePersistence(filepath="bot_data")
 
-    application = (
+# --- Сборка и запуск бота ---
+
+def build_application(token: str, request: BaseRequest = None) -> Application:
+    """Собирает Application со всеми обработчиками и фоновыми задачами.
+
+    request — альтернативный транспорт Bot API (например, локальная заглушка).
+    """
+    global outbox
+    builder = (
         Application.builder()
-        .token(TOKEN)
+        .token(token)
         .persistence(persistence)
-        .build()
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY, limiter=flood_limiter))
     )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    urls = bot_api_urls()
+    if urls:
+        builder = builder.base_url(urls["base_url"]).base_file_url(urls["base_file_url"])
+    application = builder.build()
 
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
             MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_menu)],
-            # Состояния анкеты
-            ASK_EXPERIENCE: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_experience)],
-            ASK_CITIZENSHIP: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_citizenship)],
-            ASK_FIO: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_fio)],
-            ASK_AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_age)],
-            ASK_CITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_city)],
-            ASK_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_phone)],
+            # Состояния анкеты строятся из FORM_STEPS
+            **{
+                state: [MessageHandler(filters.TEXT & ~filters.COMMAND, handler)]
+                for state, handler in FORM_HANDLERS.items()
+            },
             CONFIRM_DATA: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_data)],
             # Состояния вакансий
             VACANCIES_LIST: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_vacancy_selection)],
@@ -539,17 +4359,83 @@ def main():
             ADMIN_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_menu)],
             DELETE_ID: [MessageHandler(filters.TEXT, delete_id_handler)],
             SEND_MESSAGE: [MessageHandler(filters.TEXT, send_message_handler)],
+            VIEW_ANKETS: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_view_ankets)],
+            SEARCH_QUERY: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_search_query)],
+            VACANCY_EDIT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_vacancy_edit)],
+            EXPORT_FORMAT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_export_format)],
+            EXPORT_FILTER: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_export_filter)],
         },
         fallbacks=[CommandHandler("cancel", cancel), CommandHandler("start", start)],
         persistent=True,
         name="main_conversation",
     )
 
+    # Время каждого обработчика попадает в метрики
+    instrument_handlers(conv_handler)
     application.add_handler(conv_handler)
+    application.job_queue.run_repeating(flush_journal, interval=JOURNAL_FLUSH_INTERVAL)
+    application.job_queue.run_repeating(check_vacancies, interval=VACANCIES_RELOAD_INTERVAL)
+    application.job_queue.run_repeating(save_counters, interval=STATS_SAVE_INTERVAL)
+    application.job_queue.run_repeating(maintain_archive, interval=ARCHIVE_CHECK_INTERVAL, first=60)
+    application.job_queue.run_repeating(check_broadcasts, interval=BROADCAST_LEASE, first=BROADCAST_LEASE)
+    if worker_index in (None, 0):
+        application.job_queue.run_repeating(evict_expired_state, interval=3600)
+        # Очередь отправки общая: при нескольких обработчиках ее отправляет первый
+        if OUTBOX_URL:
+            outbox = OutboxSender(OUTBOX_URL, OUTBOX_TOKEN, OUTBOX_BATCH_SIZE, OUTBOX_TIMEOUT)
+            application.job_queue.run_repeating(deliver_outbox, interval=OUTBOX_INTERVAL)
+    if worker_index is not None:
+        application.job_queue.run_repeating(sync_cache, interval=CACHE_SYNC_INTERVAL)
+        application.job_queue.run_repeating(check_front, interval=5)
+
+    return application
+
+
+def bot_token() -> str:
+    token = os.getenv("TELEGRAM_TOKEN")
+    if not token:
+        raise ValueError("Необходимо установить TELEGRAM_TOKEN в переменных окружения (в файле .env).")
+    return token
+
+def run_worker(index: int):
+    """Процесс-обработчик: получает обновления от приемника и обрабатывает их как обычный бот."""
+    configure_worker(index)
+    init_storage()
+    application = build_application(bot_token())
+    asyncio.run(run_webhook(application))
+
+def main():
+    """Главная функция для запуска бота."""
+    if BOT_WORKERS > 1:
+        TOKEN = bot_token()
+        prepare_shared_storage()
+        print(f"🤖 Бот запущен ({BOT_WORKERS} обработчиков)...")
+        asyncio.run(run_front(TOKEN))
+        return
+
+    init_storage()
+
+    TOKEN = bot_token()
+
+    application = build_application(TOKEN)
 
     print("🤖 Бот запущен...")
-    application.run_polling()
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook(application))
+    elif BOT_MODE == "polling":
+        application.run_polling()
+    else:
+        raise ValueError(f"Неизвестный режим BOT_MODE={BOT_MODE!r}: ожидается 'polling' или 'webhook'.")
 
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        # python HR-Bot.py export [файл.xlsx] — выгрузка анкет в Excel
+        init_storage()
+        export_to_excel(sys.argv[2] if len(sys.argv) > 2 else EXCEL_FILE)
+        release_storage()
+    elif len(sys.argv) > 2 and sys.argv[1] == "worker":
+        # python HR-Bot.py worker N — процесс-обработчик, его запускает приемник (BOT_WORKERS > 1)
+        run_worker(int(sys.argv[2]))
+    else:
+        main()
 
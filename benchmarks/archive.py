@@ -0,0 +1,187 @@
+"""Архив анкет по месяцам и срок хранения (SQLiteStore.archive_before, purge_before).
+
+Заполняет базу синтетическими анкетами за --months месяцев и сравнивает до и
+после переноса старых месяцев в архив: размер базы, время записи пачки
+анкет, время загрузки всех анкет (как при запуске) и пиковую память
+потоковой выгрузки. Затем проверяет, что чтение охватывает обе части:
+загрузка, выгрузка и постраничный просмотр возвращают те же анкеты, что и до
+архивации; удаление пользователя и повторная анкета затрагивают архив;
+очистка по сроку хранения удаляет из базы и кэша одни и те же анкеты.
+
+    python benchmarks/archive.py --months 24 --per-month 10000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from common import load_bot
+
+CITIES = ["Москва", "Тула", "Казань", "Самара", "Омск", "Пермь", "Уфа"]
+
+
+def month_name(index: int) -> str:
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def fill(bot, store, months: int, per_month: int):
+    random.seed(1)
+    first = 2024 * 12
+    user_id = 1_000_000
+    for index in range(first, first + months):
+        batch = []
+        for i in range(per_month):
+            record = bot.make_record(user_id, {
+                "experience": random.choice(["ДА", "НЕТ"]),
+                "citizenship": random.choice(["Россия", "СНГ", "Другое"]),
+                "fio": f"Иванов{user_id % 997} Иван Иванович",
+                "age": random.randint(18, 70),
+                "city": random.choice(CITIES),
+                "phone": f"+7{9_000_000_000 + user_id}",
+            })
+            record["created_at"] = f"{month_name(index)}-{1 + i * 28 // per_month:02d} 12:00:00"
+            batch.append(record)
+            user_id += 1
+        store.add_many(batch)
+    return first
+
+
+def write_latency(bot, store, count: int = 50, rounds: int = 40) -> float:
+    """Медиана записи пачки анкет (как сброс журнала), мс."""
+    durations = []
+    for r in range(rounds):
+        batch = [bot.make_record(50_000_000 + r * count + i, {
+            "experience": "ДА", "citizenship": "Россия", "fio": "Тестов Тест", "age": 30,
+            "city": "Москва", "phone": f"+7000{r * count + i:07d}",
+        }) for i in range(count)]
+        started = time.perf_counter()
+        store.add_many(batch)
+        durations.append(time.perf_counter() - started)
+        store.conn.execute("DELETE FROM applicants WHERE user_id >= 50000000")
+        store.conn.commit()
+    return statistics.median(durations) * 1000
+
+
+def export_peak(store) -> tuple:
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = sum(1 for _ in store.iter_rows())
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def measure(bot, store, path: str) -> dict:
+    store.conn.execute("VACUUM")
+    started = time.perf_counter()
+    records = store.records()
+    load = time.perf_counter() - started
+    count, export_seconds, peak = export_peak(store)
+    return {
+        "size_mb": os.path.getsize(path) / 2**20,
+        "hot_rows": store.conn.execute("SELECT COUNT(*) FROM applicants").fetchone()[0],
+        "write_ms": write_latency(bot, store),
+        "load_s": load,
+        "export_s": export_seconds,
+        "export_peak_mb": peak / 2**20,
+        "records": records,
+        "exported": count,
+    }
+
+
+def all_pages(store, size: int = 40) -> list:
+    rows, after = [], 0
+    while True:
+        page = store.page(after, size)
+        if not page:
+            return rows
+        rows.extend(page)
+        after = page[-1][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--per-month", type=int, default=10_000)
+    parser.add_argument("--hot-months", type=int, default=2)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    bot = load_bot()
+    path = "archive.db"
+    store = bot.SQLiteStore(path)
+    store.init()
+    first = fill(bot, store, args.months, args.per_month)
+    pages_before = all_pages(store)
+    before = measure(bot, store, path)
+
+    cutoff = month_name(first + args.months - args.hot_months)
+    started = time.perf_counter()
+    archived = 0
+    while count := store.archive_before(cutoff):
+        archived += count
+    archive_seconds = time.perf_counter() - started
+    after = measure(bot, store, path)
+
+    print(f"Анкет: {len(before['records'])}, в архив перенесено {archived} за {archive_seconds:.1f} с")
+    print(f"{'':<28}{'до архива':>12}{'после':>12}")
+    for name, key, fmt in [
+        ("размер базы, МБ", "size_mb", ".1f"), ("строк в applicants", "hot_rows", "d"),
+        ("запись 50 анкет, мс", "write_ms", ".2f"), ("загрузка всех анкет, с", "load_s", ".2f"),
+        ("выгрузка, с", "export_s", ".2f"), ("пик памяти выгрузки, МБ", "export_peak_mb", ".1f"),
+    ]:
+        print(f"{name:<28}{before[key]:>12{fmt}}{after[key]:>12{fmt}}")
+
+    checks = {
+        "загрузка совпадает": before["records"] == after["records"],
+        "выгрузка совпадает": before["exported"] == after["exported"] == len(before["records"]),
+        "просмотр совпадает": pages_before == all_pages(store),
+    }
+
+    # Удаление и повторная анкета пользователя из архива
+    old = before["records"][0]
+    user_id, submission_id = old[1], old[0]
+    checks["удаление из архива"] = store.delete_user(user_id) == 1 and user_id not in store.user_ids()
+    second = before["records"][1]
+    resubmitted = bot.make_record(second[1], {"experience": "ДА", "citizenship": "Россия", "fio": "Новое ФИО",
+                                              "age": 33, "city": "Тула", "phone": second[7]})
+    resubmitted["submission_id"] = second[0]
+    store.add_many([resubmitted])
+    records = store.records()
+    checks["повторная анкета заменяет архивную"] = (
+        [r for r in records if r[0] == second[0]] == [tuple(resubmitted[name] for name in bot.RECORD_FIELDS)]
+        and all(r[0] != submission_id for r in records)
+    )
+
+    # Срок хранения: база и кэш удаляют одни и те же анкеты
+    cache = bot.ApplicantCache()
+    cache.load(records)
+    retention = f"{month_name(first + args.months // 2)}-15"
+    started = time.perf_counter()
+    purged = 0
+    while count := store.purge_before(retention, bot.RETENTION_BATCH_SIZE):
+        purged += count
+    purge_seconds = time.perf_counter() - started
+    expired = 0
+    while count := cache.expire(retention, bot.RETENTION_BATCH_SIZE):
+        expired += count
+    remaining = store.records()
+    checks["срок хранения: база и кэш"] = (
+        purged == expired and len(remaining) == len(cache)
+        and all(r[-1] >= retention for r in remaining)
+        and {r[0] for r in remaining} == set(cache._records)
+    )
+    print(f"Удалено по сроку хранения: {purged} за {purge_seconds:.2f} с, осталось {len(remaining)}")
+
+    for name, ok in checks.items():
+        print(f"{name}: {'OK' if ok else 'ОШИБКА'}")
+    store.close()
+    raise SystemExit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Рассылка на локальной заглушке Bot API с имитацией ответов 429.
+
+Проверяет, что каждый получатель получил сообщение ровно один раз, в том
+числе после прерывания рассылки и ее продолжения, и выводит скорость.
+
+    python benchmarks/broadcast.py --recipients 500 --flood-limit 20
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from telegram import Bot
+
+from common import FAKE_TOKEN, FakeTelegramRequest, load_bot
+
+
+async def run(bot_module, recipients: int, flood_limit: int, interrupt_after: float):
+    request = FakeTelegramRequest(flood_limit=flood_limit, retry_after=1)
+    bot = Bot(FAKE_TOKEN, request=request)
+    await bot.initialize()
+
+    user_ids = list(range(1000, 1000 + recipients))
+    broadcast_id = await bot_module.storage.write(
+        bot_module.broadcasts.create, "Тест", 1, user_ids, bot_module.BROADCAST_OWNER, bot_module.BROADCAST_LEASE
+    )
+
+    started = time.monotonic()
+    # Первый запуск прерываем, как при остановке бота, затем продолжаем
+    first = asyncio.create_task(bot_module.BroadcastRunner(bot, broadcast_id).run())
+    await asyncio.sleep(interrupt_after)
+    first.cancel()
+    try:
+        await first
+    except asyncio.CancelledError:
+        pass
+    sent_before_restart = sum(request.sent[user_id] for user_id in user_ids)
+    await bot_module.BroadcastRunner(bot, broadcast_id).run()
+    elapsed = time.monotonic() - started
+
+    duplicates = [user_id for user_id in user_ids if request.sent[user_id] > 1]
+    missing = [user_id for user_id in user_ids if request.sent[user_id] == 0]
+    print(f"Получателей: {recipients}, до перезапуска отправлено: {sent_before_restart}")
+    print(f"Время: {elapsed:.2f} с, скорость: {recipients / elapsed:.1f} сообщ./с")
+    print(f"Ответов 429: {request.flood_errors}")
+    print(f"Повторных отправок: {len(duplicates)}, не доставлено: {len(missing)}")
+    await bot.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--recipients", type=int, default=300)
+    parser.add_argument("--flood-limit", type=int, default=20, help="сообщений в секунду до ответа 429")
+    parser.add_argument("--rate", type=float, default=30, help="BROADCAST_RATE бота")
+    parser.add_argument("--interrupt-after", type=float, default=2.0, help="секунд до имитации перезапуска")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        bot_module = load_bot()
+        bot_module.BROADCAST_RATE = args.rate
+        bot_module.BROADCAST_PROGRESS_INTERVAL = 0.5
+        bot_module.init_storage()
+        try:
+            asyncio.run(run(bot_module, args.recipients, args.flood_limit, args.interrupt_after))
+        finally:
+            bot_module.journal.close()
+            bot_module.storage.shutdown()
+            bot_module.store.close()
+            bot_module.broadcasts.close()
+
+
+if __name__ == "__main__":
+    main()
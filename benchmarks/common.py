@@ -0,0 +1,150 @@
+"""Общие средства для бенчмарков: загрузка HR-Bot.py и локальная заглушка Bot API.
+
+Бенчмарки запускаются из корня репозитория, например:
+    python benchmarks/broadcast.py
+"""
+import importlib.util
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_FILE = os.path.join(ROOT, "HR-Bot.py")
+
+# Токен заглушки: формат как у настоящего, в сеть запросы не уходят
+FAKE_TOKEN = "123456:FAKE-TOKEN"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "HR-Bot", "username": "hr_test_bot"}
+
+# Полный проход анкеты с отправкой
+FORM_ANSWERS = ["/start", "📝 Заполнить анкету", "ДА", "Россия", "Иванов Иван Иванович", "30", "Москва", "+79991234567", "✅ Отправить"]
+
+_update_ids = itertools.count(1)
+
+
+def make_update(user_id: int, text: str) -> dict:
+    """Текстовое сообщение пользователя в том виде, в каком его присылает Telegram."""
+    message = {
+        "message_id": next(_update_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def percentile(values, q: float) -> float:
+    """Перцентиль q (0–100) по ближайшему рангу."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+def load_bot(name: str = "hr_bot", path: str = BOT_FILE):
+    """Импортирует HR-Bot.py (или другую его версию) как модуль: в имени файла есть дефис."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def baseline_source(revision: str = "") -> str:
+    """Текст HR-Bot.py из ревизии git (по умолчанию — первый коммит репозитория)."""
+    if not revision:
+        revision = subprocess.run(
+            ["git", "rev-list", "--max-parents=0", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.split()[0]
+    return subprocess.run(
+        ["git", "show", f"{revision}:HR-Bot.py"], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Локальная заглушка Telegram Bot API для Bot/Application.
+
+    Отвечает на вызовы без сети, считает отправленные сообщения по чатам и
+    может имитировать ограничение частоты: если за последнюю секунду
+    отправлено больше flood_limit сообщений, возвращает 429 с retry_after.
+    """
+
+    def __init__(self, flood_limit: int = None, retry_after: int = 1, latency: float = 0.0):
+        self.flood_limit = flood_limit
+        self.retry_after = retry_after
+        self.latency = latency
+        self.calls = Counter()
+        self.sent = Counter()
+        self.flood_errors = 0
+        self._window = []
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _flooded(self) -> bool:
+        if self.flood_limit is None:
+            return False
+        now = time.monotonic()
+        self._window = [t for t in self._window if now - t < 1]
+        if len(self._window) >= self.flood_limit:
+            return True
+        self._window.append(now)
+        return False
+
+    def _message(self, chat_id, text=None) -> dict:
+        self._message_id += 1
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": BOT_USER,
+        }
+        if text is not None:
+            message["text"] = text
+        return message
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "sendDocument"):
+            self.sent[int(params["chat_id"])] += 1
+            return self._message(params["chat_id"], params.get("text"))
+        if method == "editMessageText":
+            return self._message(params["chat_id"], params.get("text"))
+        if method == "getUpdates":
+            return []
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        if self.latency:
+            import asyncio
+            await asyncio.sleep(self.latency)
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        params = request_data.parameters if request_data else {}
+        if api_method in ("sendMessage", "sendDocument") and self._flooded():
+            self.flood_errors += 1
+            body = {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+            return 429, json.dumps(body).encode()
+        body = {"ok": True, "result": self._result(api_method, params)}
+        return 200, json.dumps(body).encode()
@@ -0,0 +1,128 @@
+"""Нагрузочный тест параллельной обработки обновлений.
+
+Тысячи пользователей одновременно проходят анкету: каждый отправляет все
+ответы подряд, не дожидаясь бота, и обновления кладутся в очередь
+Application, как при polling.
+Для каждого значения UPDATE_CONCURRENCY измеряется скорость и проверяется,
+что обновления каждого пользователя обработаны по порядку: анкета сохранена
+с верными ответами, сообщений об ошибке ввода нет.
+
+Задержка заглушки Bot API имитирует сетевой запрос к Telegram — именно ее
+параллельная обработка и позволяет перекрывать. Задержка случайная (от 0 до
+2 × --latency), чтобы обновления одного пользователя могли обогнать друг
+друга, если порядок не соблюдается.
+
+    python benchmarks/concurrency.py --users 1000 --levels 1 8 64 256 --latency 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+from telegram import Update
+
+from common import FAKE_TOKEN, FORM_ANSWERS, FakeTelegramRequest, load_bot, make_update
+
+
+class RecordingRequest(FakeTelegramRequest):
+    """Заглушка со случайной задержкой, запоминающая сообщения об ошибках ввода по чатам."""
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.mean_latency = latency
+        self.errors = defaultdict(list)
+
+    async def do_request(self, *args, **kwargs):
+        await asyncio.sleep(random.uniform(0, 2 * self.mean_latency))
+        return await super().do_request(*args, **kwargs)
+
+    def _result(self, method, params):
+        text = params.get("text") or ""
+        if method == "sendMessage" and text.startswith("❌"):
+            self.errors[int(params["chat_id"])].append(text)
+        return super()._result(method, params)
+
+
+async def run_level(bot_module, concurrency: int, users: int, first_user: int, latency: float) -> dict:
+    bot_module.UPDATE_CONCURRENCY = concurrency
+    request = RecordingRequest(latency)
+    application = bot_module.build_application(FAKE_TOKEN, request=request)
+    await application.initialize()
+    await application.start()
+
+    user_ids = range(first_user, first_user + users)
+    # Каждый пользователь отправляет все ответы разом — худший случай для порядка
+    updates = [Update.de_json(make_update(user_id, text), application.bot) for user_id in user_ids for text in FORM_ANSWERS]
+    started = time.monotonic()
+    for update in updates:
+        application.update_queue.put_nowait(update)
+    await application.update_queue.join()
+    elapsed = time.monotonic() - started
+
+    await application.stop()
+    await application.shutdown()
+
+    expected = ("ДА", "Россия", "Иванов Иван Иванович", 30, "Москва", "+79991234567")
+    broken = 0
+    for user_id in user_ids:
+        records = bot_module.cache.by_user(user_id)
+        if len(records) != 1 or records[0].row()[1:] != expected or request.errors[user_id]:
+            broken += 1
+    return {
+        "concurrency": concurrency,
+        "users": users,
+        "updates": len(updates),
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(len(updates) / elapsed, 1),
+        "out_of_order_users": broken,
+    }
+
+
+async def run(bot_module, users: int, levels, latency: float):
+    results = []
+    for index, concurrency in enumerate(levels):
+        result = await run_level(bot_module, concurrency, users, 100_000 * (index + 1), latency)
+        print(
+            f"UPDATE_CONCURRENCY={concurrency:>4}: {result['updates_per_second']:>8.1f} обновл./с, "
+            f"{result['seconds']:.2f} с, нарушений порядка: {result['out_of_order_users']}"
+        )
+        results.append(result)
+    await bot_module.journal.flush()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 8, 64, 256])
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа заглушки Bot API, с")
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        bot_module = load_bot()
+        bot_module.init_storage()
+        try:
+            results = asyncio.run(run(bot_module, args.users, args.levels, args.latency))
+        finally:
+            bot_module.journal.close()
+            bot_module.storage.shutdown()
+            bot_module.store.close()
+            bot_module.broadcasts.close()
+            bot_module.persistence.close()
+
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if any(result["out_of_order_users"] for result in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Пиковая память (RSS) выгрузки анкет: потоковая выгрузка против pandas.
+
+Каждый вариант запускается в отдельном процессе:
+  stream — export_applicants() из SQLite в XLSX (openpyxl write-only);
+  csv    — то же в CSV;
+  pandas — прежний путь: pd.read_excel всего файла и to_excel.
+
+    python benchmarks/export_memory.py --rows 100000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import load_bot
+
+
+def peak_rss_kb() -> int:
+    # На Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(mode: str, workdir: str):
+    os.chdir(workdir)
+    if mode == "pandas":
+        import pandas as pd
+        base = peak_rss_kb()
+        started = time.perf_counter()
+        df = pd.read_excel("source.xlsx")
+        df.to_excel("out_pandas.xlsx", index=False)
+        rows = len(df)
+    else:
+        bot = load_bot()
+        bot.init_storage()
+        base = peak_rss_kb()
+        started = time.perf_counter()
+        rows = bot.export_applicants(f"out_stream.{mode}", "csv" if mode == "csv" else "xlsx")
+    print(json.dumps({
+        "mode": mode,
+        "rows": rows,
+        "seconds": round(time.perf_counter() - started, 2),
+        "base_rss_mb": round(base / 1024, 1),
+        "peak_rss_mb": round(peak_rss_kb() / 1024, 1),
+    }))
+
+
+def prepare(workdir: str, rows: int):
+    """Создает базу с rows анкетами и такой же Excel-файл для прежнего пути."""
+    os.chdir(workdir)
+    bot = load_bot()
+    bot.init_storage()
+    batch = []
+    for i in range(rows):
+        batch.append(bot.make_record(10_000_000 + i, {
+            'experience': 'ДА' if i % 2 else 'НЕТ',
+            'citizenship': 'Россия',
+            'fio': f'Иванов Иван Иванович {i}',
+            'age': 20 + i % 40,
+            'city': ('Москва', 'Тула', 'Казань')[i % 3],
+            'phone': f'+7999{i:07d}',
+        }))
+        if len(batch) == 10_000:
+            bot.store.add_many(batch)
+            batch = []
+    if batch:
+        bot.store.add_many(batch)
+    bot.export_applicants("source.xlsx", "xlsx")
+    bot.journal.close()
+    bot.storage.shutdown()
+    bot.store.close()
+    bot.broadcasts.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--modes", default="stream,csv,pandas")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.workdir)
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        prepare(workdir, args.rows)
+        for mode in args.modes.split(","):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", mode, "--workdir", workdir],
+                capture_output=True, text=True, check=True
+            ).stdout
+            print(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    main()
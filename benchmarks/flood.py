@@ -0,0 +1,145 @@
+"""Защита от флуда: обычные пользователи на фоне спамеров.
+
+Обычные пользователи проходят анкету, а спамеры одновременно шлют сотни
+/start подряд. Обновления кладутся в очередь Application, как при polling.
+Прогон выполняется с ограничителем частоты (FLOOD_RATE/FLOOD_BURST) и без
+него: сравниваются время, за которое все обычные пользователи отправили
+анкеты, число вызванных обработчиков и число отброшенных обновлений.
+
+Дополнительно проверяется, что память ограничителя не растет с числом
+разных пользователей (--distinct пользователей по одному сообщению).
+
+    python benchmarks/flood.py --users 200 --spammers 50 --spam 400
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+
+from telegram import Update
+
+from common import FAKE_TOKEN, FORM_ANSWERS, FakeTelegramRequest, load_bot, make_update
+
+
+class SlowRequest(FakeTelegramRequest):
+    """Заглушка с постоянной задержкой ответа, как у сетевого запроса к Telegram."""
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+
+    async def do_request(self, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        return await super().do_request(*args, **kwargs)
+
+
+async def run_case(bot, limited: bool, users: int, spammers: int, spam: int, first_user: int, latency: float) -> dict:
+    limiter = bot.UserRateLimiter(bot.FLOOD_RATE, bot.FLOOD_BURST, bot.FLOOD_MAX_USERS) if limited else None
+    application = bot.build_application(FAKE_TOKEN, request=SlowRequest(latency))
+    application.update_processor.limiter = limiter
+    await application.initialize()
+    await application.start()
+
+    user_ids = range(first_user, first_user + users)
+    spammer_ids = range(first_user + users, first_user + users + spammers)
+    # Спам и анкеты перемешаны: обычные пользователи приходят вперемешку со спамерами
+    updates = [make_update(user_id, "/start") for _ in range(spam) for user_id in spammer_ids]
+    step = max(1, len(updates) // (users * len(FORM_ANSWERS) + 1))
+    forms = [make_update(user_id, text) for user_id in user_ids for text in FORM_ANSWERS]
+    mixed = []
+    for index, update in enumerate(forms):
+        mixed.extend(updates[index * step:(index + 1) * step])
+        mixed.append(update)
+    mixed.extend(updates[len(forms) * step:])
+
+    shed_before = bot.UPDATES_SHED.value("flood")
+    handled_before = bot.HANDLER_SECONDS.count("start")
+    started = time.monotonic()
+    forms_done = None
+    for data in mixed:
+        application.update_queue.put_nowait(Update.de_json(data, application.bot))
+    processed = asyncio.create_task(application.update_queue.join())
+    while not processed.done():
+        if forms_done is None and all(bot.cache.by_user(user_id) for user_id in user_ids):
+            forms_done = time.monotonic() - started
+        await asyncio.sleep(0.01)
+    total = time.monotonic() - started
+    if forms_done is None:
+        forms_done = total
+
+    await application.stop()
+    await application.shutdown()
+    saved = sum(1 for user_id in user_ids if bot.cache.by_user(user_id))
+    return {
+        "limited": limited,
+        "updates": len(mixed),
+        "forms_saved": saved,
+        "forms_seconds": round(forms_done, 2),
+        "total_seconds": round(total, 2),
+        "start_handled": int(bot.HANDLER_SECONDS.count("start") - handled_before),
+        "shed": int(bot.UPDATES_SHED.value("flood") - shed_before),
+    }
+
+
+def limiter_memory(bot, distinct: int) -> tuple:
+    """Память ограничителя после сообщений от distinct разных пользователей."""
+    limiter = bot.UserRateLimiter(bot.FLOOD_RATE, bot.FLOOD_BURST, bot.FLOOD_MAX_USERS)
+    tracemalloc.start()
+    for user_id in range(distinct):
+        limiter.allow(user_id)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(limiter), current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--spammers", type=int, default=50)
+    parser.add_argument("--spam", type=int, default=400, help="сообщений от каждого спамера")
+    parser.add_argument("--latency", type=float, default=0.01, help="задержка ответа заглушки Bot API, с")
+    parser.add_argument("--distinct", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        bot = load_bot()
+        bot.init_storage()
+
+        async def run():
+            results = []
+            for index, limited in enumerate((False, True)):
+                results.append(await run_case(
+                    bot, limited, args.users, args.spammers, args.spam, 1_000_000 * (index + 1), args.latency
+                ))
+            await bot.journal.flush()
+            return results
+
+        try:
+            results = asyncio.run(run())
+        finally:
+            bot.journal.close()
+            bot.storage.shutdown()
+            bot.store.close()
+            bot.broadcasts.close()
+            bot.persistence.close()
+
+        for result in results:
+            name = "с ограничителем" if result["limited"] else "без ограничителя"
+            print(
+                f"{name:>17}: анкет {result['forms_saved']}/{args.users} за {result['forms_seconds']:.2f} с, "
+                f"всё за {result['total_seconds']:.2f} с, вызовов /start {result['start_handled']}, "
+                f"отброшено {result['shed']}"
+            )
+        tracked, size = limiter_memory(bot, args.distinct)
+        print(f"Ограничитель после {args.distinct} разных пользователей: {tracked} записей, {size / 2**20:.1f} МБ")
+
+    ok = all(result["forms_saved"] == args.users for result in results) and tracked <= bot.FLOOD_MAX_USERS
+    print("OK" if ok else "ОШИБКА")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Стоимость обработки одного сообщения в анкете: текущий код против прежней версии.
+
+Обработчики вызываются напрямую с заглушками Update и context, поэтому
+измеряется только работа самого обработчика (клавиатуры, проверки,
+регулярные выражения) без сети и ConversationHandler. Прежняя версия
+берется из git (по умолчанию — первый коммит репозитория).
+
+    python benchmarks/form_handlers.py --iterations 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from common import BOT_FILE, baseline_source, load_bot
+
+# Проход по анкете с ошибками и возвратами: (состояние, текст)
+SCENARIO = [
+    ("ASK_EXPERIENCE", "ДА"),
+    ("ASK_CITIZENSHIP", "Франция"),
+    ("ASK_CITIZENSHIP", "Россия"),
+    ("ASK_FIO", "⬅️ Назад"),
+    ("ASK_CITIZENSHIP", "Россия"),
+    ("ASK_FIO", "Иванов Иван Иванович"),
+    ("ASK_AGE", "200"),
+    ("ASK_AGE", "33"),
+    ("ASK_CITY", "Москва"),
+    ("ASK_PHONE", "123"),
+    ("ASK_PHONE", "+79991234567"),
+]
+
+
+class FakeMessage:
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+    async def reply_text(self, *args, **kwargs):
+        pass
+
+
+def handlers_for(bot) -> dict:
+    if hasattr(bot, "FORM_HANDLERS"):
+        return {name: bot.FORM_HANDLERS[getattr(bot, name)] for name, _ in SCENARIO}
+    # Прежняя версия: отдельная функция на каждый вопрос
+    return {name: getattr(bot, name.lower()) for name, _ in SCENARIO}
+
+
+async def measure(bot, iterations: int) -> float:
+    handlers = handlers_for(bot)
+    user = SimpleNamespace(id=1)
+    steps = [
+        (handlers[name], SimpleNamespace(message=FakeMessage(text), effective_user=user))
+        for name, text in SCENARIO
+    ]
+    context = SimpleNamespace(user_data={})
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for handler, update in steps:
+            await handler(update, context)
+    return (time.perf_counter() - started) / (iterations * len(steps)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--baseline", default="", help="ревизия git для сравнения")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        baseline_file = os.path.join(workdir, "HR-Bot-baseline.py")
+        with open(baseline_file, "w", encoding="utf-8") as f:
+            f.write(baseline_source(args.baseline))
+        baseline = load_bot("hr_bot_baseline", baseline_file)
+        current = load_bot("hr_bot", BOT_FILE)
+        result = {
+            "updates": args.iterations * len(SCENARIO),
+            "baseline_us_per_update": round(asyncio.run(measure(baseline, args.iterations)), 2),
+            "current_us_per_update": round(asyncio.run(measure(current, args.iterations)), 2),
+        }
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""Нагрузочный стенд: сценарии бота на заглушке Bot API при разном объеме базы.
+
+Строит то же Application с ConversationHandler, что и main()
+(build_application), на локальной заглушке Bot API и прогоняет через него
+синтетические обновления по сценариям:
+  form      — пользователи заполняют и отправляют анкету;
+  resubmit  — пользователи из базы подают анкету повторно (замена прежней);
+  vacancies — пользователи листают вакансии;
+  admin     — админ просматривает анкеты, удаляет анкету и создает рассылку.
+
+Для каждой комбинации хранилища и размера базы (в отдельном процессе)
+выводятся скорость, p50/p95/p99 времени обработки обновления и время
+операций с хранилищем. Результаты — JSON, пригодный для сравнения между
+версиями (--output, --baseline).
+
+    python benchmarks/harness.py --sizes 1000 10000 100000 --backends sqlite excel --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from telegram import Update
+
+from common import FAKE_TOKEN, FORM_ANSWERS, FakeTelegramRequest, load_bot, make_update, percentile
+
+SEED_USER = 10_000_000
+VACANCY_ANSWERS = [
+    "/start", "💼 Список вакансий", "🚚 Водитель категории Е", "⬅️ Назад",
+    "📦 Водитель-экспедитор", "⬅️ Назад", "⬅️ Назад в меню",
+]
+
+
+def admin_answers(target_id: int) -> list:
+    return [
+        "/start",
+        "🔐 Админка", "📋 Просмотреть все анкеты", "Следующая ➡️", "Следующая ➡️", "⬅️ Предыдущая", "⬅️ Назад в меню",
+        "🔐 Админка", "🗑 Удалить анкету", str(target_id),
+        "🔐 Админка", "📢 Отправить всем сообщение", "Проверка рассылки",
+    ]
+
+
+def summary_ms(durations: list) -> dict:
+    return {
+        "count": len(durations),
+        "total_ms": round(sum(durations) * 1000, 2),
+        "p50_ms": round(percentile(durations, 50) * 1000, 3),
+        "p95_ms": round(percentile(durations, 95) * 1000, 3),
+        "p99_ms": round(percentile(durations, 99) * 1000, 3),
+        "max_ms": round(max(durations, default=0) * 1000, 3),
+    }
+
+
+def instrument_storage(bot, timings: dict):
+    """Подменяет операции хранилища обертками, замеряющими время."""
+
+    def timed(name, func):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                timings[name].append(time.perf_counter() - started)
+        return wrapper
+
+    bot.storage.read = timed("storage_read", bot.storage.read)
+    bot.storage.write = timed("storage_write", bot.storage.write)
+    bot.journal.append = timed("journal_append", bot.journal.append)
+
+
+def seed(bot, size: int):
+    """Заполняет хранилище size синтетическими анкетами."""
+    batch = []
+    for i in range(size):
+        batch.append(bot.make_record(SEED_USER + i, {
+            'experience': 'ДА' if i % 2 else 'НЕТ',
+            'citizenship': ('Россия', 'СНГ', 'Другое')[i % 3],
+            'fio': f'Иванов Иван Иванович {i}',
+            'age': 20 + i % 40,
+            'city': ('Москва', 'Тула', 'Казань')[i % 3],
+            'phone': f'+7999{i:07d}',
+        }))
+        if len(batch) == 10_000:
+            bot.store.add_many(batch)
+            batch = []
+    if batch:
+        bot.store.add_many(batch)
+    bot.cache.load(bot.store.records())
+
+
+async def run_scenario(application, scripts: list) -> dict:
+    """Прогоняет сценарии пользователей последовательно, замеряя каждое обновление."""
+    latencies = []
+    started = time.perf_counter()
+    for user_id, answers in scripts:
+        for text in answers:
+            update = Update.de_json(make_update(user_id, text), application.bot)
+            update_started = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - update_started)
+    elapsed = time.perf_counter() - started
+    result = {
+        "updates": len(latencies),
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(len(latencies) / elapsed, 1),
+    }
+    for q in (50, 95, 99):
+        result[f"p{q}_latency_ms"] = round(percentile(latencies, q) * 1000, 3)
+    result["max_latency_ms"] = round(max(latencies) * 1000, 3)
+    return result
+
+
+async def run_child(bot, size: int, users: int, admin_rounds: int) -> dict:
+    timings = defaultdict(list)
+    instrument_storage(bot, timings)
+    application = bot.build_application(FAKE_TOKEN, request=FakeTelegramRequest())
+    # Без start(): задачи job_queue (рассылка, сброс журнала) не запускаются и не искажают замеры
+    await application.initialize()
+
+    admin_id = min(bot.ADMIN_IDS)
+    scenarios = {
+        "form": [(user_id, FORM_ANSWERS) for user_id in range(1, users + 1)],
+        "resubmit": [(SEED_USER + i, FORM_ANSWERS) for i in range(admin_rounds, admin_rounds + min(users, size))],
+        "vacancies": [(user_id, VACANCY_ANSWERS) for user_id in range(users + 1, 2 * users + 1)],
+        "admin": [(admin_id, admin_answers(SEED_USER + i)) for i in range(admin_rounds)],
+    }
+    results = {}
+    for name, scripts in scenarios.items():
+        results[name] = await run_scenario(application, scripts)
+        # Анкеты из журнала записываются в хранилище в рамках сценария
+        await bot.journal.flush()
+
+    await application.shutdown()
+    return {
+        "backend": bot.STORAGE_BACKEND,
+        "applicants": size,
+        "scenarios": results,
+        "storage": {name: summary_ms(durations) for name, durations in sorted(timings.items())},
+    }
+
+
+def child(backend: str, size: int, users: int, admin_rounds: int, workdir: str):
+    os.chdir(workdir)
+    os.environ["STORAGE_BACKEND"] = backend
+    bot = load_bot()
+    bot.init_storage()
+    seed_started = time.perf_counter()
+    seed(bot, size)
+    seed_seconds = time.perf_counter() - seed_started
+    try:
+        result = asyncio.run(run_child(bot, size, users, admin_rounds))
+    finally:
+        bot.journal.close()
+        bot.storage.shutdown()
+        bot.store.close()
+        bot.broadcasts.close()
+        bot.persistence.close()
+    result["seed_seconds"] = round(seed_seconds, 2)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> bool:
+    """Печатает сценарии, у которых p95 вырос больше чем на tolerance; возвращает True при регрессии."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(item["backend"], item["applicants"]): item for item in json.load(f)}
+    regressed = False
+    for result in results:
+        previous = baseline.get((result["backend"], result["applicants"]))
+        if previous is None:
+            continue
+        for name, scenario in result["scenarios"].items():
+            before = previous["scenarios"].get(name, {}).get("p95_latency_ms")
+            after = scenario["p95_latency_ms"]
+            if before and after > before * (1 + tolerance):
+                regressed = True
+                print(f"Регрессия: {result['backend']} {result['applicants']} {name}: p95 {before} → {after} мс")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    parser.add_argument("--backends", nargs="+", default=["sqlite"], choices=["sqlite", "excel"])
+    parser.add_argument("--users", type=int, default=200, help="пользователей в сценариях form и vacancies")
+    parser.add_argument("--admin-rounds", type=int, default=5, help="повторов сценария admin")
+    parser.add_argument("--output", help="записать результаты в JSON-файл")
+    parser.add_argument("--baseline", help="JSON прошлого прогона: сравнить p95 и завершиться с ошибкой при регрессии")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимый рост p95 относительно --baseline")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        backend, size = args.child
+        child(backend, int(size), args.users, args.admin_rounds, args.workdir)
+        return
+
+    results = []
+    for backend in args.backends:
+        for size in args.sizes:
+            # Отдельный процесс и каталог: состояние модуля и файлы не переходят между прогонами
+            with tempfile.TemporaryDirectory() as workdir:
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--child", backend, str(size),
+                     "--users", str(args.users), "--admin-rounds", str(args.admin_rounds), "--workdir", workdir],
+                    capture_output=True, text=True, check=True
+                ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            results.append(result)
+            for name, scenario in result["scenarios"].items():
+                print(
+                    f"{backend:>6} {size:>7} {name:<9} {scenario['updates_per_second']:>9.1f} обновл./с  "
+                    f"p50 {scenario['p50_latency_ms']:>8.2f}  p95 {scenario['p95_latency_ms']:>8.2f}  "
+                    f"p99 {scenario['p99_latency_ms']:>8.2f} мс"
+                )
+            storage_ms = sum(op["total_ms"] for op in result["storage"].values())
+            print(f"{backend:>6} {size:>7} хранилище: {storage_ms:.1f} мс всего")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
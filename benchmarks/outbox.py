@@ -0,0 +1,208 @@
+"""Отправка анкет во внешнюю систему через очередь applicant_outbox (OutboxSender).
+
+Пользователи заполняют и отправляют анкету через то же Application, что и
+в main(), а фоновая задача, как deliver_outbox, сбрасывает журнал и
+отправляет очередь в локальную заглушку HR/CRM-системы. Заглушка отвечает
+с задержкой --latency, часть запросов отклоняет с 503 (--fail), на часть
+не успевает ответить до таймаута, хотя пачку уже приняла (--lost, ответ
+потерян), и отклоняет с 400 пачки с «некорректной» анкетой (каждый
+--poison-every-й пользователь). Часть пользователей подает анкету повторно.
+
+Проверяется:
+- время ответа на «✅ Отправить» не зависит от задержки внешней системы;
+- каждая анкета (и повторная — как новая версия) принята ровно один раз
+  по id, повторы пачек после потерянных ответов отброшены по id;
+- отклонена только некорректная анкета, остальные из ее пачки доставлены;
+- повтор журнала после сбоя не ставит доставленные анкеты в очередь снова.
+
+    python benchmarks/outbox.py --users 500 --latency 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from telegram import Update
+
+from common import FAKE_TOKEN, FORM_ANSWERS, FakeTelegramRequest, load_bot, make_update, percentile
+
+POISON_FIO = "Отказов Отказ Отказович"
+
+
+def stand_in_class(bot):
+    class StandIn(bot.HTTPServer):
+        """Заглушка HR/CRM-системы: принимает JSON-массив анкет, отбрасывает уже принятые id."""
+
+        def __init__(self, latency: float, fail: float, lost: float, lost_delay: float):
+            super().__init__("127.0.0.1", 0)
+            self.latency = latency
+            self.fail = fail
+            self.lost = lost
+            self.lost_delay = lost_delay
+            self.accepted = {}
+            self.duplicates = 0
+            self.requests = 0
+            self.statuses = {}
+
+        def _status(self, status: int) -> int:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            return status
+
+        async def handle(self, method, path, headers, body):
+            self.requests += 1
+            if headers.get("authorization") != "Bearer outbox-token":
+                return self._status(401), b"", {}
+            await asyncio.sleep(self.latency)
+            if random.random() < self.fail:
+                return self._status(503), b"busy", {}
+            items = json.loads(body)
+            if any(item["fio"] == POISON_FIO for item in items):
+                return self._status(400), "некорректное ФИО".encode(), {}
+            for item in items:
+                if item["id"] in self.accepted:
+                    self.duplicates += 1
+                else:
+                    self.accepted[item["id"]] = item
+            if random.random() < self.lost:
+                # Пачка принята, но ответ не успевает до таймаута бота: бот повторит ее
+                await asyncio.sleep(self.lost_delay)
+            return self._status(200), b"{}", {}
+
+    return StandIn
+
+
+async def deliver_loop(bot, stop: asyncio.Event, interval: float):
+    """То же, что flush_journal и deliver_outbox в job_queue."""
+    while not stop.is_set():
+        await bot.journal.flush_logged()
+        await bot.outbox.deliver()
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def submit_forms(application, user_ids, poison_every: int, latencies: list):
+    for user_id in user_ids:
+        for text in FORM_ANSWERS:
+            if text == "Иванов Иван Иванович" and poison_every and user_id % poison_every == 0:
+                text = POISON_FIO
+            update = Update.de_json(make_update(user_id, text), application.bot)
+            started = time.perf_counter()
+            await application.process_update(update)
+            if text == "✅ Отправить":
+                latencies.append(time.perf_counter() - started)
+
+
+async def run(bot, args) -> dict:
+    random.seed(1)
+    server = stand_in_class(bot)(args.latency, args.fail, args.lost, bot.OUTBOX_TIMEOUT * 2)
+    await server.start()
+    bot.OUTBOX_URL = f"http://127.0.0.1:{server.port}/applicants"
+    bot.OUTBOX_TOKEN = "outbox-token"
+    bot.init_storage()
+    application = bot.build_application(FAKE_TOKEN, request=FakeTelegramRequest())
+    await application.initialize()
+
+    stop = asyncio.Event()
+    delivery = asyncio.create_task(deliver_loop(bot, stop, args.interval))
+    latencies = []
+    user_ids = list(range(1_000_000, 1_000_000 + args.users))
+    started = time.monotonic()
+    await submit_forms(application, user_ids, args.poison_every, latencies)
+    # Повторные анкеты — не в ту же секунду, что и первые (created_at с точностью до секунды)
+    await asyncio.sleep(1.1)
+    resubmitted = user_ids[:args.users // 10]
+    await submit_forms(application, resubmitted, 0, latencies)
+    submitted = time.monotonic() - started
+
+    # Дожидаемся опустошения очереди: сброс журнала и отправка идут в фоне
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        if not bot.journal.pending() and not bot.store.outbox_pending(1):
+            break
+    delivered_seconds = time.monotonic() - started
+    stop.set()
+    await delivery
+
+    conn = bot.store.conn
+    statuses = dict(conn.execute("SELECT status, COUNT(*) FROM applicant_outbox GROUP BY status").fetchall())
+    # Повтор журнала после сбоя между записью в базу и удалением журнала: те же анкеты еще раз
+    replayed = [json.loads(row[0]) for row in conn.execute("SELECT payload FROM applicant_outbox ORDER BY id")]
+    bot.store.add_many(replayed)
+    statuses_after_replay = dict(conn.execute("SELECT status, COUNT(*) FROM applicant_outbox GROUP BY status").fetchall())
+    delivered_ids = {row[0] for row in conn.execute("SELECT id FROM applicant_outbox WHERE status = 'delivered'")}
+    attempts = conn.execute("SELECT MAX(attempts) FROM applicant_outbox").fetchone()[0]
+
+    await application.shutdown()
+    await bot.outbox.close()
+    await server.stop()
+    bot.release_storage()
+
+    poison = {user_id for user_id in user_ids if args.poison_every and user_id % args.poison_every == 0}
+    # Сколько версий анкеты каждого пользователя должна получить внешняя система
+    expected = {user_id: (user_id not in poison) + (user_id in resubmitted) for user_id in user_ids}
+    expected = {user_id: count for user_id, count in expected.items() if count}
+    received = {}
+    for item in server.accepted.values():
+        received[item["user_id"]] = received.get(item["user_id"], 0) + 1
+    return {
+        "submitted_seconds": submitted,
+        "delivered_seconds": delivered_seconds,
+        "confirm_p50_ms": percentile(latencies, 50) * 1000,
+        "confirm_p95_ms": percentile(latencies, 95) * 1000,
+        "requests": server.requests,
+        "http_statuses": server.statuses,
+        "duplicates": server.duplicates,
+        "max_attempts": attempts,
+        "checks": {
+            "все анкеты доставлены ровно один раз": received == expected,
+            "доставленное в базе совпадает с принятым": delivered_ids == set(server.accepted),
+            "отклонены только некорректные": statuses.get("rejected", 0) == len(poison) and not any(item["fio"] == POISON_FIO for item in server.accepted.values()),
+            "очередь пуста": "pending" not in statuses,
+            "повтор журнала не ставит в очередь": statuses_after_replay == statuses,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.2, help="задержка ответа внешней системы, с")
+    parser.add_argument("--fail", type=float, default=0.2, help="доля запросов с ответом 503")
+    parser.add_argument("--lost", type=float, default=0.1, help="доля принятых пачек, ответ на которые теряется")
+    parser.add_argument("--poison-every", type=int, default=97, help="каждый N-й пользователь — некорректная анкета")
+    parser.add_argument("--interval", type=float, default=0.2, help="период задачи отправки, с")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    bot = load_bot()
+    # Строка журнала на каждый запрос к заглушке не нужна: итоги печатаются в конце
+    logging.getLogger().setLevel(logging.WARNING)
+    # Короткие таймаут и паузы, чтобы прогон с ошибками занимал секунды
+    bot.OUTBOX_TIMEOUT = max(0.5, args.latency * 3)
+    bot.OUTBOX_RETRY_MIN = 0.05
+    bot.OUTBOX_RETRY_MAX = 0.5
+    bot.OUTBOX_BATCH_SIZE = 50
+    result = asyncio.run(run(bot, args))
+
+    print(f"Анкет: {args.users} + {args.users // 10} повторных, отправлены за {result['submitted_seconds']:.2f} с, "
+          f"доставлены за {result['delivered_seconds']:.2f} с")
+    print(f"«✅ Отправить»: p50 {result['confirm_p50_ms']:.2f} мс, p95 {result['confirm_p95_ms']:.2f} мс "
+          f"(задержка внешней системы {args.latency * 1000:.0f} мс)")
+    print(f"Запросов к внешней системе: {result['requests']}, ответы: {result['http_statuses']}, "
+          f"повторно присланных и отброшенных по id: {result['duplicates']}, наибольшее число попыток: {result['max_attempts']}")
+    for name, ok in result["checks"].items():
+        print(f"{name}: {'OK' if ok else 'ОШИБКА'}")
+    ok = all(result["checks"].values()) and result["confirm_p95_ms"] < args.latency * 1000
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Время запуска и сохранения: SQLitePersistence против PicklePersistence.
+
+Для каждого числа пользователей создается состояние как у работающего
+бота: у всех есть запись разговора, у 10% — незаконченная анкета в
+user_data. Затем измеряется:
+  startup — загрузка user_data и разговоров при запуске;
+  flush   — сохранение одного цикла с --dirty изменившимися пользователями
+            (для PicklePersistence в лучшем режиме on_flush=True:
+            один полный дамп вместо дампа на каждое изменение).
+С --stale доля пользователей не появлялась дольше TTL: PicklePersistence
+загружает их все равно, SQLitePersistence — нет.
+
+    python benchmarks/persistence.py --sizes 10000,100000,1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import pickle
+import tempfile
+import time
+
+from telegram.ext import PicklePersistence
+
+from common import load_bot
+
+CONVERSATION = "main_conversation"
+PARTIAL_FORM = {'experience': 'ДА', 'citizenship': 'Россия', 'fio': 'Иванов Иван Иванович'}
+
+
+def make_state(users: int):
+    user_data = {user_id: (dict(PARTIAL_FORM) if user_id % 10 == 0 else {}) for user_id in range(users)}
+    conversations = {(user_id, user_id): 0 for user_id in range(users)}
+    return user_data, conversations
+
+
+async def bench_pickle(path: str, users: int, dirty: int) -> dict:
+    user_data, conversations = make_state(users)
+    with open(path, "wb") as f:
+        pickle.dump({
+            'user_data': user_data, 'chat_data': {}, 'bot_data': {},
+            'callback_data': None, 'conversations': {CONVERSATION: conversations},
+        }, f)
+    del user_data, conversations
+
+    persistence = PicklePersistence(filepath=path, on_flush=True)
+    started = time.perf_counter()
+    await persistence.get_user_data()
+    await persistence.get_conversations(CONVERSATION)
+    startup = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for user_id in range(dirty):
+        await persistence.update_user_data(user_id, dict(PARTIAL_FORM))
+        await persistence.update_conversation(CONVERSATION, (user_id, user_id), 1)
+    await persistence.flush()
+    flush = time.perf_counter() - started
+    return {"startup_s": round(startup, 3), "flush_s": round(flush, 3), "file_mb": round(os.path.getsize(path) / 2**20, 1)}
+
+
+async def bench_sqlite(bot, users: int, dirty: int, stale: float) -> dict:
+    persistence = bot.persistence
+    now = time.time()
+    stale_users = int(users * stale)
+    expired = now - persistence.ttl - 3600
+
+    def updated_at(user_id):
+        return expired if user_id < stale_users else now
+
+    blob = pickle.dumps(PARTIAL_FORM)
+    with persistence.conn:
+        persistence.conn.execute("DELETE FROM persist_user_data")
+        persistence.conn.execute("DELETE FROM persist_conversations")
+        # Пустые user_data SQLitePersistence не хранит
+        persistence.conn.executemany(
+            "INSERT INTO persist_user_data VALUES (?, ?, ?)",
+            ((user_id, blob, updated_at(user_id)) for user_id in range(0, users, 10))
+        )
+        persistence.conn.executemany(
+            "INSERT INTO persist_conversations VALUES (?, ?, ?, ?)",
+            ((CONVERSATION, f"{user_id},{user_id}", 0, updated_at(user_id)) for user_id in range(users))
+        )
+
+    started = time.perf_counter()
+    await persistence.get_user_data()
+    await persistence.get_conversations(CONVERSATION)
+    startup = time.perf_counter() - started
+
+    started = time.perf_counter()
+    # Как Application.update_persistence: все изменения цикла отправляются разом
+    await asyncio.gather(*(
+        coroutine
+        for user_id in range(dirty)
+        for coroutine in (
+            persistence.update_user_data(user_id, dict(PARTIAL_FORM)),
+            persistence.update_conversation(CONVERSATION, (user_id, user_id), 1),
+        )
+    ))
+    await persistence.flush()
+    flush = time.perf_counter() - started
+    return {"startup_s": round(startup, 3), "flush_s": round(flush, 3), "file_mb": round(os.path.getsize(bot.DB_FILE) / 2**20, 1)}
+
+
+async def run(sizes, dirty, stale):
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        bot = load_bot()
+        bot.init_storage()
+        for users in sizes:
+            pickle_result = await bench_pickle(os.path.join(workdir, "bot_data_bench"), users, dirty)
+            sqlite_result = await bench_sqlite(bot, users, dirty, stale)
+            print(json.dumps({
+                "users": users, "dirty": dirty, "stale": stale,
+                "pickle": pickle_result, "sqlite": sqlite_result,
+            }))
+        await bot.close_storage(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--dirty", type=int, default=100, help="изменившихся пользователей за цикл")
+    parser.add_argument("--stale", type=float, default=0.0, help="доля пользователей старше TTL")
+    args = parser.parse_args()
+    asyncio.run(run([int(size) for size in args.sizes.split(",")], args.dirty, args.stale))
+
+
+if __name__ == "__main__":
+    main()
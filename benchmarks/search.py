@@ -0,0 +1,135 @@
+"""Скорость поиска анкет по индексам кэша (ApplicantCache.search).
+
+Заполняет кэш синтетическими анкетами и для набора типичных запросов админа
+замеряет время поиска по индексам и полного перебора анкет с теми же
+условиями; результаты обоих способов сравниваются. Дополнительно выводятся
+время загрузки кэша, объем его памяти и время приема и удаления анкеты
+(поддержка индексов).
+
+    python benchmarks/search.py --size 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from common import load_bot
+
+CITIES = ["Москва", "Тула", "Казань", "Самара", "Омск", "Пермь", "Уфа"]
+FIRST_NAMES = ["Иван", "Петр", "Сергей", "Алексей", "Дмитрий", "Андрей", "Михаил", "Николай"]
+LAST_NAMES = ["Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Волков", "Соколов", "Лебедев", "Козлов"]
+
+
+def synthetic_rows(bot, size: int) -> list:
+    random.seed(1)
+    rows = []
+    for i in range(size):
+        record = bot.make_record(1_000_000 + i, {
+            "experience": random.choice(["ДА", "НЕТ"]),
+            "citizenship": random.choice(["Россия", "СНГ", "Другое"]),
+            "fio": f"{random.choice(LAST_NAMES)}{i % 997} {random.choice(FIRST_NAMES)} {random.choice(FIRST_NAMES)}ович",
+            "age": random.randint(18, 70),
+            "city": random.choice(CITIES),
+            "phone": f"+7{random.randint(9_000_000_000, 9_999_999_999)}",
+        })
+        record["created_at"] = f"2026-{1 + i % 9:02d}-{1 + i % 28:02d} 10:00:00"
+        rows.append(tuple(record[name] for name in bot.RECORD_FIELDS))
+    return rows
+
+
+def scan(bot, cache, query) -> list:
+    """Тот же поиск полным перебором: эталон для проверки и сравнения."""
+    def matches(a):
+        for name in ("city", "citizenship", "experience"):
+            value = getattr(query, name)
+            if value is not None and (getattr(a, name) is None or bot.normalize_text(getattr(a, name)) != bot.normalize_text(value)):
+                return False
+        if query.age_min is not None and not (isinstance(a.age, int) and a.age >= query.age_min):
+            return False
+        if query.age_max is not None and not (isinstance(a.age, int) and a.age <= query.age_max):
+            return False
+        day = a.created_at[:10] if a.created_at else None
+        if query.date_from is not None and not (day and day >= query.date_from):
+            return False
+        if query.date_to is not None and not (day and day <= query.date_to):
+            return False
+        if query.fio:
+            words = bot.normalize_text(a.fio or "").split()
+            if not all(any(w.startswith(prefix) for w in words) for prefix in bot.normalize_text(query.fio).split()):
+                return False
+        if query.phone and not bot.phone_digits(a.phone or "").startswith(bot.phone_digits(query.phone)):
+            return False
+        return True
+
+    return [a for a in cache._records.values() if matches(a)]
+
+
+def median_ms(func, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    bot = load_bot()
+    Q = bot.ApplicantQuery
+    queries = {
+        "город": Q(city="москва"),
+        "город + опыт": Q(city="Москва", experience="да"),
+        "город + гражданство + возраст": Q(city="Москва", citizenship="Россия", age_min=25, age_max=30),
+        "возраст": Q(age_min=30, age_max=32),
+        "даты": Q(date_from="2026-03-01", date_to="2026-03-03"),
+        "фио": Q(fio="иванов1"),
+        "фио, два слова": Q(fio="Соколов12 Иван"),
+        "телефон": Q(phone="+7900"),
+        "фио + город": Q(fio="петр", city="Тула"),
+    }
+
+    rows = synthetic_rows(bot, args.size)
+    cache = bot.ApplicantCache()
+    started = time.perf_counter()
+    cache.load(rows)
+    print(f"Анкет: {len(cache)}, загрузка: {time.perf_counter() - started:.2f} с, "
+          f"память: {cache.memory_usage() / 2**20:.1f} МБ")
+
+    ok = True
+    print(f"{'запрос':<32}{'найдено':>9}{'индексы, мс':>14}{'перебор, мс':>14}")
+    for name, query in queries.items():
+        found = cache.search(query)
+        expected = scan(bot, cache, query)
+        ok &= found == expected
+        indexed = median_ms(lambda: cache.search(query), args.repeat)
+        scanned = median_ms(lambda: scan(bot, cache, query), max(1, args.repeat // 10))
+        print(f"{name:<32}{len(found):>9}{indexed:>14.3f}{scanned:>14.1f}")
+
+    records = [bot.make_record(5_000_000 + i, {
+        "experience": "ДА", "citizenship": "Россия", "fio": f"Тестов{i} Тест Тестович",
+        "age": 30, "city": "Москва", "phone": f"+7000{i:07d}",
+    }) for i in range(1000)]
+    started = time.perf_counter()
+    for record in records:
+        cache.add(record)
+    added = (time.perf_counter() - started) / len(records)
+    started = time.perf_counter()
+    for record in records:
+        cache.delete_user(record["user_id"])
+    deleted = (time.perf_counter() - started) / len(records)
+    print(f"Прием анкеты: {added * 1e6:.0f} мкс, удаление: {deleted * 1e6:.0f} мкс")
+
+    print("OK" if ok else "ОШИБКА: результаты поиска не совпадают с перебором")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Ответы пользователям во время долгой записи в хранилище (StorageExecutor).
+
+Строит то же Application, что и main() (build_application), на заглушке
+Bot API и запускает долгую запись пачки анкет: add_many хранилища
+замедлена на --write-seconds (как перезапись большого Excel-файла), а с
+--backend excel к задержке добавляется настоящая перезапись ExcelStore
+с --rows строками.
+Пока запись идет, --users других пользователей проходят анкету и
+дожидаются ответа на каждое сообщение.
+
+Прогон повторяется и со старым поведением — та же запись прямо в event
+loop, как до StorageExecutor, — чтобы было видно, что без отдельного
+потока ответы ждут конца записи.
+
+Проверяется: с StorageExecutor все ответы пришли, пока запись еще шла,
+и ни один не ждал дольше --bound секунд.
+
+    python benchmarks/slow_write.py --users 50 --write-seconds 3
+"""
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from telegram import Update
+
+from common import FAKE_TOKEN, FORM_ANSWERS, FakeTelegramRequest, load_bot, make_update
+
+
+def slow_store(bot, write_seconds: float) -> threading.Event:
+    """Замедляет add_many хранилища; событие устанавливается, когда запись началась."""
+    started = threading.Event()
+    add_many = bot.store.add_many
+
+    @functools.wraps(add_many)
+    def slow_add_many(records):
+        started.set()
+        # Блокирующее ожидание, как у pandas: поток занят целиком
+        time.sleep(write_seconds)
+        add_many(records)
+
+    bot.store.add_many = slow_add_many
+    return started
+
+
+def seed(bot, rows: int):
+    batch = [bot.make_record(10_000_000 + i, {
+        "experience": "ДА", "citizenship": "Россия", "fio": f"Иванов Иван Иванович {i}",
+        "age": 30, "city": "Москва", "phone": f"+7999{i:07d}",
+    }) for i in range(rows)]
+    bot.store.add_many(batch)
+
+
+async def walk_form(application, request, user_id: int, latencies: list):
+    """Пользователь отвечает по одному сообщению, дожидаясь ответа бота на каждое."""
+    for text in FORM_ANSWERS:
+        before = request.sent[user_id]
+        sent_at = time.monotonic()
+        application.update_queue.put_nowait(Update.de_json(make_update(user_id, text), application.bot))
+        while request.sent[user_id] == before:
+            await asyncio.sleep(0.001)
+        latencies.append(time.monotonic() - sent_at)
+
+
+async def run_case(bot, through_executor: bool, users: int, first_user: int, write_seconds: float) -> dict:
+    request = FakeTelegramRequest()
+    application = bot.build_application(FAKE_TOKEN, request=request)
+    await application.initialize()
+    await application.start()
+
+    records = [bot.make_record(first_user - 1 - i, {
+        "experience": "НЕТ", "citizenship": "СНГ", "fio": "Петров Петр Петрович",
+        "age": 40, "city": "Тула", "phone": f"+7888{i:07d}",
+    }) for i in range(100)]
+    latencies = []
+    walking = asyncio.gather(*(walk_form(application, request, user_id, latencies)
+                               for user_id in range(first_user, first_user + users)))
+    # Запись начинается, когда пользователи уже в середине анкеты
+    await asyncio.sleep(0.05)
+    started = slow_store(bot, write_seconds)
+    write_started = time.monotonic()
+    if through_executor:
+        write = asyncio.create_task(bot.storage.write(bot.store.add_many, records))
+        await asyncio.to_thread(started.wait)
+    else:
+        # Как до StorageExecutor: запись прямо в обработчике, в потоке event loop
+        async def blocking_write():
+            bot.store.add_many(records)
+        write = asyncio.create_task(blocking_write())
+    await walking
+    answered = time.monotonic() - write_started
+    write_running = not write.done()
+    await write
+    written = time.monotonic() - write_started
+
+    await application.stop()
+    await application.shutdown()
+    bot.store.add_many = bot.store.add_many.__wrapped__
+    saved = sum(1 for user_id in range(first_user, first_user + users) if bot.cache.by_user(user_id))
+    return {
+        "answered_seconds": answered,
+        "write_seconds": written,
+        "answered_during_write": write_running,
+        "max_latency": max(latencies),
+        "saved": saved,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--write-seconds", type=float, default=3, help="насколько замедлить запись пачки")
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "excel"])
+    parser.add_argument("--rows", type=int, default=5000, help="анкет в хранилище до записи")
+    parser.add_argument("--bound", type=float, default=0.5, help="допустимое время ответа во время записи, с")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        os.environ["STORAGE_BACKEND"] = args.backend
+        bot = load_bot()
+        logging.getLogger().setLevel(logging.WARNING)
+        # Журнал не сбрасывается в хранилище во время замера: пишет только долгая запись
+        bot.JOURNAL_BATCH_SIZE = 10 ** 9
+        bot.JOURNAL_FLUSH_INTERVAL = 3600
+        bot.init_storage()
+        seed(bot, args.rows)
+
+        async def run():
+            results = {}
+            for index, (name, through_executor) in enumerate((("StorageExecutor", True), ("в event loop", False))):
+                results[name] = await run_case(bot, through_executor, args.users, 1_000_000 * (index + 1), args.write_seconds)
+            await bot.journal.flush()
+            return results
+
+        try:
+            results = asyncio.run(run())
+        finally:
+            bot.release_storage()
+
+    for name, result in results.items():
+        print(
+            f"{name:>16}: запись {result['write_seconds']:.2f} с, все {args.users} пользователей получили ответы "
+            f"за {result['answered_seconds']:.2f} с (пока шла запись: {'да' if result['answered_during_write'] else 'нет'}), "
+            f"самый долгий ответ {result['max_latency'] * 1000:.0f} мс, анкет {result['saved']}/{args.users}"
+        )
+    result = results["StorageExecutor"]
+    ok = result["answered_during_write"] and result["max_latency"] < args.bound and result["saved"] == args.users
+    print("OK" if ok else "ОШИБКА")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Время запуска и память бота: текущий код против прежней версии.
+
+Каждый замер — отдельный «холодный» интерпретатор, который импортирует
+HR-Bot.py и открывает хранилище (init_storage, если он есть в версии).
+Выводятся медианы времени импорта, времени всего процесса и пиковой
+памяти (RSS), а также то, загружен ли pandas. Прежняя версия берется из
+git (по умолчанию — первый коммит репозитория).
+
+    python benchmarks/startup.py --runs 7
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import BOT_FILE, baseline_source
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CHILD = """
+import time
+started = time.perf_counter()
+import json, resource, sys
+sys.path.insert(0, {here!r})
+from common import load_bot
+bot = load_bot("hr_bot", {path!r})
+imported = time.perf_counter()
+if hasattr(bot, "init_storage"):
+    bot.init_storage()
+print(json.dumps({{
+    "import_seconds": imported - started,
+    "startup_seconds": time.perf_counter() - started,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "pandas_loaded": "pandas" in sys.modules,
+}}))
+"""
+
+
+def measure(path: str, runs: int, workdir: str) -> dict:
+    samples = []
+    for _ in range(runs):
+        # Каждый запуск — в пустом каталоге, чтобы хранилище создавалось заново
+        with tempfile.TemporaryDirectory(dir=workdir) as rundir:
+            started = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, "-c", CHILD.format(here=HERE, path=path)],
+                cwd=rundir, capture_output=True, text=True, check=True
+            ).stdout
+            sample = json.loads(output.strip().splitlines()[-1])
+            sample["process_seconds"] = time.perf_counter() - started
+            samples.append(sample)
+    result = {
+        key: round(statistics.median(sample[key] for sample in samples), 3)
+        for key in ("import_seconds", "startup_seconds", "process_seconds", "peak_rss_mb")
+    }
+    result["pandas_loaded"] = any(sample["pandas_loaded"] for sample in samples)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--baseline", default="", help="ревизия git для сравнения")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        baseline_file = os.path.join(workdir, "HR-Bot-baseline.py")
+        with open(baseline_file, "w", encoding="utf-8") as f:
+            f.write(baseline_source(args.baseline))
+        result = {
+            "runs": args.runs,
+            "baseline": measure(baseline_file, args.runs, workdir),
+            "current": measure(BOT_FILE, args.runs, workdir),
+        }
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
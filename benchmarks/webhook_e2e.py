@@ -0,0 +1,132 @@
+"""Сквозная проверка режима webhook без Telegram.
+
+Поднимает бота в режиме webhook на локальном порту (ответы Bot API уходят в
+заглушку), отправляет POST-запросами записанные обновления — полный проход
+анкеты для каждого пользователя — и проверяет, что анкеты сохранены, а на
+каждое сообщение пришел ответ. Дополнительно проверяются ответы 403 (неверный
+секрет) и 400 (не JSON), а при маленькой очереди — ответы 503 и повторная
+доставка, как это делает Telegram.
+
+    python benchmarks/webhook_e2e.py --users 200 --queue-size 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from common import FAKE_TOKEN, FORM_ANSWERS, FakeTelegramRequest, load_bot, make_update
+
+SECRET = "e2e-secret"
+
+
+class Client:
+    """Минимальный HTTP/1.1-клиент с keep-alive, как у серверов Telegram."""
+
+    def __init__(self, port: int, path: str):
+        self.port = port
+        self.path = path
+        self.reader = self.writer = None
+
+    async def post(self, body: bytes, secret: str = SECRET) -> int:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+        head = (
+            f"POST {self.path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+            f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\nContent-Length: {len(body)}\r\n\r\n"
+        )
+        self.writer.write(head.encode("latin-1") + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        close = False
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            if line.lower().startswith(b"connection: close"):
+                close = True
+        if close:
+            await self.close()
+        return status
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+async def simulate_user(port: int, path: str, user_id: int, stats: dict):
+    client = Client(port, path)
+    for text in FORM_ANSWERS:
+        body = json.dumps(make_update(user_id, text)).encode()
+        while True:
+            status = await client.post(body)
+            if status != 503:
+                break
+            # Telegram повторяет доставку, пока не получит 200
+            stats["503"] += 1
+            await asyncio.sleep(0.05)
+        assert status == 200, f"неожиданный ответ {status}"
+        stats["posted"] += 1
+    await client.close()
+
+
+async def run(bot_module, users: int, latency: float):
+    request = FakeTelegramRequest(latency=latency)
+    application = bot_module.build_application(FAKE_TOKEN, request=request)
+    stop = asyncio.Event()
+    runner = asyncio.create_task(bot_module.run_webhook(application, stop))
+    while bot_module.webhook_server is None:
+        await asyncio.sleep(0.01)
+    server = bot_module.webhook_server
+
+    probe = Client(server.port, server.path)
+    forbidden = await probe.post(json.dumps(make_update(1, "/start")).encode(), secret="wrong")
+    bad_request = await probe.post(b"not json")
+    await probe.close()
+
+    stats = {"posted": 0, "503": 0}
+    user_ids = range(10_000, 10_000 + users)
+    started = time.monotonic()
+    await asyncio.gather(*(simulate_user(server.port, server.path, user_id, stats) for user_id in user_ids))
+    await server.queue.join()
+    elapsed = time.monotonic() - started
+
+    stop.set()
+    await runner
+
+    silent = [user_id for user_id in user_ids if request.sent[user_id] < len(FORM_ANSWERS)]
+    saved = {user_id for user_id in user_ids if bot_module.cache.by_user(user_id)}
+    print(f"Неверный секрет: {forbidden}, не JSON: {bad_request}")
+    print(f"Пользователей: {users}, обновлений: {stats['posted']}, ответов 503: {stats['503']}")
+    print(f"Время: {elapsed:.2f} с, скорость: {stats['posted'] / elapsed:.0f} обновл./с")
+    print(f"Анкет сохранено: {len(saved)} из {users}, без ответа: {len(silent)}")
+    ok = forbidden == 403 and bad_request == 400 and len(saved) == users and not silent
+    print("OK" if ok else "ОШИБКА")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--queue-size", type=int, default=8, help="WEBHOOK_QUEUE_SIZE бота")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа заглушки Bot API, с")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        bot_module = load_bot()
+        bot_module.WEBHOOK_LISTEN = "127.0.0.1"
+        bot_module.WEBHOOK_PORT = 0
+        bot_module.WEBHOOK_SECRET = SECRET
+        bot_module.WEBHOOK_QUEUE_SIZE = args.queue_size
+        bot_module.METRICS_PORT = 0
+        bot_module.init_storage()
+        # Хранилище закрывается в post_shutdown вместе с приложением
+        ok = asyncio.run(run(bot_module, args.users, args.latency))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Масштабирование на несколько процессов-обработчиков (BOT_WORKERS).
+
+Запускает бота отдельным процессом в режиме webhook: при BOT_WORKERS=1 — как
+раньше, одним процессом, при BOT_WORKERS=N — приемник и N обработчиков.
+Ответы Bot API уходят в локальную заглушку (BOT_API_URL), которая работает
+в нескольких процессах на одном порту (SO_REUSEPORT), чтобы не стать узким
+местом. Пользователи проходят анкету; обновления идут POST-запросами по
+нескольким keep-alive соединениям, как их шлет Telegram, обновления одного
+пользователя — по порядку в одном соединении.
+
+Время прогона — от первого обновления до последнего ответа бота в заглушке.
+После остановки бота проверяется, что все анкеты записаны в общую базу, а
+сообщений об ошибке ввода (признак нарушенного порядка) нет.
+
+Рост скорости с числом обработчиков ограничен числом ядер: приемнику,
+заглушке и генератору тоже нужны ядра, поэтому почти линейный рост видно,
+только когда ядер заметно больше, чем обработчиков. Число ядер печатается.
+
+    python benchmarks/workers.py --workers 1 2 4 --users 2000
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qsl
+
+from common import BOT_FILE, FAKE_TOKEN, FORM_ANSWERS, FakeTelegramRequest, load_bot, make_update
+from webhook_e2e import Client
+
+SECRET = "workers-secret"
+# На анкету: ответ на каждое сообщение, а после отправки — еще и главное меню
+REPLIES_PER_FORM = len(FORM_ANSWERS) + 1
+
+
+def free_port(count: int = 1) -> int:
+    """Свободный порт, за которым свободны еще count - 1 подряд."""
+    while True:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            base = probe.getsockname()[1]
+        try:
+            for port in range(base, base + count):
+                with socket.socket() as s:
+                    s.bind(("127.0.0.1", port))
+            return base
+        except OSError:
+            continue
+
+
+def api_process(port: int, sent, errors, latency: float):
+    """Процесс заглушки Bot API: отвечает как FakeTelegramRequest и считает ответы бота."""
+    bot = load_bot()
+    fake = FakeTelegramRequest()
+
+    class FakeBotAPI(bot.HTTPServer):
+        async def start(self):
+            self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port, reuse_port=True)
+
+        async def handle(self, method, path, headers, body):
+            api_method = path.rsplit("/", 1)[-1]
+            params = dict(parse_qsl(body.decode()))
+            if api_method == "sendMessage":
+                with sent.get_lock():
+                    sent.value += 1
+                if params.get("text", "").startswith("❌"):
+                    with errors.get_lock():
+                        errors.value += 1
+            if latency:
+                await asyncio.sleep(latency)
+            result = json.dumps({"ok": True, "result": fake._result(api_method, params)}).encode()
+            return 200, result, {"Content-Type": "application/json"}
+
+    async def serve():
+        server = FakeBotAPI("127.0.0.1", port)
+        await server.start()
+        await asyncio.Event().wait()
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    asyncio.run(serve())
+
+
+async def post_all(port: int, updates: list, stats: dict):
+    """Отправляет обновления по одному keep-alive соединению; на 503 повторяет, как Telegram."""
+    client = Client(port, "/telegram")
+    for body in updates:
+        while True:
+            try:
+                status = await client.post(body, secret=SECRET)
+            except (ConnectionError, asyncio.IncompleteReadError, IndexError):
+                await client.close()
+                await asyncio.sleep(0.1)
+                continue
+            if status != 503:
+                break
+            stats["503"] += 1
+            await asyncio.sleep(0.01)
+        assert status == 200, f"неожиданный ответ {status}"
+    await client.close()
+
+
+def form_updates(user_ids, connections: int) -> list:
+    """Обновления по соединениям: пользователи соединения заполняют анкету вперемешку."""
+    lanes = []
+    for lane in range(connections):
+        users = user_ids[lane::connections]
+        lanes.append([json.dumps(make_update(user_id, text)).encode() for text in FORM_ANSWERS for user_id in users])
+    return lanes
+
+
+async def wait_counter(counter, target: int, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while counter.value < target:
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.005)
+    return True
+
+
+async def drive(port: int, workers: int, users: int, connections: int, sent, timeout: float) -> dict:
+    # Прогрев: по пользователю на обработчик — процессы запущены, кэши и соединения готовы
+    warmup = list(range(1, workers + 1))
+    stats = {"503": 0}
+    await asyncio.gather(*(post_all(port, lane, stats) for lane in form_updates(warmup, len(warmup))))
+    if not await wait_counter(sent, len(warmup) * REPLIES_PER_FORM, timeout):
+        raise RuntimeError("бот не ответил на прогрев")
+
+    user_ids = list(range(1_000_000, 1_000_000 + users))
+    lanes = form_updates(user_ids, connections)
+    target = sent.value + users * REPLIES_PER_FORM
+    started = time.monotonic()
+    await asyncio.gather(*(post_all(port, lane, stats) for lane in lanes))
+    posted = time.monotonic() - started
+    done = await wait_counter(sent, target, timeout)
+    elapsed = time.monotonic() - started
+    return {
+        "updates": users * len(FORM_ANSWERS),
+        "posted_seconds": round(posted, 2),
+        "seconds": round(elapsed, 2),
+        "complete": done,
+        "rejected_503": stats["503"],
+        "warmup_users": len(warmup),
+    }
+
+
+def wait_port(port: int, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"бот завершился с кодом {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("бот не начал слушать порт")
+
+
+def run_case(workers: int, users: int, connections: int, api_procs: int, latency: float, timeout: float) -> dict:
+    workdir = tempfile.mkdtemp()
+    api_port, front_port = free_port(), free_port()
+    sent, errors = multiprocessing.Value("q", 0), multiprocessing.Value("q", 0)
+    api = [multiprocessing.Process(target=api_process, args=(api_port, sent, errors, latency)) for _ in range(api_procs)]
+    for process in api:
+        process.start()
+
+    env = {
+        **os.environ,
+        "TELEGRAM_TOKEN": FAKE_TOKEN,
+        "BOT_MODE": "webhook",
+        "BOT_WORKERS": str(workers),
+        "BOT_WORKER_BASE_PORT": str(free_port(workers)),
+        "BOT_API_URL": f"http://127.0.0.1:{api_port}",
+        "WEBHOOK_URL": "",
+        "WEBHOOK_LISTEN": "127.0.0.1",
+        "WEBHOOK_PORT": str(front_port),
+        "WEBHOOK_SECRET": SECRET,
+        "METRICS_PORT": "0",
+    }
+    bot = subprocess.Popen(
+        [sys.executable, BOT_FILE], cwd=workdir, env=env,
+        stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, "bot.log"), "w"),
+    )
+    try:
+        wait_port(front_port, bot, timeout)
+        result = asyncio.run(drive(front_port, workers, users, connections, sent, timeout))
+    finally:
+        bot.send_signal(signal.SIGTERM)
+        bot.wait(timeout)
+        for process in api:
+            process.terminate()
+            process.join()
+
+    with sqlite3.connect(os.path.join(workdir, "hr_bot.db")) as conn:
+        saved = conn.execute("SELECT COUNT(DISTINCT user_id) FROM applicants").fetchone()[0]
+    result.update(workers=workers, saved=saved - result["warmup_users"], input_errors=errors.value, workdir=workdir)
+    result["updates_per_second"] = round(result["updates"] / result["seconds"], 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="значения BOT_WORKERS")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--connections", type=int, default=40, help="соединений к webhook (у Telegram по умолчанию 40)")
+    parser.add_argument("--api-procs", type=int, default=2, help="процессов заглушки Bot API")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа заглушки Bot API, с")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    print(f"Ядер процессора: {os.cpu_count()}")
+    results = []
+    for workers in args.workers:
+        result = run_case(workers, args.users, args.connections, args.api_procs, args.latency, args.timeout)
+        results.append(result)
+        speedup = result["updates_per_second"] / results[0]["updates_per_second"]
+        linear = workers / results[0]["workers"]
+        print(
+            f"BOT_WORKERS={workers:>2}: {result['updates_per_second']:>8.1f} обновл./с, {result['seconds']:.2f} с, "
+            f"ускорение ×{speedup:.2f} (линейное ×{linear:.0f}, эффективность {speedup / linear:.0%}), "
+            f"анкет {result['saved']}/{args.users}, ошибок ввода {result['input_errors']}, 503: {result['rejected_503']}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    ok = all(r["complete"] and r["saved"] == args.users and not r["input_errors"] for r in results)
+    print("OK" if ok else "ОШИБКА (журнал бота — bot.log в workdir из --json)")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()